@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+
+"""
+capture.py
+
+Capture Dastard's triggered-record stream (data port = base port + 2) into a local HDF5 file,
+without involving Dastard's own LJH/OFF writers. Useful for a quick raw capture, or to save
+data on a remote dcom computer.
+
+One thread receives records into a bounded queue; a dedicated writer thread appends them in
+batches to chunked, compressed, per-channel datasets, and closes the file when told to stop.
+If the writer falls behind and the queue fills, whole batches are dropped (and counted) rather
+than blocking the receiver.
+
+File layout: one group per channel index, named by the index (e.g. "/17"), with attribute
+"name" when channel names are known. Each group has datasets "records" (nrecords x nsamples)
+and "headers" (record_stream.RECORD_HEADER_DTYPE). If the record length changes during a
+capture, the new length goes into "records_<nsamples>" and "headers_<nsamples>".
+
+usage:
+
+python -m dastardcommander.capture output.hdf5 [--host localhost] [--port 5500] [--seconds 10]
+"""
+
+import argparse
+import queue
+import threading
+import time
+
+import h5py
+import numpy as np
+
+from . import record_stream
+
+
+class RecordCapture:
+    """Capture records from a running Dastard to an HDF5 file.
+
+    Usage:
+        cap = RecordCapture("capture.hdf5", host, baseport, channel_names)
+        cap.start()
+        ...
+        print(cap.report())
+        cap.stop()
+    """
+
+    stop_timeout = 30.0  # seconds to wait in stop() for the writer to write what is queued
+
+    def __init__(self, filename, host="localhost", baseport=5500, channel_names=None,
+                 max_queued_batches=256, write_batch=64, chunk_records=64, compression="lzf"):
+        self.filename = filename
+        self.host = host
+        self.baseport = baseport
+        self.channel_names = channel_names
+        self.queue = queue.Queue(maxsize=max_queued_batches)
+        self.write_batch = write_batch
+        self.chunk_records = chunk_records
+        self.compression = compression
+        self.running = False
+        self.abort = False
+        self.receiver = None
+        self.writer = None
+        self.h5 = None
+        self.datasets = {}
+        self.pending = {}
+        self.records_received = 0
+        self.records_dropped = 0
+        self.records_written = 0
+        self.bytes_written = 0
+        self.tstart = None
+        self.tstop = None
+        self.error = None
+
+    def start(self):
+        self.h5 = h5py.File(self.filename, "w")
+        self.h5.attrs["source"] = f"tcp://{self.host}:{self.baseport + 2}"
+        self.h5.attrs["start_time"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        self.running = True
+        self.tstart = time.time()
+        self.writer = threading.Thread(target=self._write_loop, name="capture-writer", daemon=True)
+        self.receiver = threading.Thread(target=self._receive_loop, name="capture-receiver", daemon=True)
+        self.writer.start()
+        self.receiver.start()
+
+    def stop(self):
+        """Stop receiving, and wait for the writer to write everything still queued and close the
+        file. If that takes over `stop_timeout`, the writer abandons what remains (counting it as
+        dropped) and closes the file as soon as its current write finishes."""
+        if self.receiver is None:
+            return
+        self.running = False
+        self.receiver.join()
+        # Tell the writer to flush and finish. If it died on an error, nothing drains the queue
+        # any more, so don't wait for room in it.
+        while self.writer.is_alive():
+            try:
+                self.queue.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        self.writer.join(timeout=self.stop_timeout)
+        if self.writer.is_alive():
+            print(f"RecordCapture writer did not finish within {self.stop_timeout} s; abandoning queued records")
+            self.abort = True
+            self.writer.join()
+        self.receiver = self.writer = None
+        self.tstop = time.time()
+
+    def _receive_loop(self):
+        sub = record_stream.RecordSubscriber(self.host, self.baseport)
+        try:
+            while self.running:
+                batch = sub.recv_batch(timeout_ms=100)
+                if len(batch) == 0:
+                    continue
+                self.records_received += len(batch)
+                try:
+                    self.queue.put_nowait(batch)
+                except queue.Full:
+                    self.records_dropped += len(batch)
+        finally:
+            sub.close()
+
+    def _write_loop(self):
+        """Write queued batches until stopped, then close the file. Once started, only this
+        thread touches the file."""
+        try:
+            self._write_until_stopped()
+        except Exception as e:
+            self.error = e
+            print(f"RecordCapture writer error: {e}")
+            self.running = False
+        finally:
+            self._close()
+
+    def _write_until_stopped(self):
+        lastflush = time.time()
+        while not self.abort:
+            try:
+                batch = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                batch = []
+            if batch is None:
+                self._flush(True)
+                return
+            self._stage(batch)
+            # Write any channel with a full batch, and everything else at least once a second.
+            force = time.time() - lastflush > 1.0
+            self._flush(force)
+            if force:
+                lastflush = time.time()
+
+    def _close(self):
+        if self.abort:
+            abandoned = sum(len(r) for _, r in self.pending.values())
+            while True:
+                try:
+                    batch = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if batch is not None:
+                    abandoned += len(batch)
+            self.records_dropped += abandoned
+        try:
+            try:
+                self.h5.attrs["records_dropped"] = self.records_dropped
+            finally:
+                self.h5.close()
+        except Exception as e:
+            print(f"RecordCapture could not close {self.filename}: {e}")
+
+    def _stage(self, batch):
+        """Decode a batch and sort its records into per-(channel, length) lists awaiting a write."""
+        if len(batch) == 0:
+            return
+        headers, records = record_stream.decode_records(batch)
+        groups = {}
+        for i, key in enumerate(zip(headers["chan"].tolist(), headers["nsamples"].tolist())):
+            groups.setdefault(key, []).append(i)
+        for key, idx in groups.items():
+            h, r = self.pending.setdefault(key, ([], []))
+            h.append(headers[idx])
+            r.extend(records[i] for i in idx)
+
+    def _flush(self, force=False):
+        for key, (h, r) in self.pending.items():
+            if self.abort:
+                return
+            if len(r) == 0 or (len(r) < self.write_batch and not force):
+                continue
+            headers = np.concatenate(h)
+            data = np.vstack(r)
+            self._append(key, headers, data)
+            self.pending[key] = ([], [])
+
+    def _append(self, key, headers, data):
+        if key not in self.datasets:
+            self.datasets[key] = self._create_datasets(*key, data.dtype)
+        hds, rds = self.datasets[key]
+        n0 = rds.shape[0]
+        n = len(data)
+        rds.resize(n0 + n, axis=0)
+        rds[n0:] = data
+        hds.resize(n0 + n, axis=0)
+        hds[n0:] = headers
+        self.records_written += n
+        self.bytes_written += data.nbytes
+
+    def _create_datasets(self, chan, nsamples, dtype):
+        name = str(chan)
+        if name in self.h5:
+            group = self.h5[name]
+        else:
+            group = self.h5.create_group(name)
+            if self.channel_names is not None and chan < len(self.channel_names):
+                group.attrs["name"] = self.channel_names[chan]
+        suffix = ""
+        if "records" in group and group["records"].shape[1] != nsamples:
+            suffix = f"_{nsamples}"
+        rds = group.create_dataset(f"records{suffix}", shape=(0, nsamples), maxshape=(None, nsamples),
+                                   dtype=dtype, chunks=(self.chunk_records, nsamples),
+                                   compression=self.compression, shuffle=True)
+        hds = group.create_dataset(f"headers{suffix}", shape=(0,), maxshape=(None,),
+                                   dtype=record_stream.RECORD_HEADER_DTYPE, chunks=(self.chunk_records,))
+        return hds, rds
+
+    @property
+    def elapsed(self):
+        if self.tstart is None:
+            return 0.0
+        end = self.tstop if self.tstop is not None else time.time()
+        return end - self.tstart
+
+    @property
+    def mb_per_second(self):
+        """Sustained rate of raw record data written to disk, in MB/s."""
+        t = self.elapsed
+        if t <= 0:
+            return 0.0
+        return self.bytes_written / t / 1e6
+
+    def report(self):
+        return (f"{self.records_written} records written ({self.mb_per_second:.2f} MB/s), "
+                f"{self.records_dropped} dropped, {self.queue.qsize()} batches queued")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Capture Dastard's record stream to an HDF5 file")
+    parser.add_argument("filename")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=5500, help="Dastard base port (records are on port+2)")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    args = parser.parse_args()
+
+    cap = RecordCapture(args.filename, args.host, args.port)
+    cap.start()
+    try:
+        tend = time.time() + args.seconds
+        while time.time() < tend and cap.running:
+            time.sleep(1)
+            print(cap.report())
+    except KeyboardInterrupt:
+        pass
+    cap.stop()
+    print(f"Capture to {args.filename} finished: {cap.report()}")
+
+
+if __name__ == "__main__":
+    main()
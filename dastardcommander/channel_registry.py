@@ -0,0 +1,175 @@
+"""
+channel_registry.py
+
+One shared description of Dastard's channels, rebuilt once per CHANNELNAMES message, so that
+the tabs and helpers of dcom can look channels up without rescanning the list of names.
+Nothing here depends on Qt.
+
+Channel names are a prefix followed by a channel number, such as "chan12" (a signal channel)
+or "err12" (a TDM error channel). The index of a channel is its position in the CHANNELNAMES
+list, which is how Dastard's RPC calls identify it.
+
+Long lists of channel numbers are written in run-length range notation, such as "1-512,600-700"
+(see `format_ranges` and `parse_ranges`).
+"""
+
+import re
+
+import numpy as np
+
+RANGE_PATTERN = re.compile(r"^(\d+)(?:-(\d+))?$")
+
+# Dastard's record stream carries channel indices as uint16, so no channel number is larger.
+MAX_CHANNEL_NUMBER = 65535
+
+
+class ChannelRegistry:
+    """Name, number, and index lookups for the current list of channel names.
+
+    The containers `names` (list), `prefixes` (set), and `numberToIndex` (dict of signal channel
+    number -> index) are updated in place, so objects holding a reference to them stay current.
+
+    >>> reg = ChannelRegistry(["err1", "chan1", "err2", "chan2", "err5", "chan5"])
+    >>> reg.index["chan5"], reg.numberToIndex[2], sorted(reg.prefixes)
+    (5, 3, ['chan', 'err'])
+    >>> reg.indices("chan", [5, 1, 3]).tolist()
+    [5, 1, -1]
+    >>> reg.prefixIndices["err"].tolist(), reg.numbers[reg.signalIndices].tolist()
+    ([0, 2, 4], [1, 2, 5])
+    >>> reg.isSignal.tolist()
+    [False, True, False, True, False, True]
+    """
+
+    signalPrefix = "chan"
+
+    def __init__(self, names=()):
+        self.names = []
+        self.prefixes = set()
+        self.numberToIndex = {}
+        self.generation = 0
+        self.update(names)
+
+    def update(self, names):
+        """Rebuild every lookup for a new list of channel names."""
+        self.names[:] = list(names)
+        self.prefixes.clear()
+        self.numberToIndex.clear()
+        self.index = {name: i for i, name in enumerate(self.names)}
+        n = len(self.names)
+        self.prefixOf = []
+        self.numbers = np.full(n, -1, dtype=np.int64)
+        for i, name in enumerate(self.names):
+            prefix = name.rstrip("1234567890")
+            self.prefixOf.append(prefix)
+            self.prefixes.add(prefix)
+            if len(prefix) < len(name):
+                self.numbers[i] = int(name[len(prefix):])
+        prefixOf = np.array(self.prefixOf, dtype=object)
+        self.prefixIndices = {p: np.nonzero(prefixOf == p)[0] for p in self.prefixes}
+
+        # For each prefix, an array from channel number to index (-1 where there is no such channel)
+        self._numberLookup = {}
+        for p, idx in self.prefixIndices.items():
+            nums = self.numbers[idx]
+            lookup = np.full(max(0, nums.max(initial=-1)) + 1, -1, dtype=np.int64)
+            ok = nums >= 0
+            lookup[nums[ok]] = idx[ok]
+            self._numberLookup[p] = lookup
+
+        self.isSignal = np.zeros(n, dtype=bool)
+        self.signalIndices = self.prefixIndices.get(self.signalPrefix, np.zeros(0, dtype=np.int64))
+        self.isSignal[self.signalIndices] = True
+        self.numberToIndex.update(zip(self.numbers[self.signalIndices].tolist(), self.signalIndices.tolist()))
+        self.generation += 1
+
+    def __len__(self):
+        return len(self.names)
+
+    def indices(self, prefix, numbers):
+        """Return an array of the channel indices of `prefix` + each of `numbers` (-1 where unknown)."""
+        numbers = np.asarray(numbers, dtype=np.int64)
+        lookup = self._numberLookup.get(prefix)
+        result = np.full(len(numbers), -1, dtype=np.int64)
+        if lookup is None:
+            return result
+        ok = (numbers >= 0) & (numbers < len(lookup))
+        result[ok] = lookup[numbers[ok]]
+        return result
+
+    def maxNumber(self, prefix):
+        """Return the largest channel number that exists with `prefix` (-1 if there are none)."""
+        return len(self._numberLookup.get(prefix, ())) - 1
+
+    def numbersOf(self, prefix):
+        """Return the sorted channel numbers that exist with `prefix`."""
+        return np.sort(self.numbers[self.prefixIndices.get(prefix, np.zeros(0, dtype=np.int64))])
+
+
+def format_ranges(numbers, sep=","):
+    """Return a string listing the sorted, unique `numbers`, with each run of 3 or more
+    consecutive values written as "first-last".
+
+    >>> format_ranges([7, 1, 2, 3, 4, 10, 11, 13, 3])
+    '1-4,7,10,11,13'
+    >>> format_ranges([])
+    ''
+    """
+    numbers = np.unique(np.asarray(numbers, dtype=np.int64))
+    if len(numbers) == 0:
+        return ""
+    breaks = np.nonzero(np.diff(numbers) != 1)[0]
+    firsts = numbers[np.concatenate(([0], breaks + 1))].tolist()
+    lasts = numbers[np.concatenate((breaks, [len(numbers) - 1]))].tolist()
+    words = []
+    for a, b in zip(firsts, lasts):
+        if b - a >= 2:
+            words.append(f"{a}-{b}")
+        else:
+            words.extend(str(x) for x in range(a, b + 1))
+    return sep.join(words)
+
+
+def parse_ranges(text, maximum=MAX_CHANNEL_NUMBER):
+    """Parse numbers and "first-last" ranges separated by commas and/or whitespace.
+
+    Returns (numbers, bad): an int array of all numbers in the order written (ranges expanded,
+    duplicates kept), and a list of the words that could not be parsed. Ranges are clipped to
+    `maximum` before they are expanded (so a typo cannot expand to billions of numbers), and the
+    part of each word beyond it is reported as bad. Use maximum=None for no limit.
+
+    >>> numbers, bad = parse_ranges("5, 1-3,,9-7 x")
+    >>> numbers.tolist(), bad
+    ([5, 1, 2, 3, 7, 8, 9], ['x'])
+    >>> numbers, bad = parse_ranges("3-4000000000 1 12", maximum=6)
+    >>> numbers.tolist(), bad
+    ([3, 4, 5, 6, 1], ['7-4000000000', '12'])
+    """
+    firsts, lasts, bad = [], [], []
+    for word in text.replace(",", " ").split():
+        m = RANGE_PATTERN.match(word)
+        if m is None:
+            bad.append(word)
+            continue
+        a = int(m.group(1))
+        b = a if m.group(2) is None else int(m.group(2))
+        a, b = min(a, b), max(a, b)
+        if maximum is not None and b > maximum:
+            if a > maximum:
+                bad.append(word)
+                continue
+            bad.append(str(maximum + 1) if b == maximum + 1 else f"{maximum + 1}-{b}")
+            b = maximum
+        firsts.append(a)
+        lasts.append(b)
+    if len(firsts) == 0:
+        return np.zeros(0, dtype=np.int64), bad
+    firsts = np.array(firsts, dtype=np.int64)
+    lengths = np.array(lasts, dtype=np.int64) - firsts + 1
+    # Expand all ranges at once: each output value is its range's first value plus its offset in the range.
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(firsts, lengths) + offsets, bad
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -1,10 +1,11 @@
 import os
-import time
 import numpy as np
 import struct
 import PyQt5
 from PyQt5 import QtCore, QtWidgets, QtGui
 from PyQt5.QtCore import pyqtSlot, pyqtSignal
+from . import record_pipeline
+from . import rpc_client
 from . import status_monitor
 
 
@@ -13,11 +14,13 @@ class LevelTrigConfig(QtWidgets.QDialog):
     A QDialog box that helps the user to configure level trigger settings for each channel.
 
     First the user says whether pulses are positive- or negative-going and how far from the
-    baseline the trigger should be set.
+    baseline the trigger should be set: either one level threshold for all channels, or a
+    multiple of each channel's own noise.
 
     Then after user pushes "Start", auto triggers are turned on, the baseline levels for each
     channel are estimated, and then auto triggers are turned off and the level triggers are
-    turned on.
+    turned on. The noise of each channel is estimated from the pretrigger samples of the same
+    autotriggered records.
     """
 
     header_fmt = "<HBBIIffQQ"
@@ -25,6 +28,10 @@ class LevelTrigConfig(QtWidgets.QDialog):
 
     dataComplete = pyqtSignal()
 
+    # With at least this many channels, decode records in a pool of worker processes
+    # (see record_pipeline.py) instead of one record at a time in the GUI thread.
+    pipelineMinChannels = 512
+
     def __init__(self, parent=None):
         self.dcom = parent
         QtWidgets.QDialog.__init__(self, parent)
@@ -35,7 +42,14 @@ class LevelTrigConfig(QtWidgets.QDialog):
         self.textBrowser.setReadOnly(True)
         self.zmqlistener = None
         self.zmqthread = None
+        self.pipeline = None
+        self.pipelineTimer = None
+        self.pipelineBaselines = None
+        self.pipelineNoise = None
+        self.uploader = None
+        self.uploadThread = None
         self.startButton.clicked.connect(self.startConfiguration)
+        self.noiseCheckBox.toggled.connect(self.noiseSpinBox.setEnabled)
         self.dataComplete.connect(self.finishConfiguration)
 
     @pyqtSlot()
@@ -47,13 +61,19 @@ class LevelTrigConfig(QtWidgets.QDialog):
         self.positivePulseButton.setDisabled(True)
         self.negativePulseButton.setDisabled(True)
         self.levelSpinBox.setDisabled(True)
+        self.toleranceSpinBox.setDisabled(True)
+        self.noiseCheckBox.setDisabled(True)
+        self.noiseSpinBox.setDisabled(True)
         self.startButton.setDisabled(True)
 
         threshold = self.levelSpinBox.value()
         self.recordsPerChan = 40
 
         self.cursor = self.textBrowser.textCursor()
-        self.cursor.insertText(f"Configuring level triggers at (baseline{threshold:+d}) ...\n")
+        level = f"baseline{threshold:+d}"
+        if self.noiseCheckBox.isChecked():
+            level = f"baseline + {self.noiseSpinBox.value():.1f} x noise"
+        self.cursor.insertText(f"Configuring level triggers at ({level}) ...\n")
         self.save_quiet = "TRIGGER" in self.dcom.quietTopics
         if not self.save_quiet:
             self.dcom.quietTopics.add("TRIGGER")
@@ -77,6 +97,9 @@ class LevelTrigConfig(QtWidgets.QDialog):
 
     def launchRecordMonitor(self, channels_to_configure):
         positive = self.positivePulseButton.isChecked()
+        if len(channels_to_configure) >= self.pipelineMinChannels:
+            self.launchRecordPipeline(channels_to_configure, positive)
+            return
         self.channels_seen = {
             id: BaselineFinder(positive, self.recordsPerChan) for id in channels_to_configure
         }
@@ -90,6 +113,74 @@ class LevelTrigConfig(QtWidgets.QDialog):
         self.zmqthread.started.connect(self.zmqlistener.data_monitor_loop)
         QtCore.QTimer.singleShot(0, self.zmqthread.start)
 
+    def launchRecordPipeline(self, channels_to_configure, positive):
+        """Find baselines in a pool of worker processes, polling them for progress on a timer."""
+        self.channels_to_configure = channels_to_configure
+        self.progressBar.setMaximum(self.recordsPerChan * len(channels_to_configure))
+        consumer = record_pipeline.BaselineConsumer(len(self.dcom.channel_names), positive, self.recordsPerChan)
+        self.pipeline = record_pipeline.RecordPipeline(
+            self.dcom.host, self.dcom.port, channels_to_configure, consumers=[consumer]
+        )
+        self.pipeline.start()
+        self.cursor.insertText(f"   (using {self.pipeline.nworkers} worker processes)\n")
+        self.pipelineTimer = QtCore.QTimer(self)
+        self.pipelineTimer.timeout.connect(self.pollRecordPipeline)
+        self.pipelineTimer.start(500)
+
+    @pyqtSlot()
+    def pollRecordPipeline(self):
+        try:
+            consumers = self.pipeline.collect()
+        except Exception as e:
+            print(f"Error collecting baselines from record workers: {e}")
+            return
+        if consumers is None:
+            return  # not every worker has replied yet
+        (consumer,) = consumers
+        self.progressBar.setValue(consumer.progress(self.channels_to_configure))
+        if consumer.completed(self.channels_to_configure).all():
+            self.stopRecordPipeline()
+            self.pipelineBaselines = consumer.baselines(self.channels_to_configure)
+            self.pipelineNoise = consumer.noise(self.channels_to_configure)
+            self.dataComplete.emit()
+
+    def stopRecordPipeline(self):
+        if self.pipelineTimer is not None:
+            self.pipelineTimer.stop()
+            self.pipelineTimer = None
+        if self.pipeline is not None:
+            self.pipeline.stop()
+            self.pipeline = None
+
+    def baselines(self):
+        """Return a dict mapping channel index to estimated baseline."""
+        if self.pipelineBaselines is not None:
+            return self.pipelineBaselines
+        return {idx: blf.baseline() for idx, blf in self.channels_seen.items()}
+
+    def noise(self):
+        """Return a dict mapping channel index to estimated noise (standard deviation)."""
+        if self.pipelineNoise is not None:
+            return self.pipelineNoise
+        return {idx: blf.noise() for idx, blf in self.channels_seen.items()}
+
+    def thresholds(self):
+        """Return the threshold (level relative to baseline), either one number for all channels,
+        or a dict mapping channel index to threshold when they are set from the noise."""
+        sign = 1 if self.positivePulseButton.isChecked() else -1
+        if not self.noiseCheckBox.isChecked():
+            return sign * self.levelSpinBox.value()
+        noise = self.noise()
+        if len(noise) == 0:
+            return {}
+        sigmas = np.fromiter(noise.values(), dtype=float, count=len(noise))
+        k = self.noiseSpinBox.value()
+        # At least 1 unit, so a channel with no measurable noise does not trigger on its baseline.
+        thresholds = sign * np.maximum(1.0, k * sigmas)
+        self.cursor.insertText(f"   Noise: median {np.median(sigmas):.2f}, range {sigmas.min():.2f} to "
+                               f"{sigmas.max():.2f}; thresholds {k:.1f} x noise.\n")
+        return dict(zip(noise.keys(), thresholds.tolist()))
+
     @pyqtSlot()
     def finishConfiguration(self):
         """This slot is called when enough data has been collected to estimate all baselines.
@@ -100,24 +191,35 @@ class LevelTrigConfig(QtWidgets.QDialog):
         # 4) Set level triggers (but turn them off first)
         self.cursor.insertText("4) Done with baseline data.  Stopping all triggers.\n")
         self.turnOffAllTriggers()
-        self.cursor.insertText("5) Sending all level triggers\n")
         positive = self.positivePulseButton.isChecked()
-        threshold = self.levelSpinBox.value()
-        if not positive:
-            threshold = -threshold
-        for idx, blf in self.channels_seen.items():
-            level = int(0.5 + blf.baseline() + threshold)
-            ts = {
-                "ChannelIndices": [idx],
-                "AutoTrigger": False,
-                "EdgeTrigger": False,
-                "LevelTrigger": True,
-                "LevelRising": positive,
-                "LevelLevel": level,
-            }
-            self.dcom.client.call("SourceControl.ConfigureTriggers", ts)
-            time.sleep(0.01)
-
+        groups = groupChannelsByLevel(self.baselines(), self.thresholds(), self.toleranceSpinBox.value())
+        requests = [{
+            "ChannelIndices": channels,
+            "AutoTrigger": False,
+            "EdgeTrigger": False,
+            "LevelTrigger": True,
+            "LevelRising": positive,
+            "LevelLevel": level,
+        } for level, channels in groups]
+        nchan = sum(len(r["ChannelIndices"]) for r in requests)
+        self.cursor.insertText(f"5) Sending level triggers for {nchan} channels ({len(requests)} distinct levels)\n")
+
+        # Send from a QThread, so the GUI (and its heartbeat) keep running.
+        self.progressBar.setMaximum(max(1, nchan))
+        self.progressBar.setValue(0)
+        self.uploadThread = QtCore.QThread()
+        self.uploader = LevelTriggerUploader(self.dcom.host, self.dcom.port, requests)
+        self.uploader.moveToThread(self.uploadThread)
+        self.uploader.progress.connect(self.progressBar.setValue)
+        self.uploader.finished.connect(self.uploadFinished)
+        self.uploader.finished.connect(self.uploadThread.quit)
+        self.uploadThread.started.connect(self.uploader.run)
+        self.uploadThread.start()
+
+    @pyqtSlot(int, str)
+    def uploadFinished(self, nfailed, error):
+        if nfailed > 0:
+            self.cursor.insertText(f"X  {nfailed} level trigger requests failed: {error}\n")
         if not self.save_quiet:
             delay = 5000  # ms
             QtCore.QTimer.singleShot(delay, self.endSilentTRIGGER)
@@ -130,7 +232,13 @@ class LevelTrigConfig(QtWidgets.QDialog):
 
     @pyqtSlot()
     def done(self, dialogCode):
-        """Cleanly close the zmqlistener before closing the dialog."""
+        """Cleanly close the zmqlistener (or worker processes) before closing the dialog."""
+        self.stopRecordPipeline()
+        if self.uploader is not None:
+            self.uploader.cancel = True
+        if self.uploadThread is not None:
+            self.uploadThread.quit()
+            self.uploadThread.wait()
         if self.zmqlistener is not None:
             self.zmqlistener.running = False
         if self.zmqthread is not None:
@@ -180,9 +288,10 @@ class LevelTrigConfig(QtWidgets.QDialog):
 
             typecode = values[2]
             data_fmt = self.data_fmt[typecode]
+            npresamples = values[3]
             # nsamp = values[4]
             data = np.frombuffer(data_message, dtype=data_fmt)
-            blf.newValues(data)
+            blf.newValues(data, npresamples)
             self.progressBar.setValue(self.progressBar.value() + 1)
             if blf.completed:
                 self.nchanIncomplete -= 1
@@ -194,6 +303,90 @@ class LevelTrigConfig(QtWidgets.QDialog):
             return
 
 
+def groupChannelsByLevel(baselines, threshold, tolerance=0):
+    """Return [(level, [channel indices]), ...]: the level trigger for each channel, grouped so that
+    one ConfigureTriggers request can set each group.
+
+    `baselines` maps channel index to baseline; each channel's level is its baseline plus
+    `threshold`, rounded. `threshold` is one number for all channels, or a dict mapping channel
+    index to threshold (channels missing from it are left out). With `tolerance` > 0, channels
+    whose levels differ by up to 2*tolerance share one level, which is within `tolerance` of each
+    channel's own level.
+
+    >>> baselines = {3: 100.2, 5: 100.4, 7: 103.0, 9: 90.0}
+    >>> groupChannelsByLevel(baselines, 10)
+    [(100, [9]), (110, [3, 5]), (113, [7])]
+    >>> groupChannelsByLevel(baselines, 10, tolerance=2)
+    [(100, [9]), (111, [3, 5, 7])]
+    >>> groupChannelsByLevel(baselines, {3: 5.0, 5: 12.5, 9: 20.3})
+    [(105, [3]), (110, [9]), (113, [5])]
+    """
+    if isinstance(threshold, dict):
+        baselines = {c: b for c, b in baselines.items() if c in threshold}
+        thresholds = np.fromiter((threshold[c] for c in baselines), dtype=float, count=len(baselines))
+    else:
+        thresholds = threshold
+    if len(baselines) == 0:
+        return []
+    channels = np.fromiter(baselines.keys(), dtype=np.int64, count=len(baselines))
+    levels = np.floor(np.fromiter(baselines.values(), dtype=float, count=len(baselines)) + thresholds + 0.5)
+    levels = levels.astype(np.int64)
+    order = np.lexsort((channels, levels))
+    channels, levels = channels[order], levels[order]
+
+    groups = []
+    i = 0
+    while i < len(levels):
+        j = np.searchsorted(levels, levels[i] + 2 * tolerance, side="right")
+        level = levels[i] + (levels[j - 1] - levels[i]) // 2
+        groups.append((int(level), channels[i:j].tolist()))
+        i = j
+    return groups
+
+
+class LevelTriggerUploader(QtCore.QObject):
+    """QObject that sends a list of ConfigureTriggers requests, to run in a QThread.
+
+    It opens its own connection to the Dastard RPC server: the main window's client is not
+    meant to be shared between threads.
+    """
+
+    progress = pyqtSignal(int)  # number of channels sent so far
+    finished = pyqtSignal(int, str)  # number of failed requests, and the last error
+
+    def __init__(self, host, port, requests):
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.requests = requests
+        self.cancel = False
+
+    @pyqtSlot()
+    def run(self):
+        nfailed, error = 0, ""
+        try:
+            client = rpc_client.JSONClient((self.host, self.port))
+        except OSError as e:
+            self.finished.emit(len(self.requests), str(e))
+            return
+        nsent = 0
+        for request in self.requests:
+            if self.cancel:
+                break
+            try:
+                reply = client.call("SourceControl.ConfigureTriggers", request, verbose=False, errorBox=False)
+                if reply is None or reply[1] is not None:
+                    nfailed += 1
+                    error = "no reply" if reply is None else str(reply[1])
+            except Exception as e:
+                nfailed += 1
+                error = str(e)
+            nsent += len(request["ChannelIndices"])
+            self.progress.emit(nsent)
+        client.close()
+        self.finished.emit(nfailed, error)
+
+
 class BaselineFinder:
     """
     An object to estimate the baseline of a channel's data.
@@ -201,8 +394,9 @@ class BaselineFinder:
     Usage:
     * Call `bf=BaseLineFinder(positivePulses=True)` to set up a finder for positive-going pulses,
         or with the argument False for negative-going pulses.
-    * Call `bf.newValues(data)` to add a new data record `data` to the history.
+    * Call `bf.newValues(data, npresamples)` to add a new data record `data` to the history.
     * Call `B=bf.baseline()` to estimate the baseline and return it.
+    * Call `N=bf.noise()` to estimate the noise (standard deviation) and return it.
     * Check `bf.completed` to see if a sufficient amount of data has been acquired.
 
     Algorithm:
@@ -210,6 +404,9 @@ class BaselineFinder:
     `recordsRequired` optional argument), the answer is the lowest or highest median seen so far
     for positive- or negative-going pulses, respectively.
 
+        The noise is the median over the same records of the robust noise of each record's
+    pretrigger samples (see record_pipeline.pretrigger_noise).
+
         There might be a lot of room to improve this, but it seems like a sensible starting point.
     I want it to work well when we are able to stop pulses, but still work okay even when we aren't.
     My thinking is that if there are no pulses, min(median) will be only slightly biased to low values
@@ -222,11 +419,13 @@ class BaselineFinder:
         self.positivePulses = positivePulses
         self.recordsRequired = recordsRequired
         self.medians = []
+        self.sigmas = []
         self.completed = False
 
-    def newValues(self, data):
+    def newValues(self, data, npresamples=0):
         data = np.asarray(data, dtype=np.uint16)
         median = np.median(data)
+        self.sigmas.append(record_pipeline.pretrigger_noise(data, npresamples))
 
         if median > 65535 or median < 0:
             median %= 65536
@@ -240,3 +439,6 @@ class BaselineFinder:
         if self.positivePulses:
             return np.min(self.medians)
         return np.max(self.medians)
+
+    def noise(self):
+        return np.median(self.sigmas)
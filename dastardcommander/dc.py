@@ -26,20 +26,26 @@ import numpy as np
 # Qt5 imports
 import PyQt5.uic
 from PyQt5 import QtCore, QtGui, QtWidgets
-from PyQt5.QtCore import QSettings, pyqtSlot, QCoreApplication
+from PyQt5.QtCore import QSettings, pyqtSignal, pyqtSlot, QCoreApplication
 from PyQt5.QtWidgets import QFileDialog
 
 # User code imports
+from . import capture
+from . import channel_registry
 from . import configure_level_triggers
 from . import disable_hyperactive
+from . import hyperactive
 from . import rpc_client
 from . import status_monitor
 from . import special_channels
 from . import trigger_config
 from . import trigger_config_simple
+from . import trigger_states
 from . import writing
 from . import projectors
 from . import observe
+from . import record_stream
+from . import spectra
 from . import workflow
 
 try:
@@ -52,23 +58,14 @@ except ImportError:
 
 def csv2int_array(text, normalize=False):
     """Convert a string of numerical values separated by whitespace and/or commas to a list of int.
-    Any words that cannot be converted will be ignored.
+    Ranges such as "4-7" are expanded. Any words that cannot be converted will be ignored.
 
     If `normalize`, remove duplicates and sort the list numerically.
     """
-    array = []
-    words = text.replace(",", " ").split()
-    for w in words:
-        try:
-            array.append(int(w))
-        except ValueError:
-            pass
-
+    array, _ = channel_registry.parse_ranges(text)
     if normalize:
-        array = list(set(array))
-        array.sort()
-
-    return array
+        array = np.unique(array)
+    return array.tolist()
 
 
 # Here is how you try to import compiled UI files and fall back to processing them
@@ -88,6 +85,9 @@ QCoreApplication.setApplicationName("DastardCommander")
 
 
 class MainWindow(QtWidgets.QMainWindow):  # noqa: PLR0904
+    # Emitted with each TRIGGERRATE message, for anything that watches trigger rates as they arrive.
+    triggerRateReceived = pyqtSignal(object)
+
     def __init__(self, rpc_client, host, port, settings, parent=None):
         self.client = rpc_client
         self.client.setQtParent(self)
@@ -119,8 +119,17 @@ class MainWindow(QtWidgets.QMainWindow):  # noqa: PLR0904
         self.actionTDM_Autotune.triggered.connect(self.crateStartAndAutotune)
         self.actionLevel_Trig_Configure.triggered.connect(self.configLevelTrigs)
         self.actionDisable_Hyperactive_Chans.triggered.connect(self.disableHyperactive)
+        self.actionWatch_Hyperactive_Chans.toggled.connect(self.toggleHyperactiveWatch)
+        self.actionAuto_Block_Hyperactive_Chans.setChecked(settings.value("hyperactiveAutoBlock", False, type=bool))
+        self.actionAuto_Block_Hyperactive_Chans.toggled.connect(
+            lambda on: self.settings.setValue("hyperactiveAutoBlock", on))
+        self.actionHyperactive_Watch_Factor.triggered.connect(self.setHyperactiveWatchFactor)
         self.actionLoad_Disabled_Invert_Chan.triggered.connect(self.loadSpecialChanList)
         self.actionSave_Disabled_Invert_Chan.triggered.connect(self.saveSpecialChanList)
+        self.actionMonitor_Record_Drops.toggled.connect(self.toggleRecordDropMonitor)
+        self.actionLive_Spectra.triggered.connect(self.showSpectra)
+        self.actionCapture_Records.toggled.connect(self.toggleRecordCapture)
+        self.actionExport_Rate_History.triggered.connect(self.exportRateHistory)
         self.pushButton_sendEdgeMulti.clicked.connect(self.sendEdgeMulti)
         self.pushButton_sendMix.clicked.connect(self.sendMix)
         self.pushButton_sendExperimentStateLabel.clicked.connect(
@@ -137,10 +146,16 @@ class MainWindow(QtWidgets.QMainWindow):  # noqa: PLR0904
         self.rows = 0
         self.streams = 0
         self.samplePeriod = 0
+        # Digest of the projectors/basis Dastard has, by channel index, so re-sends skip unchanged
+        # channels. Only valid for this Dastard, channel list, and record length.
+        self.projectorDigests = {}
+        self.projectorRecordLengths = None
         self.lanceroCheckBoxes = {}
         self.updateLanceroCardChoices()
         parallel = settings.value("parallelStream", True, type=bool)
         self.buildLanceroFiberBoxes(8, parallel)
+        # Clamp: a stored 0 (or negative) rate would divide by zero in CountRateMap.scheduleRender.
+        observe.CountRateMap.maxFPS = max(0.5, settings.value("observeMaxFPS", 5.0, type=float))
         self.triggerTab = trigger_config.TriggerConfig(None, self.client)
         self.tabTriggering.layout().addWidget(self.triggerTab)
 
@@ -160,24 +175,19 @@ class MainWindow(QtWidgets.QMainWindow):  # noqa: PLR0904
         self.writingTab = writing.WritingControl(None, host, self.client)
         self.tabWriting.layout().addWidget(self.writingTab)
 
-        self.observeWindow = observe.Observe(parent=None, host=host, client=self.client)
-        self.observeTab = observe.Observe(parent=None, host=host, client=self.client)
+        # One model does the work for every Observe view; the pop-out view is built on first use.
+        self.countRateModel = observe.CountRateModel()
+        self.observeTab = observe.Observe(parent=None, host=host, client=self.client, model=self.countRateModel)
+        self.observeWindow = None
         self.tabObserve.layout().addWidget(self.observeTab)
 
         # Create a SpecialChannels object for trigger blocker; let the relevant tabs/windows share access to it.
         self.triggerBlocker = special_channels.SpecialChannels(configName="blocked_channels")
         self.triggerTab.triggerBlocker = self.triggerBlocker
         self.triggerTabSimple.triggerBlocker = self.triggerBlocker
-        self.observeWindow.triggerBlocker = self.triggerBlocker
-        self.observeTab.triggerBlocker = self.triggerBlocker
-        cdb = self.triggerTab.clearDisabledButton
-        for tab in (self.triggerTab, self.observeTab):
-            cdb.clicked.connect(tab.pushedClearDisabled)
-        self.observeTab.blocklist_changed.connect(self.triggerTab.updateDisabledList)
-        self.observeTab.block_channel.connect(self.triggerTab.blockTriggering)
-        self.triggerTab.changedBlockList.connect(self.observeTab.updateDisabledCount)
+        self.triggerTab.clearDisabledButton.clicked.connect(self.triggerTab.pushedClearDisabled)
+        self.connectObserveView(self.observeTab)
         self.triggerTab.updateDisabledList()
-        self.lastTriggerRateMessage = (-1, {})
 
         self.workflowTab = workflow.Workflow(self, parent=self.tabWorkflow)
         self.workflowTab.projectorsLoadedSig.connect(
@@ -186,13 +196,15 @@ class MainWindow(QtWidgets.QMainWindow):  # noqa: PLR0904
 
         self.microscopes = []
         self.last_messages = defaultdict(str)
-        self.channel_names = []
-        self.channel_prefixes = set()
-        self.channel_indices = {}  # a map from channel number to index
-        self.triggerTabSimple.channel_indices = self.channel_indices
+        # One registry of channel names/numbers/indices, shared by all tabs and rebuilt on CHANNELNAMES.
+        self.channels = channel_registry.ChannelRegistry()
+        self.channel_names = self.channels.names
+        self.channel_prefixes = self.channels.prefixes
+        self.channel_indices = self.channels.numberToIndex  # a map from channel number to index
+        self.triggerTab.channels = self.channels
         self.triggerTab.channel_names = self.channel_names
-        self.observeTab.channel_names = self.channel_names
-        self.observeWindow.channel_names = self.channel_names
+        self.countRateModel.channels = self.channels
+        self.countRateModel.channel_names = self.channel_names
         self.triggerTab.channel_prefixes = self.channel_prefixes
         self.workflowTab.channel_names = self.channel_names
         self.workflowTab.channel_prefixes = self.channel_prefixes
@@ -210,6 +222,17 @@ class MainWindow(QtWidgets.QMainWindow):  # noqa: PLR0904
 
         self.quietTopics = {"TRIGGERRATE", "NUMBERWRITTEN", "EXTERNALTRIGGER", "DATADROP", "ALIVE"}
 
+        # Drops reported by the server (DATADROP messages) and those we find in the record stream.
+        self.nDataDropMessages = 0
+        self.dropDetector = record_stream.DropDetector()
+        self.hyperWatchdog = hyperactive.RateWatchdog(factor=settings.value("hyperactiveFactor", 10.0, type=float))
+        self.recordthread = None
+        self.recordlistener = None
+        self.spectraWindow = None  # built when first requested
+        self.recordCapture = None
+        self.captureTimer = QtCore.QTimer()
+        self.captureTimer.timeout.connect(self.updateCaptureLabel)
+
         # The ZMQ update monitor. Must run in its own QThread.
         self.nmsg = 0
         self.zmqthread = QtCore.QThread()
@@ -260,9 +283,11 @@ class MainWindow(QtWidgets.QMainWindow):  # noqa: PLR0904
             print(f"CurrentTime message: '{message}'")
 
         elif topic == "TRIGGERRATE":
-            self.observeTab.handleTriggerRateMessage(d)
-            self.observeWindow.handleTriggerRateMessage(d)
-            self.lastTriggerRateMessage = (self.nmsg, d)
+            self.countRateModel.handleTriggerRateMessage(d)
+            self.triggerRateReceived.emit(d)
+
+        elif topic == "DATADROP":
+            self.handleDataDropMessage(d)
 
         # All other messages are ignored if they haven't changed
         elif not self.last_messages[topic] == message:
@@ -276,6 +301,9 @@ class MainWindow(QtWidgets.QMainWindow):  # noqa: PLR0904
                     d["Nsamples"], d["Npresamp"]
                 )
                 self.workflowTab.handleStatusUpdate(d)
+                if self.projectorRecordLengths != (d["Nsamples"], d["Npresamp"]):
+                    self.projectorRecordLengths = (d["Nsamples"], d["Npresamp"])
+                    self.forgetSentProjectors()
 
                 source = d["SourceName"]
                 nchan = d["Nchannels"]
@@ -299,8 +327,7 @@ class MainWindow(QtWidgets.QMainWindow):  # noqa: PLR0904
                 else:
                     groups_info = None
                 self.updateStatusBar(is_running, source, groups_info)
-                self.observeTab.handleStatusUpdate(is_running, source, groups_info)
-                self.observeWindow.handleStatusUpdate(is_running, source, groups_info)
+                self.countRateModel.handleStatusUpdate(is_running, source, groups_info)
 
             elif topic == "TRIGGER":
                 self.triggerTab.handleTriggerMessage(d)
@@ -349,24 +376,23 @@ class MainWindow(QtWidgets.QMainWindow):  # noqa: PLR0904
                 if d["InvertChan"] is None:
                     invertText = ""
                 else:
-                    invertText = ", ".join([str(c) for c in d["InvertChan"]])
+                    invertText = channel_registry.format_ranges(d["InvertChan"], sep=", ")
                 self.invertedChanTextEdit.setPlainText(invertText)
                 # Always start out DISABLING the expert ability to change inverted channels
                 self.actionChange_Inverted_Chans.setChecked(False)
 
             elif topic == "CHANNELNAMES":
-                # Careful: don't replace the variable
-                self.channel_names[:] = []
-                self.channel_prefixes.clear()
-                self.channel_indices.clear()  # a map from channel numbers to indices
-                for index, name in enumerate(d):
-                    self.channel_names.append(name)
-                    prefix = name.rstrip("1234567890")
-                    self.channel_prefixes.add(prefix)
-                    if prefix == "chan":
-                        number = int(name[len(prefix):])
-                        self.channel_indices[number] = index
+                # Updates channel_names, channel_prefixes, and channel_indices in place
+                self.channels.update(d)
+                self.triggerTab.serverTriggerState.clear()  # indices may now mean other channels
+                self.forgetSentProjectors()
                 print("New channames: ", self.channel_names)
+                self.countRateModel.handleChannelNames()
+                if self.spectraWindow is not None:
+                    self.spectraWindow.handleChannelNames()
+                self.dropDetector.reset(len(self.channel_names))
+                self.hyperWatchdog.reset(len(self.channel_names))
+                self.updateHyperLabel()
                 if self.sourceIsTDM:
                     self.triggerTab.channelChooserBox.setCurrentIndex(2)
                 else:
@@ -381,17 +407,16 @@ class MainWindow(QtWidgets.QMainWindow):  # noqa: PLR0904
                 # self.workflowTab.handleNumberWritten(d)
 
             elif topic == "NEWDASTARD":
+                self.forgetSentProjectors()
                 if self.fullyConfigured:
                     self.fullyConfigured = False
                     self.closeReconnect("New Dastard started")
 
             elif topic == "TESMAP":
-                self.observeTab.handleTESMap(d)
-                self.observeWindow.handleTESMap(d)
+                self.countRateModel.handleTESMap(d)
 
             elif topic == "TESMAPFILE":
-                self.observeTab.handleTESMapFile(d)
-                self.observeWindow.handleTESMapFile(d)
+                self.countRateModel.handleTESMapFile(d)
 
             elif topic == "MIX":
                 # We only permit setting a single, common mix value from DC, so
@@ -404,12 +429,10 @@ class MainWindow(QtWidgets.QMainWindow):  # noqa: PLR0904
                     self.doubleSpinBox_MixFraction.setValue(0.0)
 
             elif topic == "EXTERNALTRIGGER":
-                self.observeTab.handleExternalTriggerMessage(d)
-                self.observeWindow.handleExternalTriggerMessage(d)
+                self.countRateModel.handleExternalTriggerMessage(d)
 
             elif topic == "STATELABEL":
-                self.observeTab.ExperimentStateIncrementer.updateLabel(d)
-                self.observeWindow.ExperimentStateIncrementer.updateLabel(d)
+                self.countRateModel.handleStateLabel(d)
 
             else:
                 print(f"{topic} is not a topic we handle yet.")
@@ -431,9 +454,18 @@ class MainWindow(QtWidgets.QMainWindow):  # noqa: PLR0904
     def buildStatusBar(self):
         self.statusMainLabel = QtWidgets.QLabel("Server not running. ")
         self.statusFreshLabel = QtWidgets.QLabel("")
+        self.statusDropLabel = QtWidgets.QLabel("")
+        self.statusDropLabel.setToolTip(
+            "Red: Dastard reported dropped data, or records arrived out of order.\n"
+            "Gaps between records mean dropped data only in noise mode (zero-delay autotriggers).")
+        self.statusCaptureLabel = QtWidgets.QLabel("")
+        self.statusHyperLabel = QtWidgets.QLabel("")
         sb = self.statusBar()
         sb.addWidget(self.statusMainLabel)
         sb.addWidget(self.statusFreshLabel)
+        sb.addWidget(self.statusDropLabel)
+        sb.addWidget(self.statusCaptureLabel)
+        sb.addWidget(self.statusHyperLabel)
 
     def updateStatusBar(self, is_running, source_name, group_info):
 
@@ -508,8 +540,175 @@ class MainWindow(QtWidgets.QMainWindow):  # noqa: PLR0904
         self.zmqlistener.running = False
         self.zmqthread.quit()
         self.zmqthread.wait()
+        self.stopRecordDropMonitor()
+        if self.spectraWindow is not None:
+            self.spectraWindow.close()
+        self.stopRecordCapture()
         event.accept()
-        self.observeWindow.hide()  # prevents close hanging due to still visible observeWindow
+        if self.observeWindow is not None:
+            self.observeWindow.hide()  # prevents close hanging due to still visible observeWindow
+
+    def handleDataDropMessage(self, d):
+        """Dastard reported dropped data. Count these reports alongside the record-stream drops."""
+        self.nDataDropMessages += 1
+        self.updateDropLabel()
+
+    def updateDropLabel(self):
+        parts = []
+        if self.nDataDropMessages > 0:
+            parts.append(f"{self.nDataDropMessages} server DATADROP msgs")
+        if self.recordlistener is not None:
+            parts.append(self.dropDetector.summary())
+        self.statusDropLabel.setText(";  ".join(parts))
+        # Gaps are only informational: they mean dropped data only when records are contiguous
+        # (noise mode), while with ordinary pulse triggers nearly every record starts a gap.
+        bad = self.nDataDropMessages > 0 or self.dropDetector.total_reversals > 0
+        color = "red" if bad else "green"
+        self.statusDropLabel.setStyleSheet(f"QLabel {{ color : {color}; }}")
+
+    @pyqtSlot(bool)
+    def toggleRecordDropMonitor(self, on):
+        if on:
+            self.startRecordDropMonitor()
+        else:
+            self.stopRecordDropMonitor()
+
+    def startRecordDropMonitor(self):
+        """Subscribe to the record stream in its own QThread and feed each batch to self.dropDetector."""
+        if self.recordlistener is not None:
+            return
+        self.dropDetector.reset(len(self.channel_names))
+        self.recordthread = QtCore.QThread()
+        self.recordlistener = status_monitor.ZMQListener(self.host, 1 + self.port)
+        self.recordlistener.recordbatch.connect(self.recordBatchReceived)
+        self.recordlistener.moveToThread(self.recordthread)
+        self.recordthread.started.connect(self.recordlistener.record_batch_loop)
+        # Start now, not from a zero-delay timer: a stop before the timer fired would drop our
+        # reference to a thread that the timer then starts.
+        self.recordthread.start()
+        self.updateDropLabel()
+
+    def stopRecordDropMonitor(self):
+        if self.recordlistener is None:
+            return
+        self.recordlistener.running = False
+        self.recordthread.quit()
+        self.recordthread.wait()
+        self.recordlistener = None
+        self.recordthread = None
+        print(f"Record drop monitor stopped: {self.dropDetector.summary()}")
+        self.updateDropLabel()
+
+    @pyqtSlot(object, object)
+    def recordBatchReceived(self, headers, _records):
+        self.dropDetector.update_headers(headers)
+        self.updateDropLabel()
+
+    @pyqtSlot(bool)
+    def toggleHyperactiveWatch(self, on):
+        if on:
+            self.hyperWatchdog.reset(len(self.channel_names))
+            self.triggerRateReceived.connect(self.watchTriggerRates)
+        else:
+            self.triggerRateReceived.disconnect(self.watchTriggerRates)
+        self.updateHyperLabel()
+
+    def setHyperactiveWatchFactor(self):
+        factor, okay = QtWidgets.QInputDialog.getDouble(
+            self, "Hyperactive watch factor",
+            "Flag channels this many robust standard deviations above the median rate:",
+            self.hyperWatchdog.factor, 1.0, 1000.0, 1)
+        if okay:
+            self.hyperWatchdog.factor = factor
+            self.settings.setValue("hyperactiveFactor", factor)
+
+    @pyqtSlot(object)
+    def watchTriggerRates(self, d):
+        """Feed one TRIGGERRATE message to the hyperactive watchdog; block what it flags, if asked to."""
+        if "CountsSeen" not in d or "Duration" not in d:
+            return
+        channels = self.channels
+        watched = channels.isSignal.copy()
+        blocked = channels.indices(channels.signalPrefix, self.triggerBlocker.special)
+        watched[blocked[blocked >= 0]] = False
+        flagged = self.hyperWatchdog.update(d["CountsSeen"], d["Duration"] / 1e9, watched)  # Duration is in ns
+        if len(flagged) == 0:
+            return
+        numbers = channels.numbers[flagged].tolist()
+        limit = self.hyperWatchdog.limit
+        print(f"Hyperactive watch: channels {channel_registry.format_ranges(numbers)} trigger above {limit:.2f}/s")
+        if self.actionAuto_Block_Hyperactive_Chans.isChecked():
+            self.triggerBlocker.add_chan_to_list(numbers)
+            self.triggerTab.blockChannels(flagged.tolist())
+            self.triggerTab.updateDisabledList()
+            self.triggerTab.changedBlockList.emit()
+        self.updateHyperLabel()
+
+    def updateHyperLabel(self):
+        if not self.actionWatch_Hyperactive_Chans.isChecked():
+            self.statusHyperLabel.setText("")
+            return
+        flagged = np.nonzero(self.hyperWatchdog.flagged)[0]
+        if len(flagged) == 0:
+            self.statusHyperLabel.setText("No hyperactive chans")
+            self.statusHyperLabel.setStyleSheet("QLabel { color : green; }")
+            return
+        numbers = channel_registry.format_ranges(self.channels.numbers[flagged])
+        self.statusHyperLabel.setText(f"{len(flagged)} hyperactive chans: {numbers}")
+        self.statusHyperLabel.setStyleSheet("QLabel { color : red; }")
+
+    @pyqtSlot(bool)
+    def toggleRecordCapture(self, on):
+        if not on:
+            self.stopRecordCapture()
+            return
+        filename, _ = QFileDialog.getSaveFileName(
+            self, "Capture records to HDF5 file", os.path.expanduser("~"), "HDF5 (*.hdf5 *.h5)")
+        if not filename:
+            self.actionCapture_Records.setChecked(False)
+            return
+        self.recordCapture = capture.RecordCapture(filename, self.host, self.port, list(self.channel_names))
+        self.recordCapture.start()
+        print(f"Capturing records to {filename}")
+        self.captureTimer.start(1000)
+
+    def stopRecordCapture(self):
+        if self.recordCapture is None:
+            return
+        self.captureTimer.stop()
+        self.recordCapture.stop()
+        print(f"Capture to {self.recordCapture.filename} finished: {self.recordCapture.report()}")
+        self.updateCaptureLabel()
+        self.recordCapture = None
+
+    @pyqtSlot()
+    def updateCaptureLabel(self):
+        cap = self.recordCapture
+        if cap is None:
+            self.statusCaptureLabel.setText("")
+            return
+        state = "Capturing" if cap.running else "Captured"
+        self.statusCaptureLabel.setText(
+            f"{state}: {cap.records_written} rec, {cap.mb_per_second:.2f} MB/s, {cap.records_dropped} dropped")
+        if cap.error is not None:
+            self.statusCaptureLabel.setText(f"Capture failed: {cap.error}")
+            self.actionCapture_Records.setChecked(False)
+
+    @pyqtSlot()
+    def exportRateHistory(self):
+        filename, _ = QFileDialog.getSaveFileName(
+            self, "Export trigger rate history", os.path.expanduser("~"), "HDF5 (*.hdf5 *.h5)")
+        if not filename:
+            return
+        self.countRateModel.history.save_hdf5(filename, list(self.channel_names))
+        print(f"Trigger rate history written to {filename}")
+
+    @pyqtSlot()
+    def showSpectra(self):
+        if self.spectraWindow is None:
+            self.spectraWindow = spectra.SpectraWindow(self)
+        self.spectraWindow.show()
+        self.spectraWindow.raise_()
 
     @pyqtSlot()
     def launchMicroscope(self):
@@ -1023,7 +1222,7 @@ class MainWindow(QtWidgets.QMainWindow):  # noqa: PLR0904
         # Read the invertedChan list. Normalize it by making the list contain only unique and sorted values.
         # Update the GUI with the normalized list
         invertedChannels = csv2int_array(self.invertedChanTextEdit.toPlainText(), normalize=True)
-        invertText = ", ".join([str(c) for c in invertedChannels])
+        invertText = channel_registry.format_ranges(invertedChannels, sep=", ")
         self.invertedChanTextEdit.setPlainText(invertText)
 
         if self.phasePosPulses.isChecked():
@@ -1085,6 +1284,11 @@ class MainWindow(QtWidgets.QMainWindow):  # noqa: PLR0904
             label = "No bias: [-.50, +.50]"
         self.biasTextLabel.setText(label)
 
+    def forgetSentProjectors(self):
+        """Forget which projectors Dastard has, so the next send uploads every channel. Replaces
+        the dict, so an upload still in progress cannot record into the new one."""
+        self.projectorDigests = {}
+
     @pyqtSlot()
     def loadProjectorsBasis(self):
         if not hasattr(self, "lastdir"):
@@ -1094,7 +1298,7 @@ class MainWindow(QtWidgets.QMainWindow):  # noqa: PLR0904
         fileName = projectors.getFileNameWithDialog(qtparent=self, startdir=startdir)
         if fileName:
             self.lastdir = os.path.dirname(fileName)
-            projectors.sendProjectors(self, fileName, self.channel_names, self.client)
+            projectors.sendProjectors(self, fileName, self.channels, self.host, self.port, self.projectorDigests)
 
     @pyqtSlot()
     def loadMix(self):
@@ -1129,13 +1333,24 @@ class MainWindow(QtWidgets.QMainWindow):  # noqa: PLR0904
 
     @pyqtSlot()
     def popOutObserve(self):
+        if self.observeWindow is None:
+            self.observeWindow = observe.Observe(parent=None, host=self.host, client=self.client, model=self.countRateModel)
+            self.connectObserveView(self.observeWindow)
+            self.observeWindow.handleRatesChanged()
         self.observeWindow.show()
 
+    def connectObserveView(self, view):
+        """Let an Observe view share the trigger blocker with the Triggering tab."""
+        view.triggerBlocker = self.triggerBlocker
+        self.triggerTab.clearDisabledButton.clicked.connect(view.pushedClearDisabled)
+        view.blocklist_changed.connect(self.triggerTab.updateDisabledList)
+        view.block_channel.connect(self.triggerTab.blockTriggering)
+        self.triggerTab.changedBlockList.connect(view.updateDisabledCount)
+
     @pyqtSlot()
     def sendEdgeMulti(self):
-        # first send the trigger mesage for all channels
+        # Set all channels to the edge multi trigger state...
         config = {
-            "ChannelIndices": list(range(len(self.channel_names))),
             "EdgeMulti": self.checkBox_EdgeMulti.isChecked(),
             "EdgeRising": self.checkBox_EdgeMulti.isChecked(),
             "EdgeTrigger": self.checkBox_EdgeMulti.isChecked(),
@@ -1145,16 +1360,19 @@ class MainWindow(QtWidgets.QMainWindow):  # noqa: PLR0904
             "EdgeMultiVerifyNMonotone": self.spinBox_EdgeMultiVerifyNMonotone.value(),
             "EdgeLevel": self.spinBox_EdgeLevel.value(),
         }
-        self.client.call("SourceControl.ConfigureTriggers", config)
+        desired = trigger_states.TriggerStateStore()
+        desired.assign(self.channelIndicesAll(), config)
 
-        # Reset trigger on even-numbered channels if source is TDM and the relevant
+        # ...except turn off triggers on error channels if source is TDM and the relevant
         # check box ("Trigger on Error Channels") isn't checked.
-        omitEvenChannels = (
+        omitErrorChannels = (
             self.sourceIsTDM and not self.checkBox_edgeMultiTriggerOnError.isChecked()
         )
-        if omitEvenChannels:
-            config = {"ChannelIndices": list(range(0, len(self.channel_names), 2))}
-            self.client.call("SourceControl.ConfigureTriggers", config)
+        if omitErrorChannels:
+            desired.assign(self.channels.prefixIndices.get("err", []), {})
+
+        # Send only what differs from Dastard's current trigger state, one request per distinct state.
+        self.triggerTab.sendTriggerStates(desired)
 
     @pyqtSlot()
     def sendMix(self):
@@ -1246,9 +1464,7 @@ class MainWindow(QtWidgets.QMainWindow):  # noqa: PLR0904
         return list(range(len(self.channel_names)))
 
     def channelIndicesSignalOnly(self):
-        return [
-            i for (i, name) in enumerate(self.channel_names) if name.startswith("chan")
-        ]
+        return self.channels.signalIndices.tolist()
 
     def configLevelTrigs(self):
         configLevelDialog = configure_level_triggers.LevelTrigConfig(self)
@@ -1281,7 +1497,7 @@ class MainWindow(QtWidgets.QMainWindow):  # noqa: PLR0904
                     obj = yaml.safe_load(fp)
             invertText = ""
             if len(obj["inverted"]) > 0:
-                invertText = ", ".join([str(c) for c in obj["inverted"]])
+                invertText = channel_registry.format_ranges(obj["inverted"], sep=", ")
             self.invertedChanTextEdit.setPlainText(invertText)
             self.triggerBlocker.special = obj["disabled"]
             self.triggerTab.updateDisabledList()
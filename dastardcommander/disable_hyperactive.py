@@ -1,10 +1,10 @@
 import os
-import time
-import numpy as np
 import PyQt5
 from PyQt5 import QtCore, QtWidgets, QtGui
 from PyQt5.QtCore import pyqtSlot, pyqtSignal
 
+from . import hyperactive
+
 
 class DisableHyperDialog(QtWidgets.QDialog):
 
@@ -31,46 +31,49 @@ class DisableHyperDialog(QtWidgets.QDialog):
         self.textBrowser.clear()
         self.cursor = self.textBrowser.textCursor()
 
-        self.thread = QtCore.QThread()
         positive = self.positivePulseButton.isChecked()
         threshold = self.levelSpinBox.value()
-        messages = 5
-        self.progressBar.setMaximum(messages)
-        self.worker = DisableHyperWorker(self.dcom, positive, threshold, messages)
-        self.worker.moveToThread(self.thread)
-
-        self.worker.finished.connect(self.thread.quit)
-        self.worker.finished.connect(self.worker.deleteLater)
+        self.progressBar.setMaximum(100)
+        self.worker = DisableHyperWorker(self.dcom, positive, threshold)
         self.worker.finished.connect(self.dcom.triggerTab.updateDisabledList)
         self.worker.message.connect(self.displaySteps)
-        self.worker.progress.connect(self.updateProgress)
+        self.worker.progress.connect(self.progressBar.setValue)
+        self.worker.run()
 
-        self.thread.started.connect(self.worker.run)
-        self.thread.finished.connect(self.thread.deleteLater)
-        self.thread.start()
+    def done(self, result):
+        """Stop collecting trigger rates if the dialog is closed early."""
+        worker = getattr(self, "worker", None)
+        if worker is not None:
+            worker.cancel()
+        super().done(result)
 
     @pyqtSlot(str)
     def displaySteps(self, message):
         self.cursor.insertText(message)
 
-    @pyqtSlot()
-    def updateProgress(self):
-        self.progressBar.setValue(self.progressBar.value() + 1)
-
 
 class DisableHyperWorker(QtCore.QObject):
-    """QObject that can run in a QThread to keep GUI (main) thread responsive."""
+    """QObject that turns on edge triggers, then decides from each TRIGGERRATE message which
+    channels are hyperactive. It lives in the GUI thread but never waits: run() returns after
+    the RPCs, and the rest happens as the main window's triggerRateReceived signal arrives."""
 
     finished = pyqtSignal()
-    progress = pyqtSignal()
+    progress = pyqtSignal(int)
     message = pyqtSignal(str)
 
-    def __init__(self, dcom, positive, threshold, messages_expected):
+    maxIntegrationTime = 10.0  # seconds
+    tooManyTriggers = 1.0  # i.e. 1.0 triggers per second or more is bad when x rays are off
+
+    def __init__(self, dcom, positive, threshold):
         self.dcom = dcom
         self.positive = positive
         self.threshold = threshold
-        self.messages_expected = messages_expected
+        self.test = None
+        self.save_quiet = True
         super().__init__()
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.decide)
 
     def run(self):
         channels_to_configure = self.dcom.triggerTabSimple.channelIndicesSignalOnly(exclude_blocked=True)
@@ -101,47 +104,54 @@ class DisableHyperWorker(QtCore.QObject):
             self.finished.emit()
             return
 
-        # 3) Collect trigger rate data
-        staleTriggerRateMessageID, msg = self.dcom.lastTriggerRateMessage
-        trigcounts = np.zeros(len(msg["CountsSeen"]), dtype=int)
-        duration = 0.0
-        t0 = time.time()
-        integration_time = 10.0
-        self.message.emit(f"3) Collecting trigger rate data (takes up to {integration_time} seconds).\n")
-
-        progress_counter = 0
-        while True:
-            time.sleep(0.25)
-            triggerRateMessageID, msg = self.dcom.lastTriggerRateMessage
-            if triggerRateMessageID != staleTriggerRateMessageID:
-                triggerRateMessageID = staleTriggerRateMessageID
-                if "CountsSeen" in msg and "Duration" in msg:
-                    self.progress.emit()
-                    trigcounts += msg["CountsSeen"]
-                    duration += msg["Duration"]
-                    progress_counter += 1
-                    if progress_counter >= self.messages_expected:
-                        break
-
-            if time.time() - t0 > integration_time:
-                break
-
-        duration /= 1e9  # convert ns to seconds
-        if duration <= 0:
-            self.message.emit(f"ERROR: no trigger rate messages were received in {integration_time} seconds.")
+        # 3) Collect trigger rate data, one TRIGGERRATE message at a time, until every channel is decided.
+        self.test = hyperactive.PoissonRateTest(len(self.dcom.channel_names), channels_to_configure,
+                                                threshold=self.tooManyTriggers)
+        self.message.emit(f"3) Collecting trigger rate data (takes up to {self.maxIntegrationTime} seconds).\n")
+        self.dcom.triggerRateReceived.connect(self.triggerRateReceived)
+        self.timer.start(int(1000 * self.maxIntegrationTime))
+
+    @pyqtSlot(object)
+    def triggerRateReceived(self, msg):
+        if self.test is None or "CountsSeen" not in msg or "Duration" not in msg:
+            return
+        if not self.test.add(msg["CountsSeen"], msg["Duration"] / 1e9):  # Duration is in ns
+            return
+        self.progress.emit(100 * self.test.ndecided() // self.test.ntested())
+        if self.test.complete():
+            self.decide()
+
+    def stop(self):
+        """Stop listening for trigger rates. Returns the test so far, or None if not listening."""
+        test, self.test = self.test, None
+        if test is not None:
+            self.timer.stop()
+            self.dcom.triggerRateReceived.disconnect(self.triggerRateReceived)
+        return test
+
+    def cancel(self):
+        """Give up without changing any channels."""
+        if self.stop() is not None:
+            self.endSilentTRIGGER()
+
+    @pyqtSlot()
+    def decide(self):
+        test = self.stop()
+        if test is None:
+            return
+        if test.duration <= 0:
+            self.message.emit(f"ERROR: no trigger rate messages were received in {self.maxIntegrationTime} seconds.")
             self.finished.emit()
             return
 
-        self.message.emit(f"** {duration:.1f} seconds of trigger counts accumulated with {trigcounts.sum()} triggers.\n")
-        rates = trigcounts / duration
-        disable = []
-        enable = []
-        too_many_triggers = 1.0  # i.e. 1.0 triggers per second or more is bad when x rays are off
-        for idx, rate in enumerate(rates):
-            if rate < too_many_triggers:
-                enable.append(idx)
-            else:
-                disable.append(idx)
+        ncounts = test.counts.sum()
+        undecided = test.ntested() - test.ndecided()
+        self.message.emit(f"** {test.duration:.1f} seconds of trigger counts accumulated with {ncounts} triggers.\n")
+        if undecided > 0:
+            self.message.emit(f"** {undecided} channels with rates near {self.tooManyTriggers} Hz decided by mean rate.\n")
+        test.finish()
+        disable = test.hyperactive().tolist()
+        enable = test.quiet().tolist()
 
         nd = len(disable)
         self.message.emit(f"4) Disabling {nd} channels; re-asserting edge triggers to all others.\n")
@@ -153,13 +163,9 @@ class DisableHyperWorker(QtCore.QObject):
                 "LevelTrigger": False,
             }
             self.dcom.client.call("SourceControl.ConfigureTriggers", ts)
-            disabled_channums = []
-            for idx in disable:
-                name = self.dcom.channel_names[idx]
-                if name.startswith("chan"):
-                    cnum = int(name[4:])
-                    disabled_channums.append(cnum)
-            self.dcom.triggerBlocker.add_chan_to_list(disabled_channums)
+            numbers = self.dcom.channels.numbers[disable]
+            signal = self.dcom.channels.isSignal[disable]
+            self.dcom.triggerBlocker.add_chan_to_list(numbers[signal].tolist())
 
         if len(enable) > 0:
             ts = {
@@ -176,6 +182,7 @@ class DisableHyperWorker(QtCore.QObject):
         if not self.save_quiet:
             delay = 5000  # ms
             QtCore.QTimer.singleShot(delay, self.endSilentTRIGGER)
+        self.progress.emit(100)
         self.message.emit("Hyperactive channels are disabled. You may close this window.\n")
         self.finished.emit()
 
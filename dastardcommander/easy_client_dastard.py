@@ -1,4 +1,6 @@
 from . import rpc_client_for_easy_client
+from . import record_stream
+from . import histograms
 import numpy
 import zmq
 import time
@@ -9,15 +11,6 @@ import numpy as np
 DEBUG = True
 rpc_client_for_easy_client.DEBUG = False
 
-SUMMARY_HEADER_DTYPE=np.dtype([("chan",np.uint16),("headerVersion",np.uint8),
-     ("npresamples",np.uint32),("nsamples",np.uint32),("pretrig_mean","f4"),("peak_value","f4"),
-     ("pulse_rms","f4"),("pulse_average","f4"),("residualStdDev","f4"),
-     ("unixnano",np.uint64), ("trig frame",np.uint64)])
-
-RECORD_HEADER_DTYPE = np.dtype([("chan",np.uint16),("headerVersion",np.uint8), ("dataTypeCode", np.uint8),
-     ("npresamples",np.uint32),("nsamples",np.uint32),("samplePeriod","f4"),("voltsPerArb","f4"),
-     ("unixnano",np.uint64), ("triggerFramecount",np.uint64)])
-
 class EasyClientDastard():
     """This client will connect to a server's summary channels."""
     def __init__(self, host='localhost', baseport=5500, setupOnInit = True):
@@ -42,6 +35,77 @@ class EasyClientDastard():
         self.messagesSeen = collections.Counter()
 
 
+    def _connectDataSub(self):
+        """ connect to the record (data) port of dastard """
+        self.dataSub = record_stream.RecordSubscriber(self.host, self.baseport, context=self.context)
+        self._pendingRecords = collections.deque()
+        print(f"Collecting records from dastard at {self.dataSub.address}")
+
+    def getMessages(self, timeout_ms=1000):
+        """ return (headers, records) for all records queued on the data port, waiting up to
+        timeout_ms for at least one. headers is a numpy structured array of record_stream.RECORD_HEADER_DTYPE,
+        records a list of numpy arrays """
+        if not hasattr(self, "dataSub"):
+            self._connectDataSub()
+        batch = self.dataSub.recv_batch(timeout_ms)
+        return record_stream.decode_records(batch)
+
+    def getMessage(self):
+        """ return (header, data) for the next record published by dastard """
+        if not hasattr(self, "dataSub"):
+            self._connectDataSub()
+        while len(self._pendingRecords) == 0:
+            headers, records = self.getMessages()
+            self._pendingRecords.extend(zip(headers, records))
+        return self._pendingRecords.popleft()
+
+    def monitorDrops(self, duration_s=None, report_every_s=5.0, detector=None):
+        """ watch the record stream for duration_s seconds (forever if None), counting per-channel
+        gaps and out-of-order records; print a summary every report_every_s seconds.
+        Returns the record_stream.DropDetector """
+        if detector is None:
+            detector = record_stream.DropDetector()
+        tstart = tlast = time.time()
+        while duration_s is None or time.time()-tstart < duration_s:
+            headers, _ = self.getMessages(timeout_ms=100)
+            detector.update_headers(headers)
+            if time.time()-tlast > report_every_s:
+                tlast = time.time()
+                print(detector.summary())
+        return detector
+
+    def _connectSummarySub(self):
+        """ connect to the summary port of dastard """
+        self.summarySub = record_stream.RecordSubscriber(self.host, self.baseport, summaries=True,
+                                                        context=self.context)
+        print(f"Collecting summaries from dastard at {self.summarySub.address}")
+
+    def accumulateHistograms(self, duration_s, hist=None, fromRecords=False, positive=True, **kwargs):
+        """ histogram pulse heights for duration_s seconds, from the summary port's peak values or
+        (if fromRecords) from the raw records. Pass an existing histograms.PulseHeightHistograms as
+        hist to keep adding to it; otherwise kwargs are passed to its constructor.
+        Returns the PulseHeightHistograms """
+        if hist is None:
+            hist = histograms.PulseHeightHistograms(**kwargs)
+        if fromRecords:
+            if not hasattr(self, "dataSub"):
+                self._connectDataSub()
+            sub = self.dataSub
+        else:
+            if not hasattr(self, "summarySub"):
+                self._connectSummarySub()
+            sub = self.summarySub
+        tstart = time.time()
+        while time.time()-tstart < duration_s:
+            batch = sub.recv_batch(timeout_ms=100)
+            if fromRecords:
+                headers, records = record_stream.decode_records(batch)
+                hist.add_records(headers, records, positive)
+            else:
+                headers = record_stream.decode_headers([m[0] for m in batch], record_stream.SUMMARY_HEADER_DTYPE)
+                hist.add_summaries(headers)
+        return hist
+
     def _connectRPC(self):
         """ connect to the rpc port of dastard """
         self.rpc = rpc_client_for_easy_client.JSONClient((self.host, self.baseport))
@@ -242,21 +306,6 @@ if __name__ == '__main__':
         eval(input())
 
     if True:
-        # search for drops in one channel
-        firsts = []
+        # search for drops and out-of-order records in all channels
         c = EasyClientDastard()
-        i=0
-        ndrops=0
-        while True:
-            header,data = c.getMessage()
-            if header["chan"]!=1:
-                continue
-            i+=1
-            if i%100==0:
-                print(i)
-            firsts.append(header["triggerFramecount"])
-            if np.sum(np.diff(firsts)<0)>0:
-                print((np.sum(np.diff(firsts)<0), firsts))
-            if np.sum(np.diff(firsts)>len(data))>ndrops:
-                ndrops+=1
-                print(("drop", ndrops, np.diff(firsts)/len(data)))
\ No newline at end of file
+        detector = c.monitorDrops()
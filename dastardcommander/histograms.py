@@ -0,0 +1,149 @@
+"""
+histograms.py
+
+Incremental per-channel pulse-height histograms, accumulated from the live summary stream
+(peak values computed by Dastard) or from raw records. Nothing here depends on Qt, so the
+same accumulator serves dcom's spectra window and headless use through `EasyClientDastard`.
+"""
+
+import time
+import numpy as np
+
+
+def record_peaks(headers, records, positive=True):
+    """Return the pulse height of each record: its extreme value minus its pretrigger mean.
+
+    Records of a common length (the usual case) are stacked and handled in one vectorized pass.
+    """
+    n = len(records)
+    peaks = np.zeros(n, dtype=float)
+    if n == 0:
+        return peaks
+    npre = np.asarray(headers["npresamples"], dtype=np.intp)
+    lengths = np.array([len(r) for r in records])
+    for length in np.unique(lengths):
+        idx = np.nonzero(lengths == length)[0]
+        data = np.vstack([records[i] for i in idx]).astype(float)
+        pre = np.clip(npre[idx], 1, length)
+        cumsum = np.cumsum(data, axis=1)
+        ptmean = cumsum[np.arange(len(idx)), pre - 1] / pre
+        if positive:
+            peaks[idx] = data.max(axis=1) - ptmean
+        else:
+            peaks[idx] = ptmean - data.min(axis=1)
+    return peaks
+
+
+class PulseHeightHistograms:
+    """A channels x bins array of counts, updated one batch of (channel, value) pairs at a time.
+
+    Each batch is binned with a single `np.bincount` on flattened (channel, bin) indices, the
+    batched equivalent of `np.add.at`. Values outside [vmin, vmax) are counted as under/overflow.
+
+    If `integration_time` (seconds) is set, the histograms reset automatically when that much
+    time has passed since the last reset; the just-completed window is kept in `self.previous`.
+
+    Usage:
+    >>> h = PulseHeightHistograms(nchan=2, nbins=4, vmin=0, vmax=100)
+    >>> h.add([0, 0, 1, 1, 1], [10, 30, 60, 60, 500])
+    >>> h.counts.tolist()
+    [[1, 1, 0, 0], [0, 0, 2, 0]]
+    >>> h.overflow.tolist()
+    [0, 1]
+    >>> h.reset()
+    >>> int(h.counts.sum())
+    0
+    """
+
+    def __init__(self, nchan=0, nbins=500, vmin=0.0, vmax=20000.0, integration_time=None):
+        self.nbins = int(nbins)
+        self.vmin = float(vmin)
+        self.vmax = float(vmax)
+        if self.vmax <= self.vmin:
+            raise ValueError(f"histogram range [{vmin}, {vmax}) is empty")
+        self.integration_time = integration_time
+        self.previous = None
+        self._allocate(nchan)
+
+    def _allocate(self, nchan):
+        self.counts = np.zeros((nchan, self.nbins), dtype=np.int64)
+        self.underflow = np.zeros(nchan, dtype=np.int64)
+        self.overflow = np.zeros(nchan, dtype=np.int64)
+        self.tstart = time.time()
+
+    @property
+    def nchan(self):
+        return self.counts.shape[0]
+
+    @property
+    def bin_edges(self):
+        return np.linspace(self.vmin, self.vmax, self.nbins + 1)
+
+    @property
+    def bin_centers(self):
+        e = self.bin_edges
+        return 0.5 * (e[1:] + e[:-1])
+
+    def _grow(self, nchan):
+        extra = nchan - self.nchan
+        if extra <= 0:
+            return
+        self.counts = np.vstack([self.counts, np.zeros((extra, self.nbins), dtype=np.int64)])
+        self.underflow = np.concatenate([self.underflow, np.zeros(extra, dtype=np.int64)])
+        self.overflow = np.concatenate([self.overflow, np.zeros(extra, dtype=np.int64)])
+
+    def reset(self):
+        """Start a new integration window, keeping a copy of the old one in self.previous."""
+        self.previous = self.counts.copy()
+        self._allocate(self.nchan)
+
+    def add(self, chans, values):
+        """Add a batch of `values` seen on channel indices `chans` (equal-length sequences)."""
+        if self.integration_time is not None and time.time() - self.tstart > self.integration_time:
+            self.reset()
+        chans = np.asarray(chans, dtype=np.intp)
+        if len(chans) == 0:
+            return
+        values = np.asarray(values, dtype=float)
+        self._grow(chans.max() + 1)
+        nchan = self.nchan
+
+        bins = np.floor((values - self.vmin) * (self.nbins / (self.vmax - self.vmin)))
+        under = bins < 0
+        over = ~under & ~(bins < self.nbins)  # also catches NaN
+        ok = ~(under | over)
+        flat = chans[ok] * self.nbins + bins[ok].astype(np.intp)
+        self.counts += np.bincount(flat, minlength=nchan * self.nbins).reshape(nchan, self.nbins)
+        self.underflow += np.bincount(chans[under], minlength=nchan)
+        self.overflow += np.bincount(chans[over], minlength=nchan)
+
+    def add_summaries(self, headers):
+        """Add a structured array of summary headers (record_stream.SUMMARY_HEADER_DTYPE)."""
+        self.add(headers["chan"], headers["peak_value"])
+
+    def add_records(self, headers, records, positive=True):
+        """Add raw records (see record_stream.decode_records), using `record_peaks` as pulse heights."""
+        self.add(headers["chan"], record_peaks(headers, records, positive))
+
+    def spectrum(self, chan):
+        """Return (bin_centers, counts) for one channel index."""
+        if chan >= self.nchan:
+            return self.bin_centers, np.zeros(self.nbins, dtype=np.int64)
+        return self.bin_centers, self.counts[chan]
+
+    def image(self, log=True):
+        """Render all channels as a (nchan, nbins) uint8 array, each row scaled to its own maximum.
+
+        This is cheap enough to call at display rates: a few vectorized operations on the counts.
+        """
+        c = self.counts.astype(np.float32)
+        if log:
+            c = np.log1p(c)
+        rowmax = c.max(axis=1, keepdims=True)
+        rowmax[rowmax == 0] = 1
+        return (c * (255.0 / rowmax)).astype(np.uint8)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
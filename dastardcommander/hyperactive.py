@@ -0,0 +1,177 @@
+"""
+hyperactive.py
+
+Decide which channels trigger too often, from the CountsSeen and Duration vectors of Dastard's
+TRIGGERRATE messages. Nothing here depends on Qt.
+
+`PoissonRateTest` is Wald's sequential probability ratio test, applied to every channel at once:
+trigger counts are Poisson, so after each message we can say for each channel whether the counts
+so far are already convincing evidence of a rate above or below the threshold. Channels that
+trigger much faster than the threshold are decided within a second; channels that never trigger
+take about 3 seconds (at the default 2x margin and 1% error rates); only channels with rates near
+the threshold need the full integration time.
+
+`RateWatchdog` runs all the time instead, with X-rays on or off: it compares each channel's
+rate to robust statistics of the whole array and flags channels that stay far above the rest.
+"""
+
+import numpy as np
+
+
+class PoissonRateTest:
+    """Sequential test of whether each channel's trigger rate is above or below `threshold` (Hz).
+
+    The test compares a low and a high rate, a factor of `factor`**2 apart and each with error
+    probability `error`. They are placed so that the break-even rate (high-low)/log(high/low),
+    where the log-likelihood ratio has no drift, is exactly `threshold`; with the default factor
+    of 2, they are 0.46 and 1.85 times the threshold. A channel's verdict is fixed the first time
+    its log-likelihood ratio leaves the band (-log((1-error)/error), +log((1-error)/error)). Only
+    the channel indices in `channels` are tested (default: all `nchan`).
+
+    >>> test = PoissonRateTest(4)
+    >>> test.add([0, 0, 20, 1], 1.0)
+    True
+    >>> test.verdict.tolist(), test.complete()
+    ([0, 0, 1, 0], False)
+    >>> for _ in range(3):
+    ...     _ = test.add([0, 0, 25, 1], 1.0)
+    >>> test.verdict.tolist(), test.complete()
+    ([-1, -1, 1, 0], False)
+    >>> test.finish().tolist(), test.hyperactive().tolist(), test.quiet().tolist()
+    ([-1, -1, 1, 1], [2, 3], [0, 1])
+    >>> float(test.rateDiff / test.logRatio)
+    1.0
+    """
+
+    HYPERACTIVE = 1
+    QUIET = -1
+    UNDECIDED = 0
+
+    def __init__(self, nchan, channels=None, threshold=1.0, factor=2.0, error=0.01):
+        self.nchan = nchan
+        self.threshold = threshold
+        self.tested = np.zeros(nchan, dtype=bool)
+        if channels is None:
+            self.tested[:] = True
+        else:
+            self.tested[np.asarray(channels, dtype=np.int64)] = True
+        ratio = factor**2
+        low = threshold * np.log(ratio) / (ratio - 1)
+        high = ratio * low
+        self.logRatio = np.log(high / low)
+        self.rateDiff = high - low
+        self.bound = np.log((1 - error) / error)
+        self.counts = np.zeros(nchan, dtype=np.int64)
+        self.duration = 0.0
+        self.verdict = np.zeros(nchan, dtype=np.int8)
+
+    def add(self, counts, duration):
+        """Add one message's trigger `counts` (one per channel), collected over `duration` seconds.
+        Returns False (and ignores the message) if it has the wrong number of channels."""
+        counts = np.asarray(counts, dtype=np.int64)
+        if len(counts) != self.nchan or duration <= 0:
+            return False
+        self.counts += counts
+        self.duration += duration
+        llr = self.counts * self.logRatio - self.rateDiff * self.duration
+        open_ = self.tested & (self.verdict == self.UNDECIDED)
+        self.verdict[open_ & (llr >= self.bound)] = self.HYPERACTIVE
+        self.verdict[open_ & (llr <= -self.bound)] = self.QUIET
+        return True
+
+    def ndecided(self):
+        return int(np.count_nonzero(self.verdict[self.tested]))
+
+    def ntested(self):
+        return int(np.count_nonzero(self.tested))
+
+    def complete(self):
+        """Whether every tested channel has been decided."""
+        return self.ndecided() == self.ntested()
+
+    def rates(self):
+        """The mean trigger rate (Hz) of each channel so far."""
+        if self.duration <= 0:
+            return np.zeros(self.nchan)
+        return self.counts / self.duration
+
+    def finish(self):
+        """Decide any undecided tested channels by comparing their mean rate to the threshold,
+        and return the verdicts."""
+        open_ = self.tested & (self.verdict == self.UNDECIDED)
+        if self.duration > 0:
+            high = self.rates() >= self.threshold
+            self.verdict[open_ & high] = self.HYPERACTIVE
+            self.verdict[open_ & ~high] = self.QUIET
+        return self.verdict
+
+    def hyperactive(self):
+        """Indices of the channels decided to be hyperactive."""
+        return np.nonzero(self.verdict == self.HYPERACTIVE)[0]
+
+    def quiet(self):
+        """Indices of the channels decided to be quiet."""
+        return np.nonzero(self.verdict == self.QUIET)[0]
+
+
+class RateWatchdog:
+    """Flags channels whose trigger rates stay far above the rest of the array.
+
+    Each update finds the median rate of the watched channels and a robust spread: the larger of
+    1.4826 times the median absolute deviation and the Poisson noise sqrt(median/duration). A
+    channel is an outlier when its rate exceeds both median + `factor` * spread and `minRate`
+    (Hz), and it is flagged after `persistence` consecutive updates as an outlier. Flagged
+    channels stay flagged, and out of the statistics, until `reset`.
+
+    >>> dog = RateWatchdog(factor=5, persistence=2)
+    >>> counts = np.full(6, 10)
+    >>> counts[4] = 200
+    >>> dog.update(counts, 1.0).tolist()
+    []
+    >>> dog.update(counts, 1.0).tolist()
+    [4]
+    >>> dog.update(counts, 1.0).tolist(), np.nonzero(dog.flagged)[0].tolist(), dog.median
+    ([], [4], 10.0)
+    """
+
+    def __init__(self, factor=10.0, persistence=5, minRate=1.0):
+        self.factor = factor
+        self.persistence = persistence
+        self.minRate = minRate
+        self.reset()
+
+    def reset(self, nchan=0):
+        self.strikes = np.zeros(nchan, dtype=np.int32)
+        self.flagged = np.zeros(nchan, dtype=bool)
+        self.median = 0.0
+        self.limit = np.inf
+
+    def update(self, counts, duration, watched=None):
+        """Add one message's trigger `counts` (one per channel) over `duration` seconds. Only
+        channels where the boolean array `watched` is true are considered (default: all).
+        Returns the indices of channels newly flagged by this update."""
+        counts = np.asarray(counts, dtype=np.float64)
+        if len(counts) != len(self.flagged):
+            self.reset(len(counts))
+        use = ~self.flagged
+        if watched is not None:
+            use &= watched
+        if duration <= 0 or not use.any():
+            return np.zeros(0, dtype=np.int64)
+        rates = counts / duration
+        r = rates[use]
+        self.median = float(np.median(r))
+        mad = float(np.median(np.abs(r - self.median)))
+        spread = max(1.4826 * mad, np.sqrt(max(self.median, self.minRate) / duration))
+        self.limit = max(self.median + self.factor * spread, self.minRate)
+        outlier = use & (rates > self.limit)
+        self.strikes[outlier] += 1
+        self.strikes[~outlier] = 0
+        new = outlier & (self.strikes >= self.persistence)
+        self.flagged |= new
+        return np.nonzero(new)[0]
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -1,6 +1,7 @@
+import hashlib
 import numpy as np
 import os
-from matplotlib import cm
+import matplotlib
 import time
 from string import ascii_uppercase
 import itertools
@@ -10,6 +11,9 @@ from PyQt5 import QtGui, QtWidgets, QtCore
 from PyQt5.QtCore import pyqtSlot, pyqtSignal
 import PyQt5.uic
 
+from . import channel_registry
+from . import rate_history
+
 
 def iter_all_strings():
     "Iterator that returns A,B,C,...X,Y,Z,AA,AB,...ZX,ZY,ZZ,AAA,AAB,..."
@@ -79,79 +83,334 @@ class ExperimentStateIncrementer:
         self.lastValidState = "START"
 
 
+class RateIntegrator:
+    """Average the most recent `length` vectors of per-channel counts, at constant cost per update.
+
+    The last `length` vectors live in a fixed (length, nchan) ring buffer, alongside their running
+    sum: each new vector replaces the oldest one, so an update costs O(nchan) however long the
+    integration. With `ema=True`, the result is instead an exponential moving average with time
+    constant `length` updates. Changing `length` keeps as much of the history as still fits.
+
+    >>> r = RateIntegrator(length=2)
+    >>> r.add([1, 10]).tolist()
+    [1.0, 10.0]
+    >>> r.add([3, 20]).tolist(), r.complete
+    ([2.0, 15.0], True)
+    >>> r.add([5, 30]).tolist()
+    [4.0, 25.0]
+    >>> r.setLength(3)
+    >>> r.add([7, 40]).tolist()
+    [5.0, 30.0]
+    """
+
+    def __init__(self, length=1, ema=False):
+        self.length = max(1, int(length))
+        self.ema = ema
+        self.reset()
+
+    def reset(self):
+        self.buffer = None
+        self.sum = None
+        self.average = None
+        self.n = 0  # number of vectors in the current average (at most self.length)
+        self.next = 0  # ring buffer row to be filled next
+
+    @property
+    def complete(self):
+        return self.n >= self.length
+
+    @property
+    def rates(self):
+        if self.n == 0:
+            return None
+        if self.ema:
+            return self.average.copy()
+        return self.sum / self.n
+
+    def _recent(self, k):
+        """Return the k most recent vectors in the ring buffer, oldest first."""
+        rows = (self.next - k + np.arange(k)) % self.length
+        return self.buffer[rows]
+
+    def setLength(self, length):
+        length = max(1, int(length))
+        if length == self.length:
+            return
+        if self.buffer is not None:
+            keep = self._recent(min(self.n, length))
+            nchan = self.buffer.shape[1]
+            self.buffer = np.zeros((length, nchan), dtype=float)
+            self.buffer[:len(keep)] = keep
+            self.sum = keep.sum(axis=0)
+            self.n = len(keep)
+            self.next = self.n % length
+        self.length = length
+
+    def setEMA(self, ema):
+        """Switch between plain and exponential averaging, starting from the current rates."""
+        if ema == self.ema:
+            return
+        current = self.rates
+        if ema:
+            self.average = current
+        elif current is not None:
+            # The ring buffer was not updated in EMA mode, so restart it from the current rates.
+            self.buffer[:] = current
+            self.sum = current * self.length
+            self.n = self.length
+            self.next = 0
+        self.ema = ema
+
+    def add(self, counts):
+        """Add one vector of counts (one per channel), and return the current averaged rates."""
+        counts = np.asarray(counts, dtype=float)
+        if self.buffer is None or self.buffer.shape[1] != len(counts):
+            self.reset()
+            self.buffer = np.zeros((self.length, len(counts)), dtype=float)
+            self.sum = np.zeros(len(counts), dtype=float)
+        if self.ema:
+            if self.n == 0:
+                self.average = counts.copy()
+            else:
+                self.average += (counts - self.average) / self.length
+        else:
+            if self.n == self.length:
+                self.sum -= self.buffer[self.next]
+            self.buffer[self.next] = counts
+            self.sum += counts
+            self.next = (self.next + 1) % self.length
+        self.n = min(self.n + 1, self.length)
+        return self.rates
+
+
+class CountRateModel(QtCore.QObject):
+    """The data behind all Observe views: integrated count rates, array layout, and TES map.
+
+    dc.py feeds each relevant Dastard message to one CountRateModel, which does the work (rate
+    integration and array/aux sums) once per message and then signals its views. Views do only
+    their own drawing, so a hidden or never-opened view costs nothing.
+    """
+
+    ratesChanged = pyqtSignal()
+    arrayChanged = pyqtSignal()  # source started/stopped or changed its channel groups
+    mapChanged = pyqtSignal()
+    mapFileChanged = pyqtSignal(str)
+    integrationSettingsChanged = pyqtSignal(int, bool)
+    externalTriggersChanged = pyqtSignal(int)
+    stateLabelChanged = pyqtSignal(str)
+
+    def __init__(self, integrationTime=1, parent=None):
+        QtCore.QObject.__init__(self, parent)
+        self.integrator = RateIntegrator(integrationTime)
+        self.history = rate_history.RateHistory()
+        self.waterfall = rate_history.RateWaterfall()
+        self.ngroups = 0
+        self.chan_per_group = []
+        self.channels = channel_registry.ChannelRegistry()  # replaced by the shared one from dc.py
+        self.channel_names = self.channels.names
+        self.isSignal = np.zeros(0, dtype=bool)
+        self.pixelMap = None
+        self.pixelMapKey = None
+        self.pixelMapCache = {}
+        self.mapfile = ""
+        self.rates = None
+        self.arrayCps = 0.0
+        self.auxCps = 0.0
+
+    def handleChannelNames(self):
+        """Channel names have changed (in place): note which ones are signal ("chan*") channels."""
+        self.isSignal = self.channels.isSignal
+        self.history.reset(len(self.channel_names))
+        self.waterfall.reset(len(self.channel_names))
+
+    def handleTriggerRateMessage(self, d):
+        if self.ngroups == 0:
+            print("Ignoring trigger rate message that arrived before array status")
+            return
+        if len(self.channel_names) == 0:
+            print("Ignoring trigger rate message that arrived before channel names")
+            return
+        counts = d["CountsSeen"]
+        # Check the length before adding to the history and waterfall, because
+        # handleChannelNames resets them.
+        if len(self.isSignal) != len(counts):
+            self.handleChannelNames()
+            if len(self.isSignal) != len(counts):
+                # e.g., a stale message from before a source restart
+                print(f"Ignoring trigger rate message for {len(counts)} channels; there are {len(self.isSignal)}")
+                return
+        duration = d.get("Duration", 1e9) / 1e9  # ns to seconds
+        self.history.add(counts, duration)
+        self.waterfall.add(np.asarray(counts) / max(duration, 1e-3))
+        rates = self.integrator.add(counts)
+        self.rates = rates
+        self.arrayCps = rates[self.isSignal].sum()
+        self.auxCps = rates[~self.isSignal].sum()
+        self.ratesChanged.emit()
+
+    @property
+    def integrationComplete(self):
+        return self.integrator.complete
+
+    @pyqtSlot()
+    def resetIntegration(self):
+        self.integrator.reset()
+        self.rates = None
+        self.arrayCps = self.auxCps = 0.0
+        self.ratesChanged.emit()
+
+    @pyqtSlot(int)
+    def setIntegrationTime(self, seconds):
+        if seconds != self.integrator.length:
+            self.integrator.setLength(seconds)
+            self.integrationSettingsChanged.emit(seconds, self.integrator.ema)
+
+    @pyqtSlot(bool)
+    def setEMA(self, ema):
+        if ema != self.integrator.ema:
+            self.integrator.setEMA(ema)
+            self.integrationSettingsChanged.emit(self.integrator.length, ema)
+
+    def handleStatusUpdate(self, is_running, source_name, groups_info):
+        if not is_running:
+            return self.handleStop()
+        self.ngroups = len(groups_info)
+        self.chan_per_group = [v["Nchan"] for v in groups_info]
+        self.arrayChanged.emit()
+
+    def handleStop(self):
+        self.ngroups = 0
+        self.chan_per_group = []
+        self.arrayChanged.emit()
+
+    def handleTESMapFile(self, filename):
+        self.mapfile = filename
+        self.mapFileChanged.emit(filename)
+
+    def handleTESMap(self, msg):
+        """Compute map positions (in units of the pixel spacing) from a TESMAP message.
+
+        Positions are cached by a digest of the spacing and every pixel position, so when Dastard
+        re-sends the same map (e.g., on reconnect), neither the positions nor the views' layouts
+        are recomputed.
+        """
+        pixels = msg["Pixels"]
+        xy = np.array([(p["X"], p["Y"]) for p in pixels], dtype=float).reshape(-1, 2)
+        key = (msg["Spacing"], hashlib.sha1(xy.tobytes()).hexdigest())
+        if key == self.pixelMapKey:
+            return
+        if key in self.pixelMapCache:
+            self.pixelMap = self.pixelMapCache[key]
+        else:
+            scale = 1.0 / float(msg["Spacing"])
+            minx = xy[:, 0].min() if len(xy) > 0 else 0
+            maxy = xy[:, 1].max() if len(xy) > 0 else 0
+            print("MinX = ", minx, " MaxY=", maxy)
+            self.pixelMap = np.column_stack([(xy[:, 0] - minx) * scale, (maxy - xy[:, 1]) * scale])
+            print("handleTESMap with spacing ", msg["Spacing"], " scale ", scale)
+            self.pixelMapCache[key] = self.pixelMap
+        self.pixelMapKey = key
+        self.mapChanged.emit()
+
+    def handleExternalTriggerMessage(self, msg):
+        self.externalTriggersChanged.emit(msg["NumberObservedInLastSecond"])
+
+    def handleStateLabel(self, label):
+        self.stateLabelChanged.emit(label)
+
+
 class Observe(QtWidgets.QWidget):
-    """The tricky bit about this widget is that it cannot be properly set up until
+    """One view of a CountRateModel (dc.py shows one in the Observe tab, and optionally another
+    in a pop-out window).
+
+    The tricky bit about this widget is that it cannot be properly set up until
     dc has processed both a CHANNELNAMES message and a STATUS message (to get the
     number of rows and columns)."""
 
-    def __init__(self, parent, host, client):
+    def __init__(self, parent, host, client, model=None):
         QtWidgets.QWidget.__init__(self, parent)
         self.client = client
         self.host = host
         PyQt5.uic.loadUi(os.path.join(os.path.dirname(__file__), "ui/observe.ui"), self)
-        self.pushButton_resetIntegration.clicked.connect(self.resetIntegration)
         self.pushButton_autoScale.clicked.connect(self.handleAutoScaleClicked)
         self.mapLoadButton.clicked.connect(self.handleLoadMap)
         self.crm_grid = None
         self.crm_map = None
-        self.countsSeens = []
-        self.ngroups = 0
-        self.chan_per_group = []
-        self.channel_names = []  # injected from dc.py
+        if model is None:
+            model = CountRateModel(self.spinBox_integrationTime.value())
+        self.model = model
+        self.showIntegrationSettings(model.integrator.length, model.integrator.ema)
+        self.pushButton_resetIntegration.clicked.connect(model.resetIntegration)
+        self.spinBox_integrationTime.valueChanged.connect(model.setIntegrationTime)
+        self.checkBox_emaIntegration.toggled.connect(model.setEMA)
+        model.integrationSettingsChanged.connect(self.showIntegrationSettings)
+        model.ratesChanged.connect(self.handleRatesChanged)
+        model.arrayChanged.connect(self.handleArrayChanged)
+        model.mapChanged.connect(self.buildCRMMap)
+        model.mapFileChanged.connect(self.handleTESMapFile)
+        model.externalTriggersChanged.connect(self.handleExternalTriggers)
         self.auxPerChan = 0
         self.lastTotalRate = 0
-        self.mapfile = ""
         self.ExperimentStateIncrementer = ExperimentStateIncrementer(
             self.pushButton_experimentStateNew,
             self.pushButton_experimentStateIGNORE,
             self.label_experimentState,
             self,
         )
+        model.stateLabelChanged.connect(self.ExperimentStateIncrementer.updateLabel)
+        self.waterfallView = WaterfallView(model)
+        self.WaterfallTab.layout().addWidget(self.waterfallView)
         self.blocklist_changed.connect(self.updateDisabledCount)
+        if model.mapfile:
+            self.handleTESMapFile(model.mapfile)
 
     blocklist_changed = pyqtSignal()
     block_channel = pyqtSignal(int)
 
-    def handleTriggerRateMessage(self, d):
-        if self.ngroups == 0:
-            print("Ignoring trigger rate message that arrived before array status")
-            return
-        if len(self.channel_names) == 0:
-            print("Ignoring trigger rate message that arrived before channel names")
+    @property
+    def channel_names(self):
+        return self.model.channel_names
+
+    @property
+    def ngroups(self):
+        return self.model.ngroups
+
+    @property
+    def chan_per_group(self):
+        return self.model.chan_per_group
+
+    @pyqtSlot(int, bool)
+    def showIntegrationSettings(self, seconds, ema):
+        self.spinBox_integrationTime.setValue(seconds)
+        self.checkBox_emaIntegration.setChecked(ema)
+
+    @pyqtSlot()
+    def handleRatesChanged(self):
+        model = self.model
+        if model.rates is None:
+            if self.crm_grid is not None:
+                self.crm_grid.setCountRates(np.zeros(self.crm_grid.nchan), 1)
+            self.setArrayCps(0, False, 0)
             return
         if self.crm_grid is None:
             self.buildCRM()
 
-        countsSeen = np.array(d["CountsSeen"])
-        integrationTime = self.spinBox_integrationTime.value()
-        self.countsSeens.append(countsSeen)
-        n = min(len(self.countsSeens), integrationTime)
-        self.countsSeens = self.countsSeens[-n:]
-        countRates = np.zeros(len(countsSeen))
-        for cs in self.countsSeens:
-            countRates += cs
-        countRates /= len(self.countsSeens)
+        countRates = model.rates
         colorScale = self.getColorScale(countRates)
         if self.crm_grid is not None:
             self.crm_grid.setCountRates(countRates, colorScale)
-        if hasattr(self, "pixelMap"):
-            if self.crm_map is None or len(self.crm_map.buttons) == 0:
+        if model.pixelMap is not None:
+            if self.crm_map is None or self.crm_map.ncells == 0:
                 # if we build the crm_map before we know the source and know channel_names
                 # (eg before a dastard source is started) we will need to rebuild it later
                 # so we check here
-                print("rebuding CRMMap due to len(buttons)==0")
+                print("rebuding CRMMap due to ncells==0")
                 self.buildCRMMap()
-                print(f"now have len(buttons)={len(self.crm_map.buttons)}")
+                print(f"now have ncells={self.crm_map.ncells}")
             self.crm_map.setCountRates(countRates, colorScale)
-        integrationComplete = len(self.countsSeens) == integrationTime
-        arrayCps = 0
-        auxCps = 0
-        for cr, channel_name in zip(countRates, self.channel_names):
-            if channel_name.startswith("chan"):
-                arrayCps += cr
-            else:
-                auxCps += cr
-        self.setArrayCps(arrayCps, integrationComplete, auxCps)
+        self.setArrayCps(model.arrayCps, model.integrationComplete, model.auxCps)
+        if self.waterfallView.isVisible():
+            self.waterfallView.update()
 
     def getColorScale(self, countRates):
         if self.pushButton_autoScale.isChecked():
@@ -191,12 +450,14 @@ class Observe(QtWidgets.QWidget):
             self.crm_grid.deleteLater()
             self.crm_grid = None
 
+    @pyqtSlot()
     def buildCRMMap(self):
         self.deleteCRMMap()
         print(f"Building CountRateMap with {self.ngroups} channel groups")
         print(f"There are {len(self.channel_names)} channel names.")
         self.crm_map = CountRateMap(
-            self, self.ngroups, self.chan_per_group, self.channel_names, xy=self.pixelMap
+            self, self.ngroups, self.chan_per_group, self.channel_names,
+            xy=self.model.pixelMap, mapKey=self.model.pixelMapKey
         )
         # if we build the crm_map before we know the source and know channel_names
         # (eg before a dastard source is started) we will need to rebuild it later
@@ -208,28 +469,11 @@ class Observe(QtWidgets.QWidget):
             self.crm_map.deleteLater()
             self.crm_map = None
 
-    def handleStatusUpdate(self, is_running, source_name, groups_info):
-        if not is_running:
-            return self.handleStop()
-        ngroup = len(groups_info)
-        self.ngroups = ngroup
-        self.chan_per_group = [v["Nchan"] for v in groups_info]
-        self.deleteCRMGrid()
-        self.deleteCRMMap()
-
-    def handleStop(self):
-        self.ngroups = 0
-        self.chan_per_group = []
+    @pyqtSlot()
+    def handleArrayChanged(self):
         self.deleteCRMGrid()
         self.deleteCRMMap()
 
-    @pyqtSlot()
-    def resetIntegration(self):
-        self.countsSeens = []
-        if self.crm_grid is not None:
-            self.crm_grid.setCountRates(np.zeros(len(self.crm_grid.buttons)), 1)
-        self.setArrayCps(0, False, 0)
-
     @pyqtSlot()
     def pushedClearDisabled(self):
         """GUI requested the disabled list be cleared."""
@@ -245,6 +489,9 @@ class Observe(QtWidgets.QWidget):
         nenabled = n - ndisabled
         msg = f"{ndisabled} disabled, {nenabled} enabled of {n} channels"
         self.label_disabled_count.setText(msg)
+        for map in (self.crm_grid, self.crm_map):
+            if map is not None:
+                map.refreshBlocked()
 
     def handleAutoScaleClicked(self):
         self.doubleSpinBox_colorScale.setEnabled(
@@ -253,9 +500,10 @@ class Observe(QtWidgets.QWidget):
         self.lastTotalRate = 0  # make sure auto scale actually happens
 
     def handleLoadMap(self):
+        mapfile = self.model.mapfile
         if self.host == "localhost":
             file, _ = QtWidgets.QFileDialog.getOpenFileName(
-                self, "Select a TES map file", self.mapfile, "Maps (*.cfg *.txt)"
+                self, "Select a TES map file", mapfile, "Maps (*.cfg *.txt)"
             )
             if not file:
                 return
@@ -265,30 +513,19 @@ class Observe(QtWidgets.QWidget):
                 "Choose map file",
                 f"Enter full path to map file on {self.host} (remote server):",
                 QtWidgets.QLineEdit.Normal,
-                self.mapfile,
+                mapfile,
             )
             if not okay or not file:
                 return
         okay = self.client.call("MapServer.Load", file)
 
+    @pyqtSlot(str)
     def handleTESMapFile(self, filename):
-        self.mapfile = filename
         _head, tail = os.path.split(filename)
         self.mapFileLabel.setText(f"Map File: {tail}")
 
-    def handleTESMap(self, msg):
-        scale = 1.0 / float(msg["Spacing"])
-        minx = np.min([p["X"] for p in msg["Pixels"]])
-        maxy = np.max([p["Y"] for p in msg["Pixels"]])
-        print("MinX = ", minx, " MaxY=", maxy)
-        self.pixelMap = [
-            ((p["X"] - minx) * scale, (maxy - p["Y"]) * scale) for p in msg["Pixels"]
-        ]
-        print("handleTESMap with spacing ", msg["Spacing"], " scale ", scale)
-        self.buildCRMMap()
-
-    def handleExternalTriggerMessage(self, msg):
-        n = msg["NumberObservedInLastSecond"]
+    @pyqtSlot(int)
+    def handleExternalTriggers(self, n):
         self.label_externalTriggersInLastSecond.setText(
             f"{n} external triggers in last second"
         )
@@ -299,6 +536,224 @@ class Observe(QtWidgets.QWidget):
             self.ExperimentStateIncrementer.resetStateLabels()
 
 
+class ColorLUT:
+    """A matplotlib colormap sampled once into an n-entry lookup table.
+
+    Coloring a whole vector of values is then one numpy indexing operation, rather than a call
+    into matplotlib per value. The table is also kept as QColor objects (`qcolors`), so Qt code
+    never builds a color per value either.
+
+    >>> lut = ColorLUT("hot")
+    >>> lut.index([-1.0, 0.0, 0.5, 1.0, 7.0, float("nan")]).tolist()
+    [0, 0, 128, 255, 255, 0]
+    >>> lut([0.0, 1.0]).tolist()
+    [[10, 0, 0, 255], [255, 255, 255, 255]]
+    """
+
+    def __init__(self, name, n=256):
+        self.n = n
+        self.rgba = matplotlib.colormaps[name](np.linspace(0, 1, n), bytes=True)
+        self.qcolors = [QtGui.QColor(*c) for c in self.rgba.tolist()]
+
+    def index(self, values):
+        """Return the table index for each value in [0, 1]; out-of-range values are clipped."""
+        v = np.nan_to_num(np.asarray(values, dtype=float), nan=0.0)
+        return np.clip(v * (self.n - 1) + 0.5, 0, self.n - 1).astype(np.intp)
+
+    def __call__(self, values):
+        """Return an (n, 4) uint8 RGBA array, like the colormap itself called with bytes=True."""
+        return self.rgba[self.index(values)]
+
+
+class BucketIndex:
+    """A grid index for finding which of many unit-or-smaller boxes contains a point.
+
+    Box i covers [x[i], x[i]+w) x [y[i], y[i]+h) with w, h <= 1. Boxes are sorted by the unit
+    grid square holding their corner, so a lookup searches only the four squares that could hold
+    the corner of a box containing the point: O(log n), instead of testing all n boxes.
+
+    >>> idx = BucketIndex([0.0, 1.0, 5.5], [0.0, 0.0, 2.25], 0.8, 0.8)
+    >>> idx.find(1.5, 0.5), idx.find(6.0, 2.9), idx.find(0.9, 0.5), idx.find(-3, 9)
+    (1, 2, None, None)
+    """
+
+    def __init__(self, x, y, w, h):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.w = w
+        self.h = h
+        bx = np.floor(self.x).astype(np.int64)
+        by = np.floor(self.y).astype(np.int64)
+        if len(bx) == 0:
+            bx = by = np.zeros(1, dtype=np.int64)
+        self.x0 = bx.min()
+        self.y0 = by.min()
+        self.width = bx.max() - self.x0 + 1
+        self.height = by.max() - self.y0 + 1
+        keys = (by - self.y0) * self.width + (bx - self.x0)
+        self.order = np.argsort(keys[:len(self.x)], kind="stable")
+        self.keys = keys[self.order]
+
+    def find(self, u, v):
+        """Return the index of the (first) box containing point (u, v), or None."""
+        bx = int(np.floor(u)) - self.x0
+        by = int(np.floor(v)) - self.y0
+        for dy in (0, -1):
+            for dx in (0, -1):
+                if not (0 <= bx + dx < self.width and 0 <= by + dy < self.height):
+                    continue
+                key = (by + dy) * self.width + bx + dx
+                lo, hi = np.searchsorted(self.keys, [key, key + 1])
+                for i in self.order[lo:hi]:
+                    if self.x[i] <= u < self.x[i] + self.w and self.y[i] <= v < self.y[i] + self.h:
+                        return int(i)
+        return None
+
+
+class CellLayout:
+    """Where each channel's cell goes on a CountRateMap, in units of the cell pitch.
+
+    Only channels named "chan*" get a cell (not, e.g., Lancero error channels). Cells are laid
+    out in a grid, one row per channel group (wrapped at maxPerRow), or else at the positions
+    `xy` from a TES map. Layouts are cached by `CellLayout.get`, so rebuilding a map after a
+    reconnect (same channels, same map file) costs nothing.
+    """
+
+    _cache = {}
+    MAX_CACHED = 8
+
+    @classmethod
+    def get(cls, channel_names, chan_per_group, maxPerRow, cellFraction, xy=None, mapKey=None):
+        """Return the cached layout for these arguments, or compute (and cache) it.
+
+        `mapKey` must identify the map `xy`, e.g., the (spacing, sha1 of the positions) digest that
+        CountRateModel.handleTESMap makes; a map without one is not cached.
+        """
+        if xy is not None and mapKey is None:
+            return cls(channel_names, chan_per_group, maxPerRow, cellFraction, xy)
+        key = (tuple(channel_names), tuple(chan_per_group), maxPerRow, cellFraction, mapKey)
+        layout = cls._cache.get(key)
+        if layout is None:
+            layout = cls(channel_names, chan_per_group, maxPerRow, cellFraction, xy)
+            if len(cls._cache) >= cls.MAX_CACHED:
+                cls._cache.pop(next(iter(cls._cache)))
+            cls._cache[key] = layout
+        return layout
+
+    def __init__(self, channel_names, chan_per_group, maxPerRow, cellFraction, xy=None):
+        chanIndex, names, numbers, tooltips, cols, rows = [], [], [], [], [], []
+        self.cellOfChannel = -np.ones(len(channel_names), dtype=int)
+        horizdisp = chnum = vertdisp = groupnum = 0
+        # groupnum means the TES's group number (actual column number in TDM)
+        # chnum means TES's channel number within the group (actual row number in TDM)
+        for i, name in enumerate(channel_names):
+            if not name.startswith("chan"):
+                continue
+            self.cellOfChannel[i] = len(chanIndex)
+            chanIndex.append(i)
+            names.append(name)
+            try:
+                numbers.append(int(name.replace("chan", "")))
+            except ValueError:
+                numbers.append(-1)
+            tooltips.append(f"{name}, ({chnum} of grp {groupnum})")
+            cols.append(horizdisp)
+            rows.append(vertdisp)
+            horizdisp += 1
+            chnum += 1
+            if groupnum < len(chan_per_group) and chnum >= chan_per_group[groupnum]:
+                chnum = horizdisp = 0
+                vertdisp += 1
+                groupnum += 1
+            elif horizdisp >= maxPerRow:
+                horizdisp = 0
+                vertdisp += 1
+
+        self.chanIndex = np.array(chanIndex, dtype=int)
+        self.names = names
+        self.chanNumber = np.array(numbers, dtype=int)
+        self.tooltips = tooltips
+        ncells = len(chanIndex)
+        if xy is not None and len(xy) > 0:
+            n = min(len(xy), ncells)
+            pos = np.zeros((ncells, 2))
+            pos[:n] = np.asarray(xy, dtype=float)[:n]
+            self.col, self.row = pos[:, 0], pos[:, 1]
+        else:
+            self.col = np.array(cols, dtype=float)
+            self.row = np.array(rows, dtype=float)
+        self.index = BucketIndex(self.col, self.row, cellFraction, cellFraction)
+
+    @property
+    def ncells(self):
+        return len(self.chanIndex)
+
+
+class WaterfallView(QtWidgets.QWidget):
+    """Show a model's RateWaterfall (channels across, time down, newest at top) as one image.
+
+    The QImage is an 8-bit indexed view of the waterfall's own numpy array, colored by the
+    image's color table, so no pixel data are copied or converted when new rows arrive. The ring
+    buffer is drawn in (at most) two pieces to put the rows in time order.
+    """
+
+    lut = ColorLUT("inferno")
+
+    def __init__(self, model, parent=None):
+        QtWidgets.QWidget.__init__(self, parent)
+        self.model = model
+        self.qimage = None
+        self.imageData = None
+        self.colorTable = [QtGui.QColor("black").rgba()] + [c.rgba() for c in self.lut.qcolors[1:]]
+        self.setMinimumHeight(100)
+
+    def image(self):
+        wf = self.model.waterfall
+        if self.imageData is not wf.image:
+            self.imageData = wf.image
+            depth, stride = wf.image.shape
+            self.qimage = QtGui.QImage(wf.image.data, wf.nchan, depth, stride, QtGui.QImage.Format_Indexed8)
+            self.qimage.setColorTable(self.colorTable)
+        return self.qimage
+
+    def paintEvent(self, event):
+        qp = QtGui.QPainter(self)
+        wf = self.model.waterfall
+        w, h = self.width(), self.height()
+        qp.fillRect(self.rect(), QtCore.Qt.black)
+        if wf.n == 0 or wf.nchan == 0:
+            qp.setPen(QtCore.Qt.white)
+            qp.drawText(self.rect(), QtCore.Qt.AlignCenter, "no trigger rates yet")
+            return
+        image = self.image()
+        rowh = h / wf.n
+        # Draw oldest rows at the top, then flip so the newest row is at the top.
+        qp.translate(0, h)
+        qp.scale(1, -1)
+        y = 0.0
+        for start, count in wf.segments():
+            target = QtCore.QRectF(0, y, w, count * rowh)
+            qp.drawImage(target, image, QtCore.QRectF(0, start, wf.nchan, count))
+            y += count * rowh
+        qp.resetTransform()
+        qp.setPen(QtCore.Qt.white)
+        qp.drawText(5, 12, f"{wf.n} updates; color: log rate, {wf.vmin:g} to {wf.vmax:g}/s")
+
+    def event(self, event):
+        if event.type() == QtCore.QEvent.ToolTip:
+            wf = self.model.waterfall
+            if wf.n == 0 or wf.nchan == 0:
+                return True
+            chan = min(wf.nchan - 1, int(event.x() * wf.nchan / max(1, self.width())))
+            k = min(wf.n - 1, int(event.y() * wf.n / max(1, self.height())))
+            names = self.model.channel_names
+            name = names[chan] if chan < len(names) else f"index {chan}"
+            age = time.time() - wf.row_age(k)
+            QtWidgets.QToolTip.showText(event.globalPos(), f"{name}, {age:.0f} s ago", self)
+            return True
+        return super().event(event)
+
+
 class CountRateColorBar(QtWidgets.QWidget):
     "Show the event rate color scale as a color bar"
 
@@ -310,10 +765,10 @@ class CountRateColorBar(QtWidgets.QWidget):
         h = size.height()
 
         Nboxes = max(50, w // 2)
+        idx = self.lut.index(np.arange(Nboxes) / Nboxes)
         for i in range(Nboxes):
             f = float(i) / Nboxes
-            color = self.cmap(f, bytes=True)
-            qp.setBrush(QtGui.QColor(*color))
+            qp.setBrush(self.lut.qcolors[idx[i]])
             qp.drawRect(int(f * w + 0.5), 0, int(float(w) / Nboxes) + 1, int(h * 1.0))
 
 
@@ -321,194 +776,318 @@ _QT_DEFAULT_FONT = ""  # This is the easiest way to specify the default font
 
 
 class CountRateMap(QtWidgets.QScrollArea):
-    """Provide the UI inside the Triggering tab.
+    """Provide the count-rate grid (or TES map) inside the Observe tab.
 
-    This is a scroll area, so buttons need to be added not to self but to the QGridLayout
-    known as self.gridbox.
+    All channels are drawn as cells of one custom-painted CountRateCanvas, which paints every
+    cell from the numpy arrays here in a single paintEvent. Colors come from a precomputed
+    palette of QColors (see ColorLUT), indexed by one vectorized lookup per update. (An earlier
+    version used one QPushButton per channel, whose per-update style sheets were far too slow
+    for 1000s of channels.) Clicking on a cell toggles whether triggering is blocked on that channel.
+
+    The map zooms with Ctrl+mouse wheel. When zoomed out, cells are drawn with less detail: no
+    text below `textMinSize` pixels, and below `imageMaxSize` pixels the whole map is painted as
+    one image built with numpy.
+
+    New count rates are not drawn at once. They are rendered at most `maxFPS` times per second,
+    not at all while the map is hidden, and only cells whose displayed text or color changed
+    are repainted.
     """
 
     enabledFont = QtGui.QFont(_QT_DEFAULT_FONT, 8, QtGui.QFont.Bold)
     disabledFont = QtGui.QFont(_QT_DEFAULT_FONT, 8, QtGui.QFont.Bold)
-    enabledForeground = "black"
-    disabledForeground = "white"
-    disabledColor = "black"
-    cmap = cm.get_cmap("Wistia")
-    cmap_disabled = cm.get_cmap("hot")
+    enabledForeground = QtGui.QColor("black")
+    disabledForeground = QtGui.QColor("white")
+    lut = ColorLUT("Wistia")
+    lut_disabled = ColorLUT("hot")
+    # Cells are colored by index into this palette: first the enabled-cell colormap, then the
+    # disabled-cell colormap, then plain colors for cells with no rate yet.
+    palette = lut.qcolors + lut_disabled.qcolors + [QtGui.QColor("white"), QtGui.QColor("black")]
+    DISABLED_OFFSET = lut.n
+    NO_RATE = len(palette) - 2
+    NO_RATE_DISABLED = len(palette) - 1
+    MaxPerRow = 32  # no more than this many cells per row of the grid
+    baseCellSize = 22  # pixels per cell at zoom 1
+    cellGap = 4  # pixels between neighboring cells at zoom 1
+    textMinSize = 14
+    imageMaxSize = 5
+    maxFPS = 5.0  # most renders per second (dc.py sets this from the "observeMaxFPS" setting)
 
-    def __init__(self, parent, ngroups, chan_per_group, channel_names, xy=None):
+    def __init__(self, parent, ngroups, chan_per_group, channel_names, xy=None, mapKey=None):
         QtWidgets.QScrollArea.__init__(self, parent)
         self.owner = parent
-        self.widget = QtWidgets.QWidget()
-        self.setWidget(self.widget)
-        self.gridbox = QtWidgets.QGridLayout()
-        self.widget.setLayout(self.gridbox)
-        self.setWidgetResizable(True)  # This is critical; without it, no buttons are drawn!
-        # The following would leave the vertical scroll always on. Seems unneccessary?
-        # self.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOn)
-
-        self.buttons = []
-        self.named_buttons = {}
         self.ngroups = ngroups
         self.chan_per_group = chan_per_group
         self.channel_names = channel_names
         self.triggerBlocker = parent.triggerBlocker
-        if xy is None:
-            size = 22
-            self.initButtons(size=size)
-        else:
-            size = 22
-            self.initButtons(size=size, xy=xy)
+        self.cellSize = self.baseCellSize
+        self.zoom = 1.0
+        self.xy = xy
+        self.mapKey = mapKey
+        self.pendingRates = None
+        self.pendingScale = 1.0
+        self.stale = False
+        self.lastRender = 0.0
+        self.renderTimer = QtCore.QTimer(self)
+        self.renderTimer.setSingleShot(True)
+        self.renderTimer.timeout.connect(self.render)
+        self.canvas = CountRateCanvas(self)
+        self.setWidget(self.canvas)
+        self.setWidgetResizable(True)
+        self.initCells()
 
         self.colorbar = CountRateColorBar(self)
-        # self.colorbar.move(0, int((self.ngroups+0.5)*size))
         w = parent.width()
-        self.colorbar.resize(w, size)
-        self.colorbar.cmap = self.cmap
-
-    def addButton(self, col, row, xwidth, ywidth, name, tooltip):
-        button = QtWidgets.QPushButton()
-        # button.move(x, y)
-        button.setFixedSize(xwidth, ywidth)
-        button.setFont(self.enabledFont)
-        button.setFlat(False)
-        button.chanName = name
-        button.chanIndex = len(self.buttons)
-        button.chanNumber = None
-        button.clicked.connect(lambda: self.click_callback(button))
-        button.setToolTip(tooltip)
-        button.triggers_blocked = False
-        self.gridbox.addWidget(button, row, col)
-        self.buttons.append(button)
-        self.named_buttons[name] = button
-        try:
-            chnum = int(name.replace("chan", ""))
-            button.chanNumber = chnum
-            if chnum in self.triggerBlocker.special:
-                self.setButtonDisabled(name)
-        except ValueError:
-            pass
+        self.colorbar.resize(w, self.baseCellSize)
+        self.colorbar.lut = self.lut
 
-    @pyqtSlot()
-    def click_callback(self, button):
-        name = button.chanName
-        cnum = button.chanNumber
+    @property
+    def nchan(self):
+        return len(self.cellOfChannel)
+
+    @property
+    def ncells(self):
+        return len(self.chanIndex)
+
+    def initCells(self):
+        """Get the (usually cached) CellLayout, and set up the per-cell display state."""
+        pitch = self.baseCellSize + self.cellGap
+        self.cellLayout = CellLayout.get(
+            self.channel_names, self.chan_per_group, self.MaxPerRow, self.baseCellSize / pitch, self.xy, self.mapKey
+        )
+        self.cellOfChannel = self.cellLayout.cellOfChannel
+        self.chanIndex = self.cellLayout.chanIndex
+        self.names = self.cellLayout.names
+        self.chanNumber = self.cellLayout.chanNumber
+        self.tooltips = self.cellLayout.tooltips
+
+        self.rates = np.zeros(self.ncells, dtype=float)
+        self.colorIndex = np.full(self.ncells, self.NO_RATE, dtype=np.intp)
+        self.blocked = np.zeros(self.ncells, dtype=bool)
+        self.texts = ["--"] * self.ncells
+        self.textKeys = np.full(self.ncells, -1, dtype=np.int64)
+        self.setZoom(self.zoom)
+        self.refreshBlocked()
+
+    @property
+    def pitch(self):
+        return (self.baseCellSize + self.cellGap) * self.zoom
+
+    def setZoom(self, zoom):
+        """Scale the map, recomputing the cells' pixel positions."""
+        self.zoom = min(max(zoom, 0.05), 4.0)
+        self.cellSize = max(1, int(round(self.baseCellSize * self.zoom)))
+        pitch = self.pitch
+        self.cellX = (self.cellLayout.col * pitch).astype(int)
+        self.cellY = (self.cellLayout.row * pitch).astype(int)
+        if self.ncells > 0:
+            self.canvas.setMinimumSize(int(self.cellX.max() + pitch), int(self.cellY.max() + pitch))
+        self.canvas.update()
+
+    def cellAt(self, x, y):
+        """Return the index of the cell containing canvas point (x, y), or None."""
+        pitch = self.pitch
+        return self.cellLayout.index.find(x / pitch, y / pitch)
+
+    def tooltip(self, cell):
+        """The cell's tooltip: channel name and position, plus a sparkline of its last 10 minutes of rates."""
+        tt = self.tooltips[cell]
+        if self.blocked[cell]:
+            tt = f"[DISABLED] {tt}"
+        history = self.owner.model.history
+        chan = self.chanIndex[cell]
+        if chan < history.nchan and history.latest is not None:
+            rates = history.sparklines([chan], seconds=600, npoints=40)[0]
+            if np.isfinite(rates).any():
+                tt += f"\n{rate_history.sparkline_text(rates)}  max {np.nanmax(rates):.2f}/s (10 min)"
+        return tt
+
+    def click_callback(self, cell):
+        name = self.names[cell]
+        cnum = int(self.chanNumber[cell])
+        if cnum < 0:
+            return
         self.triggerBlocker.toggle_channel(cnum)
         if cnum in self.triggerBlocker.special:
             print(f"Channel {name} triggering is disabled.")
-            self.setButtonDisabled(name)
-            self.owner.block_channel.emit(button.chanIndex)
+            self.setCellBlocked(cell, True)
+            self.owner.block_channel.emit(int(self.chanIndex[cell]))
         else:
             print(f"Channel {name} triggering is enabled.")
-            self.setButtonEnabled(name)
+            self.setCellBlocked(cell, False)
         self.owner.blocklist_changed.emit()
 
-    def setButtonDisabled(self, name):
-        button = self.named_buttons.get(name, None)
-        if button is None:
-            return
-        button.triggers_blocked = True
-        button.setFont(self.disabledFont)
-        button.setText("X")
-        colorString = (
-            f"QPushButton {{color: {self.disabledForeground}; background-color : {self.disabledColor};}}"
-        )
-        button.setStyleSheet(colorString)
-        tt = button.toolTip()
-        if "DISABLED" not in tt:
-            tt = f"[DISABLED] {tt}"
-            button.setToolTip(tt)
+    def cellRect(self, cell):
+        return QtCore.QRect(int(self.cellX[cell]), int(self.cellY[cell]), self.cellSize, self.cellSize)
 
-    def setButtonEnabled(self, name):
-        button = self.named_buttons.get(name, None)
-        if button is None:
-            return
-        button.triggers_blocked = False
-        button.setFont(self.enabledFont)
-        button.setText("--")
-        colorString = f"QPushButton {{color: {self.enabledForeground}; background-color : white;}}"
-        button.setStyleSheet(colorString)
-        tt = button.toolTip()
-        if "DISABLED" in tt:
-            tt = tt.replace("[DISABLED] ", "")
-            button.setToolTip(tt)
+    def setCellBlocked(self, cell, blocked):
+        self.blocked[cell] = blocked
+        if blocked:
+            self.texts[cell] = "X"
+            self.colorIndex[cell] = self.NO_RATE_DISABLED
+        else:
+            self.texts[cell] = "--"
+            self.colorIndex[cell] = self.NO_RATE
+        self.textKeys[cell] = -1
+        self.canvas.update(self.cellRect(cell))
+        self.scheduleRender()
+
+    def refreshBlocked(self):
+        """Mark as blocked exactly those cells whose channel numbers are in the trigger blocker."""
+        blocked = np.isin(self.chanNumber, list(self.triggerBlocker.special))
+        for cell in np.nonzero(blocked != self.blocked)[0]:
+            self.setCellBlocked(cell, blocked[cell])
 
     def enableAllChannels(self):
         """The list of blocked channels has been cleared. Enable all GUI elements."""
-        for (name, button) in self.named_buttons.items():
-            if button.triggers_blocked:
-                self.setButtonEnabled(name)
-
-    def deleteButtons(self):
-        for button in self.buttons:
-            if button is None:
-                continue
-            button.setParent(None)
-            button.deleteLater()
-        self.buttons = []
+        for cell in np.nonzero(self.blocked)[0]:
+            self.setCellBlocked(cell, False)
 
     def setColsRows(self, ngroups, chan_per_group):
         if ngroups != self.ngroups or len(chan_per_group) != len(self.chan_per_group):
             self.ngroups = ngroups
             self.chan_per_group = chan_per_group
-            self.initButtons()
-
-    def initButtons(self, size=22, xy=None):
-        MaxPerRow = 32  # no more than this many buttons per row
-        self.deleteButtons()
-        horizdisp = chnum = vertdisp = groupnum = i = 0
-        # wrappedrows = np.any([n > MaxPerRow for n in self.chan_per_group])
-        # groupnum means the TES's group number (actual column number in TDM)
-        # chnum means TES's channel number within the group (actual row number in TDM)
-
-        max_h = max_v = 0
-        for name in self.channel_names:
-            # No count rate buttons for Lancero error channels, or any others not called "chan*"
-            if not name.startswith("chan"):
-                self.buttons.append(None)
-                continue
-
-            tooltip = f"{name}, ({chnum} of grp {groupnum})"
-            self.addButton(horizdisp, vertdisp, size, size, name, tooltip)
-            max_h = max(horizdisp, max_h)
-            max_v = max(vertdisp, max_v)
-            horizdisp += 1
-            chnum += 1
-            i += 1
-            if chnum >= self.chan_per_group[groupnum]:
-                chnum = horizdisp = 0
-                vertdisp += 1
-                groupnum += 1
-            elif horizdisp >= MaxPerRow:
-                horizdisp = 0
-                vertdisp += 1
-        hspacer = QtWidgets.QSpacerItem(0, 0, QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Minimum)
-        self.gridbox.addItem(hspacer, 0, max_h + 1)
-        vspacer = QtWidgets.QSpacerItem(0, 0, QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Expanding)
-        self.gridbox.addItem(vspacer, max_v + 1, 0)
+            self.initCells()
 
     def setCountRates(self, countRates, colorScale):
         colorScale = float(colorScale)
         self.owner.maxRateLabel.setText(f"Max rate: {colorScale:.2f}/sec")
-        assert len(countRates) == len(self.buttons)
-        for i, cr in enumerate(countRates):
-            button = self.buttons[i]
-            if button is None:
-                continue
-            if cr < 10:
-                buttonText = f"{cr:.2f}"
-            elif cr < 100:
-                buttonText = f"{cr:.1f}"
+        assert len(countRates) == self.nchan
+        self.pendingRates = np.asarray(countRates, dtype=float)
+        self.pendingScale = colorScale
+        self.scheduleRender()
+
+    def scheduleRender(self):
+        """Render soon, but no sooner than 1/maxFPS seconds after the previous render."""
+        if self.renderTimer.isActive() or self.pendingRates is None:
+            return
+        wait = self.lastRender + 1.0 / self.maxFPS - time.time()
+        self.renderTimer.start(max(0, int(1000 * wait)))
+
+    @staticmethod
+    def displayKeys(rates):
+        """Return an integer per rate that changes exactly when its displayed text would change."""
+        return np.where(
+            rates < 10, np.round(rates * 100), np.where(rates < 100, 10000 + np.round(rates * 10), 20000 + np.round(rates))
+        ).astype(np.int64)
+
+    @pyqtSlot()
+    def render(self):
+        """Turn the latest count rates into cell texts and colors, and repaint the cells that changed."""
+        if not self.isVisible():
+            self.stale = True
+            return
+        self.stale = False
+        self.lastRender = time.time()
+        cr = self.pendingRates[self.chanIndex]
+        colorScale = self.pendingScale
+        self.rates = cr
+        colorIndex = np.where(
+            self.blocked,
+            self.DISABLED_OFFSET + self.lut_disabled.index(0.5 * cr / colorScale),
+            self.lut.index(cr / colorScale),
+        )
+        keys = self.displayKeys(cr)
+        textChanged = keys != self.textKeys
+        dirty = np.nonzero(textChanged | (colorIndex != self.colorIndex))[0]
+        for cell in np.nonzero(textChanged)[0]:
+            r = cr[cell]
+            self.texts[cell] = f"{r:.2f}" if r < 10 else f"{r:.1f}" if r < 100 else f"{r:.0f}"
+        self.textKeys = keys
+        self.colorIndex = colorIndex
+        if len(dirty) > self.ncells // 4:
+            self.canvas.update()
+        else:
+            for cell in dirty:
+                self.canvas.update(self.cellRect(cell))
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        if self.stale:
+            self.scheduleRender()
+
+
+class CountRateCanvas(QtWidgets.QWidget):
+    """The painted surface of a CountRateMap: draws all cells, and handles clicks and tooltips."""
+
+    def __init__(self, crm):
+        QtWidgets.QWidget.__init__(self)
+        self.crm = crm
+        self.setMouseTracking(False)
+
+    def paintEvent(self, event):
+        crm = self.crm
+        qp = QtGui.QPainter(self)
+        size = crm.cellSize
+        if size <= crm.imageMaxSize:
+            qp.drawImage(0, 0, self.renderImage())
+            return
+        exposed = event.rect()
+        visible = (
+            (crm.cellX + size >= exposed.left()) & (crm.cellX <= exposed.right())
+            & (crm.cellY + size >= exposed.top()) & (crm.cellY <= exposed.bottom())
+        )
+        drawText = size >= crm.textMinSize
+        if drawText:
+            qp.setPen(QtGui.QColor("gray"))
+        else:
+            qp.setPen(QtCore.Qt.NoPen)
+        for cell in np.nonzero(visible)[0]:
+            x, y = int(crm.cellX[cell]), int(crm.cellY[cell])
+            qp.setBrush(crm.palette[crm.colorIndex[cell]])
+            qp.drawRect(x, y, size - 1, size - 1)
+        if not drawText:
+            return
+        for blocked in (False, True):
+            if blocked:
+                qp.setFont(crm.disabledFont)
+                qp.setPen(crm.disabledForeground)
             else:
-                buttonText = f"{cr:.0f}"
-            button.setText(buttonText)
+                qp.setFont(crm.enabledFont)
+                qp.setPen(crm.enabledForeground)
+            for cell in np.nonzero(visible & (crm.blocked == blocked))[0]:
+                qp.drawText(crm.cellRect(cell), QtCore.Qt.AlignCenter, crm.texts[cell])
+
+    def renderImage(self):
+        """Paint all cells (each only a few pixels wide) into one QImage, with numpy."""
+        crm = self.crm
+        argb = np.array([c.rgba() for c in crm.palette], dtype=np.uint32)
+        h, w = max(1, self.height()), max(1, self.width())
+        self._image = np.full((h, w), 0xFFFFFFFF, dtype=np.uint32)  # QImage does not copy; keep a reference
+        colors = argb[crm.colorIndex]
+        for dy in range(crm.cellSize):
+            for dx in range(crm.cellSize):
+                y = crm.cellY + dy
+                x = crm.cellX + dx
+                ok = (y < h) & (x < w)
+                self._image[y[ok], x[ok]] = colors[ok]
+        return QtGui.QImage(self._image.data, w, h, 4 * w, QtGui.QImage.Format_ARGB32)
+
+    def wheelEvent(self, event):
+        if not event.modifiers() & QtCore.Qt.ControlModifier:
+            return super().wheelEvent(event)
+        factor = 1.25 if event.angleDelta().y() > 0 else 0.8
+        self.crm.setZoom(self.crm.zoom * factor)
+        event.accept()
 
-            if button.triggers_blocked:
-                textcolor = self.disabledForeground
-                scaledrate = min(0.5 * cr / colorScale, 1)
-                bgcolor = self.cmap_disabled(scaledrate, bytes=True)
+    def mousePressEvent(self, event):
+        if event.button() != QtCore.Qt.LeftButton:
+            return super().mousePressEvent(event)
+        cell = self.crm.cellAt(event.x(), event.y())
+        if cell is not None:
+            self.crm.click_callback(cell)
+
+    def event(self, event):
+        if event.type() == QtCore.QEvent.ToolTip:
+            cell = self.crm.cellAt(event.x(), event.y())
+            if cell is None:
+                QtWidgets.QToolTip.hideText()
+                event.ignore()
             else:
-                textcolor = self.enabledForeground
-                bgcolor = self.cmap(cr / colorScale, bytes=True)
-            colorString = f"rgb({bgcolor[0]},{bgcolor[1]},{bgcolor[2]})"
-            colorString = f"QPushButton {{color: {textcolor}; background-color: {colorString};}}"
-            button.setStyleSheet(colorString)
+                QtWidgets.QToolTip.showText(event.globalPos(), self.crm.tooltip(cell), self)
+            return True
+        return super().event(event)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,212 @@
+"""
+projector_cache.py
+
+An on-disk cache of encoded projector payloads (the ProjectorsBase64 and BasisBase64 of each
+ConfigureProjectorsBasis request), so that re-sending a model file that was sent before needs
+neither HDF5 reads nor encoding. Nothing here depends on Qt.
+
+The cache is content-addressed, in `directory` (by default ~/.dastard/projector_cache):
+
+* packs/<hash> holds every channel's payloads for the model file whose contents hash to <hash>,
+  one line per channel: "<channel number> <ProjectorsBase64> <BasisBase64>", in file order.
+  A pack is written alongside the first complete read of its model file, and appears only
+  once complete.
+* index.json remembers the hash of each model file by path, size, and modification time, so a
+  file that has not changed is not even re-hashed. A changed file (even with the same name)
+  hashes differently, so it is never served stale payloads.
+
+Packs' modification times record their last use. When the packs exceed `maxBytes`, the least
+recently used are deleted.
+
+Usage:
+    cache = ProjectorCache()
+    payloads = cache.load(filename)       # iterator of (cnum, projectorsBase64, basisBase64), or None
+    with cache.writer(filename) as pack:  # if it was None
+        pack.add(cnum, projectorsBase64, basisBase64)
+        ...
+        pack.commit()                     # otherwise the pack is discarded
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+
+class ProjectorCache:
+    """The cache described in the module docstring.
+
+    >>> directory = tempfile.mkdtemp()
+    >>> model = os.path.join(directory, "x_model.hdf5")
+    >>> with open(model, "wb") as fp:
+    ...     _ = fp.write(b"model")
+    >>> cache = ProjectorCache(os.path.join(directory, "cache"))
+    >>> cache.load(model) is None
+    True
+    >>> with cache.writer(model) as pack:
+    ...     pack.add(1, "AAAA", "BBBB")
+    ...     pack.add(3, "CCCC", "DDDD")
+    ...     pack.commit()
+    >>> list(cache.load(model))
+    [(1, 'AAAA', 'BBBB'), (3, 'CCCC', 'DDDD')]
+    >>> with open(model, "ab") as fp:
+    ...     _ = fp.write(b" changed")
+    >>> cache.load(model) is None
+    True
+    """
+
+    def __init__(self, directory=None, maxBytes=2 * 1024**3):
+        if directory is None:
+            directory = os.path.join(os.path.expanduser("~"), ".dastard", "projector_cache")
+        self.directory = directory
+        self.packDir = os.path.join(directory, "packs")
+        self.indexFile = os.path.join(directory, "index.json")
+        self.maxBytes = maxBytes
+        os.makedirs(self.packDir, exist_ok=True)
+
+    def _readIndex(self):
+        try:
+            with open(self.indexFile, "r", encoding="utf-8") as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return {}
+
+    def fileHash(self, filename):
+        "Return a hash of the contents of `filename`, re-hashing only if its size or mtime changed."
+        path = os.path.realpath(filename)
+        st = os.stat(path)
+        index = self._readIndex()
+        known = index.get(path)
+        if known is not None and known[:2] == [st.st_size, st.st_mtime_ns]:
+            return known[2]
+        h = hashlib.sha256()
+        with open(path, "rb") as fp:
+            for block in iter(lambda: fp.read(1 << 22), b""):
+                h.update(block)
+        filehash = h.hexdigest()[:32]
+        index[path] = [st.st_size, st.st_mtime_ns, filehash]
+        # Forget files whose packs are gone.
+        index = {p: k for p, k in index.items() if p == path or os.path.exists(self._packFile(k[2]))}
+        self._writeIndex(index)
+        return filehash
+
+    def _packFile(self, filehash):
+        return os.path.join(self.packDir, filehash)
+
+    def _writeIndex(self, index):
+        "Write `index` so that readers (maybe in another dcom) never see a partial file."
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as fp:
+                json.dump(index, fp)
+            os.replace(tmp, self.indexFile)
+        except OSError:
+            os.unlink(tmp)
+            raise
+
+    def load(self, filename):
+        """Return an iterator of (channel number, projectorsBase64, basisBase64) for every channel
+        of model file `filename`, or None if it is not cached."""
+        path = self._packFile(self.fileHash(filename))
+        try:
+            fp = open(path, "r", encoding="ascii")
+        except OSError:
+            return None
+        try:
+            os.utime(fp.fileno())  # mark as recently used
+        except OSError:
+            pass
+        return self._readPack(fp)
+
+    @staticmethod
+    def _readPack(fp):
+        with fp:
+            for line in fp:
+                cnum, projectors, basis = line.split()
+                yield int(cnum), projectors, basis
+
+    def writer(self, filename):
+        "Return a PackWriter for the payloads of model file `filename`."
+        return PackWriter(self, filename)
+
+    def evict(self):
+        "Delete the least recently used packs until they total at most `maxBytes`."
+        entries = []
+        for e in os.scandir(self.packDir):
+            if not e.name.startswith("."):
+                st = e.stat()
+                entries.append((st.st_mtime, st.st_size, e.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.maxBytes:
+                break
+            os.unlink(path)
+            total -= size
+
+
+class PackWriter:
+    """Context manager that writes the pack of model file `filename` into ProjectorCache `cache`.
+    The pack replaces any earlier one only if `commit` is called before the context exits;
+    otherwise it is discarded. Errors writing the pack are printed, not raised: a cache that
+    cannot be written should not stop anyone from reading the model file."""
+
+    def __init__(self, cache, filename):
+        self.cache = cache
+        self.filename = filename
+        self.path = None
+        self.tmp = None
+        self.fp = None
+        self.committed = False
+
+    def __enter__(self):
+        try:
+            self.path = self.cache._packFile(self.cache.fileHash(self.filename))
+            fd, self.tmp = tempfile.mkstemp(dir=self.cache.packDir, prefix=".tmp")
+            self.fp = os.fdopen(fd, "w", encoding="ascii")
+        except OSError as e:
+            self.fail(e)
+        return self
+
+    def add(self, cnum, projectorsBase64, basisBase64):
+        if self.fp is None:
+            return
+        try:
+            self.fp.write(f"{cnum} {projectorsBase64} {basisBase64}\n")
+        except OSError as e:
+            self.fail(e)
+
+    def commit(self):
+        self.committed = True
+
+    def fail(self, e):
+        print(f"Not caching projectors of {self.filename}: {e}")
+        self.discard()
+
+    def discard(self):
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+        if self.tmp is not None:
+            os.unlink(self.tmp)
+            self.tmp = None
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.fp is None:
+            return False
+        if not (self.committed and exc_type is None):
+            self.discard()
+            return False
+        try:
+            self.fp.close()
+            self.fp = None
+            os.replace(self.tmp, self.path)
+            self.tmp = None
+            self.cache.evict()
+        except OSError as e:
+            self.fail(e)
+        return False
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -1,11 +1,23 @@
 import h5py
 import numpy as np
 import base64
+import functools
+import hashlib
+import os
+import struct
+import tempfile
+import time
 from collections import OrderedDict
 import json
 
-from PyQt5 import QtWidgets
+from PyQt5 import QtCore, QtWidgets
+from PyQt5.QtCore import pyqtSignal, pyqtSlot
 from PyQt5.QtWidgets import QFileDialog
+
+from . import channel_registry
+from . import projector_cache
+from . import rpc_client
+
 #  0 -  3  Version = 1          (uint32)
 #  4       'G'                  (byte)
 #  5       'F'                  (byte)
@@ -22,6 +34,13 @@ from PyQt5.QtWidgets import QFileDialog
 #          [nrows-1,0] ... [nrows-1,ncols-1]
 
 
+@functools.lru_cache(maxsize=64)
+def _matDtype(nelements):
+    "The header above plus `nelements` float64 data elements, as one structured dtype."
+    return np.dtype([('version', np.uint32), ('magic', np.uint8, (4,)), ("nrow", np.int64),
+                     ("ncol", np.int64), ("zeros", np.int64, 2), ("data", np.float64, nelements)])
+
+
 def toMatBase64(array):
     """
     returns s,v
@@ -31,12 +50,112 @@ def toMatBase64(array):
     array - an np.array with dtype float64 (or convertable to float64)
     """
     nrow, ncol = array.shape
-    dt = np.dtype([('version', np.uint32), ('magic', np.uint8, (4,)), ("nrow", np.int64),
-                   ("ncol", np.int64), ("zeros", np.int64, 2), ("data", np.float64, nrow * ncol)])
-    a = np.array([(1, [ord("G"), ord("F"), ord("A"), 0], nrow, ncol, [0, 0], array.ravel())], dt)
-    s_bytes = base64.b64encode(a)
-    s = s_bytes.decode(encoding="ascii")
-    return s, a[0]
+    header = struct.pack("<I4sqqqq", 1, b"GFA\0", nrow, ncol, 0, 0)
+    raw = header + np.ascontiguousarray(array, dtype="<f8").tobytes()
+    s = base64.b64encode(raw).decode(encoding="ascii")
+    return s, np.frombuffer(raw, dtype=_matDtype(nrow * ncol))[0]
+
+
+def makeConfig(channelIndex, projectors, basis):
+    """Return the ConfigureProjectorsBasis request for one channel, from its Pope projectors and basis."""
+    rows, cols = projectors.shape
+    # projectors has size (n,z) where it is (rows,cols)
+    # basis has size (z,n)
+    # coefs has size (n,1)
+    # coefs (n,1) = projectors (n,z) * data (z,1)
+    # modelData (z,1) = basis (z,n) * coefs (n,1)
+    # n = number of basis (eg 3)
+    # z = record length (eg 4)
+    nBasis = rows
+    recordLength = cols
+    if nBasis > recordLength:
+        print("projectors transposed for dastard, fix projector maker")
+        projectors, basis = projectors.T, basis.T
+    return {
+        "ChannelIndex": channelIndex,
+        "ProjectorsBase64": toMatBase64(projectors)[0],
+        "BasisBase64": toMatBase64(basis)[0],
+    }
+
+
+def payloadDigest(config):
+    "Return a digest of the projectors and basis in ConfigureProjectorsBasis request `config`."
+    h = hashlib.sha256(config["ProjectorsBase64"].encode("ascii"))
+    h.update(b" ")
+    h.update(config["BasisBase64"].encode("ascii"))
+    return h.hexdigest()[:32]
+
+
+def _readDataset(h5, path):
+    "Read the whole dataset at `path` in open h5py.File `h5`, without building h5py's high-level objects."
+    dataset = h5py.h5d.open(h5.id, path.encode())
+    out = np.empty(dataset.shape, dtype=dataset.dtype)
+    dataset.read(h5py.h5s.ALL, h5py.h5s.ALL, out)
+    return out
+
+
+def iterConfigs(filename, channelNames, only=None, cache=None):
+    """
+    Yield (channel number, config) for each channel in the _model.hdf5 file `filename`, in file
+    order, where config is the dict for use in calling
+    client.call("SourceControl.ConfigureProjectorsBasis", config)
+
+    Each channel group is read and encoded only when the generator advances to it, so the first
+    configs can be sent before the whole file is read. The file is closed when the generator
+    finishes or is closed.
+    channelNames - a list of channel names, or a channel_registry.ChannelRegistry
+    only - if not None, a set of the channel numbers to read (skipping all others)
+    cache - if not None, a projector_cache.ProjectorCache. If it holds this file's payloads, they
+        are used without opening the file; otherwise a complete read (`only` is None) stores them.
+    """
+    nameNumberToIndex = getNameNumberToIndex(channelNames)
+    if not h5py.is_hdf5(filename):
+        print(f"{filename} is not a valid hdf5 file")
+        return
+    cached = None
+    if cache is not None:
+        try:
+            cached = cache.load(filename)
+        except OSError as e:
+            print(f"Not using the projector cache: {e}")
+            cache = None
+    if cached is not None:
+        for nameNumber, projectorsBase64, basisBase64 in cached:
+            if only is None or nameNumber in only:
+                yield nameNumber, {
+                    "ChannelIndex": nameNumberToIndex[nameNumber],
+                    "ProjectorsBase64": projectorsBase64,
+                    "BasisBase64": basisBase64,
+                }
+        return
+    if cache is None or only is not None:
+        yield from _readConfigs(filename, nameNumberToIndex, only)
+        return
+    with cache.writer(filename) as pack:
+        for nameNumber, config in _readConfigs(filename, nameNumberToIndex):
+            pack.add(nameNumber, config["ProjectorsBase64"], config["BasisBase64"])
+            yield nameNumber, config
+        pack.commit()
+
+
+def _readConfigs(filename, nameNumberToIndex, only=None):
+    "The part of iterConfigs that reads the model file."
+    with h5py.File(filename, "r") as h5:
+        for key in h5.keys():
+            nameNumber = int(key)
+            if only is not None and nameNumber not in only:
+                continue
+            projectors = _readDataset(h5, f"{key}/svdbasis/projectors")
+            basis = _readDataset(h5, f"{key}/svdbasis/basis")
+            yield nameNumber, makeConfig(nameNumberToIndex[nameNumber], projectors, basis)
+
+
+def modelChannelNumbers(filename):
+    "Return the list of channel numbers in the _model.hdf5 file `filename` (empty if it is not HDF5)."
+    if not h5py.is_hdf5(filename):
+        return []
+    with h5py.File(filename, "r") as h5:
+        return [int(key) for key in h5.keys()]
 
 
 def getConfigs(filename, channelNames):
@@ -46,59 +165,21 @@ def getConfigs(filename, channelNames):
     to set Projectors and Bases
     extracts the channel numbers and projectors and basis from the h5 file
     filename - points to a _model.hdf5 file created by Pope
+    channelNames - a list of channel names, or a channel_registry.ChannelRegistry
     """
-    nameNumberToIndex = getNameNumberToIndex(channelNames)
-    out = OrderedDict()
-    if not h5py.is_hdf5(filename):
-        print(f"{filename} is not a valid hdf5 file")
-        return out
-    h5 = h5py.File(filename, "r")
-    for key in list(h5.keys()):
-        nameNumber = int(key)
-        channelIndex = nameNumberToIndex[nameNumber]
-        projectors = h5[key]["svdbasis"]["projectors"][()]
-        basis = h5[key]["svdbasis"]["basis"][()]
-        rows, cols = projectors.shape
-        # projectors has size (n,z) where it is (rows,cols)
-        # basis has size (z,n)
-        # coefs has size (n,1)
-        # coefs (n,1) = projectors (n,z) * data (z,1)
-        # modelData (z,1) = basis (z,n) * coefs (n,1)
-        # n = number of basis (eg 3)
-        # z = record length (eg 4)
-        nBasis = rows
-        recordLength = cols
-        if nBasis > recordLength:
-            print("projectors transposed for dastard, fix projector maker")
-            config = {
-                "ChannelIndex": channelIndex,
-                "ProjectorsBase64": toMatBase64(projectors.T)[0],
-                "BasisBase64": toMatBase64(basis.T)[0],
-            }
-        else:
-            config = {
-                "ChannelIndex": channelIndex,
-                "ProjectorsBase64": toMatBase64(projectors)[0],
-                "BasisBase64": toMatBase64(basis)[0],
-            }
-        out[nameNumber] = config
-    return out
+    return OrderedDict(iterConfigs(filename, channelNames))
 
 
 # dastard channelNames go from chan1 to chanN and err1 to errN
 # we need to mape from channelName to channelIndex (0-2N-1)
 def getNameNumberToIndex(channelNames):
-    nameNumberToIndex = {}
-    for (i, name) in enumerate(channelNames):
-        if not name.startswith("chan"):
-            continue
-        nameNumber = int(name[4:])
-        nameNumberToIndex[nameNumber] = i
-        # for now since we only use this with lancero sources, error for non-odd index
-        # if i % 2 != 1:
-        #     raise Exception(
-        #         "all fb channelIndices on a lancero source are odd, we shouldn't load projectors for even channelIndices")
-    return nameNumberToIndex
+    """Return a dict from signal channel number to channel index.
+
+    `channelNames` may be a list of names or a channel_registry.ChannelRegistry (whose map is
+    already built, so the shared registry of dcom should be passed when there is one)."""
+    if not isinstance(channelNames, channel_registry.ChannelRegistry):
+        channelNames = channel_registry.ChannelRegistry(channelNames)
+    return channelNames.numberToIndex
 #
 # def remapConfigs(configs0, channelNames):
 #     nameNumberToIndex = getNameNumberToIndex(channelNames)
@@ -116,29 +197,356 @@ def getFileNameWithDialog(qtparent, startdir):
     return fileName
 
 
-def sendProjectors(qtparent, fileName, channel_names, client):
-    print(f"sendProjectors: opening: {fileName}")
-    configs = getConfigs(fileName, channel_names)
-    print(f"sendProjectors: Sending model for {len(configs)} chans")
-    success_chans = []
-    failures = OrderedDict()
-    # n_expected = np.sum([s.startswith("chan") for s in channel_names])
-
-    for channelIndex, config in list(configs.items()):
-        # print("sending ProjectorsBasis for {}".format(channelIndex))
-        okay, error = client.call(
-            "SourceControl.ConfigureProjectorsBasis", config, verbose=False, errorBox=False, throwError=False)
-        if okay:
-            success_chans.append(channelIndex)
+class ProjectorUploadReport:
+    """The outcome of one projector upload, channel by channel.
+
+    `channels` maps each channel number in the model file to a dict with "ChannelIndex" (None
+    until sent), "Status" ("ok", "failed", "skipped", or "not sent"), "Attempts", "Error" (the
+    last one), and "Digest" (see payloadDigest). Channels are skipped when Dastard already has
+    the same payload. `error` is set if something stopped the whole upload, such as an unreadable
+    file.
+    """
+
+    def __init__(self, fileName, channelNumbers=()):
+        self.fileName = fileName
+        self.channels = OrderedDict((cnum, self._newEntry()) for cnum in channelNumbers)
+        self.error = None
+        self.cancelled = False
+        self.elapsed = 0.0
+
+    @staticmethod
+    def _newEntry():
+        return {"ChannelIndex": None, "Status": "not sent", "Attempts": 0, "Error": None, "Digest": None}
+
+    def sent(self, cnum, channelIndex, digest=None):
+        entry = self.channels.setdefault(cnum, self._newEntry())
+        entry.update(ChannelIndex=channelIndex, Digest=digest)
+        entry["Attempts"] += 1
+
+    def skipped(self, cnum, channelIndex, digest):
+        entry = self.channels.setdefault(cnum, self._newEntry())
+        entry.update(ChannelIndex=channelIndex, Digest=digest, Status="skipped")
+
+    def succeeded(self, cnum):
+        self.channels[cnum].update(Status="ok", Error=None)
+
+    def failed(self, cnum, error):
+        self.channels[cnum].update(Status="failed", Error=str(error))
+
+    def withStatus(self, status):
+        "Return the channel numbers whose status is `status`."
+        return [cnum for cnum, entry in self.channels.items() if entry["Status"] == status]
+
+    def success(self):
+        nloaded = len(self.withStatus("ok")) + len(self.withStatus("skipped"))
+        return self.error is None and not self.cancelled and nloaded == len(self.channels)
+
+    def updateDigests(self, digests):
+        """Update `digests` (a dict mapping channel index to the digest of the payload Dastard
+        has) with this upload: add the channels sent ok, and remove those that failed."""
+        for entry in self.channels.values():
+            if entry["Status"] == "ok":
+                digests[entry["ChannelIndex"]] = entry["Digest"]
+            elif entry["Status"] == "failed":
+                digests.pop(entry["ChannelIndex"], None)
+
+    def summary(self):
+        nok, nskipped, nfailed, nunsent = (len(self.withStatus(s)) for s in ("ok", "skipped", "failed", "not sent"))
+        nretried = sum(1 for entry in self.channels.values() if entry["Attempts"] > 1)
+        text = (f"Projectors from {self.fileName}: {nok} channels sent ok, {nskipped} unchanged (skipped), "
+                f"{nfailed} failed, {nunsent} not sent ({nretried} retried) in {self.elapsed:.1f} s")
+        if self.cancelled:
+            text += " (cancelled)"
+        if self.error is not None:
+            text += f"\nUpload stopped: {self.error}"
+        return text
+
+    def failures(self):
+        "Return a dict mapping each failed channel number to its last error."
+        return OrderedDict((cnum, self.channels[cnum]["Error"]) for cnum in self.withStatus("failed"))
+
+    def failuresByError(self):
+        "Return text listing each distinct error with the channel numbers that failed with it."
+        byError = OrderedDict()
+        for cnum, error in self.failures().items():
+            byError.setdefault(error, []).append(cnum)
+        return "\n".join(f"{error}: channels {channel_registry.format_ranges(cnums)}"
+                         for error, cnums in byError.items())
+
+    def toJSON(self):
+        obj = {
+            "File": self.fileName,
+            "Error": self.error,
+            "Cancelled": self.cancelled,
+            "Elapsed": self.elapsed,
+            "Channels": {str(cnum): entry for cnum, entry in self.channels.items()},
+        }
+        return json.dumps(obj, indent=1)
+
+
+class ProjectorUploader(QtCore.QObject):
+    """QObject that reads a model file and sends its projectors to Dastard, to run in a QThread.
+
+    Up to `window` requests are in flight at once on its own JSON-RPC connection. Channels that
+    fail (an error reply or a lost connection) are retried, and only they are (re-read from the
+    file, so no configs are held in memory), up to `maxRetries` times, waiting `backoff` seconds
+    before the first retry and twice as long before each next.
+    Encoded payloads come from, and go to, `cache` (a projector_cache.ProjectorCache, or None).
+    Channels whose payloads have the same digest in `lastSent` (a dict mapping channel index to
+    payloadDigest, for what Dastard already has) are skipped.
+    Set `cancel` to stop sending; replies to requests in flight are still collected.
+    """
+
+    progress = pyqtSignal(int, int)  # channels finished so far, and total
+    finished = pyqtSignal(object)  # a ProjectorUploadReport
+
+    window = 16
+    maxRetries = 3
+    backoff = 0.5  # seconds
+    progressInterval = 0.1  # seconds between progress signals
+
+    def __init__(self, host, port, fileName, channelNames, cache=None, lastSent=None):
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.fileName = fileName
+        self.channelNames = list(channelNames)
+        self.cache = cache
+        self.lastSent = {} if lastSent is None else dict(lastSent)
+        self.cancel = False
+        self.report = None
+        self.pipe = None
+        self.connectError = None
+        self.lastProgress = 0.0
+
+    @pyqtSlot()
+    def run(self):
+        t0 = time.time()
+        self.report = report = ProjectorUploadReport(self.fileName, modelChannelNumbers(self.fileName))
+        try:
+            self.uploadWithRetries()
+        except Exception as e:
+            report.error = f"{type(e).__name__}: {e}"
+        finally:
+            if self.pipe is not None:
+                self.pipe.close()
+                self.pipe = None
+        report.cancelled = self.cancel
+        report.elapsed = time.time() - t0
+        self.emitProgress(force=True)
+        self.finished.emit(report)
+
+    def uploadWithRetries(self):
+        if not h5py.is_hdf5(self.fileName):
+            raise ValueError(f"{self.fileName} is not a valid hdf5 file")
+        self.upload(iterConfigs(self.fileName, self.channelNames, cache=self.cache))
+        for retry in range(self.maxRetries):
+            failed = self.report.withStatus("failed")
+            if len(failed) == 0 or not self.wait(self.backoff * 2**retry):
+                break
+            print(f"Retrying projectors for {len(failed)} channels")
+            self.upload(iterConfigs(self.fileName, self.channelNames, only=set(failed), cache=self.cache))
+
+    def wait(self, seconds):
+        "Sleep for `seconds` unless cancelled first. Return whether not cancelled."
+        end = time.time() + seconds
+        while not self.cancel and time.time() < end:
+            time.sleep(0.05)
+        return not self.cancel
+
+    def upload(self, configs):
+        "Send each (channel number, config) of `configs`, keeping up to `window` in flight."
+        self.connectError = None
+        inflight = {}  # request id -> channel number
+        for cnum, config in configs:
+            if self.cancel:
+                break
+            digest = payloadDigest(config)
+            if self.lastSent.get(config["ChannelIndex"]) == digest:
+                self.report.skipped(cnum, config["ChannelIndex"], digest)
+                self.emitProgress()
+                continue
+            while len(inflight) >= self.window:
+                self.receive(inflight)
+            self.send(cnum, config, digest, inflight)
+        while len(inflight) > 0:
+            self.receive(inflight)
+
+    def send(self, cnum, config, digest, inflight):
+        self.report.sent(cnum, config["ChannelIndex"], digest)
+        try:
+            reqid = self.connection().send("SourceControl.ConfigureProjectorsBasis", config)
+        except OSError as e:
+            self.report.failed(cnum, e)
+            self.dropConnection(inflight, e)
+            return
+        inflight[reqid] = cnum
+
+    def connection(self):
+        "Return the open JSONPipeline, opening one if needed. Raises OSError if that fails."
+        if self.pipe is None:
+            if self.connectError is not None:
+                # Don't wait for another connection timeout on every remaining channel.
+                raise OSError(self.connectError)
+            try:
+                self.pipe = rpc_client.JSONPipeline((self.host, self.port))
+            except OSError as e:
+                self.connectError = f"cannot connect: {e}"
+                raise OSError(self.connectError) from e
+        return self.pipe
+
+    def receive(self, inflight):
+        try:
+            reqid, _result, error = self.pipe.receive()
+        except (OSError, ValueError) as e:
+            self.dropConnection(inflight, f"no reply: {e}")
+            return
+        cnum = inflight.pop(reqid, None)
+        if cnum is None:
+            return
+        if error is None:
+            self.report.succeeded(cnum)
         else:
-            failures[channelIndex] = error
-
-    success = len(failures) == 0
-    result = f"success on channelIndices (not channelName): {sorted(success_chans)}\n" + \
-        "failures:\n" + json.dumps(failures, sort_keys=True, indent=4)
-    if not success:
-        resultBox = QtWidgets.QMessageBox(qtparent)
-        resultBox.setText(result)
-        resultBox.show()
-    print(result)
-    return success
+            self.report.failed(cnum, error)
+        self.emitProgress()
+
+    def dropConnection(self, inflight, error):
+        "Count every request in flight as failed, and close the connection (the next send reopens it)."
+        for cnum in inflight.values():
+            self.report.failed(cnum, error)
+        inflight.clear()
+        if self.pipe is not None:
+            self.pipe.close()
+            self.pipe = None
+        self.emitProgress()
+
+    def emitProgress(self, force=False):
+        now = time.time()
+        if force or now - self.lastProgress >= self.progressInterval:
+            self.lastProgress = now
+            report = self.report
+            self.progress.emit(len(report.channels) - len(report.withStatus("not sent")), len(report.channels))
+
+
+class ProjectorUploadDialog(QtWidgets.QProgressDialog):
+    """A cancellable progress dialog that runs a ProjectorUploader in its own QThread, and shows
+    the report when it finishes. Its `reportReady` signal relays the uploader's report.
+    If `lastSent` is a dict (see ProjectorUploader), it is updated with the upload's results."""
+
+    reportReady = pyqtSignal(object)  # a ProjectorUploadReport
+
+    def __init__(self, parent, host, port, fileName, channelNames, cache=None, lastSent=None):
+        super().__init__(f"Sending projectors from {os.path.basename(fileName)}", "Cancel", 0, 0, parent)
+        self.setWindowTitle("Sending projectors")
+        self.setMinimumDuration(500)  # ms
+        self.setAutoReset(False)
+        self.lastSent = lastSent
+        self.uploader = ProjectorUploader(host, port, fileName, channelNames, cache, lastSent)
+        self.uploadThread = QtCore.QThread()
+        self.uploader.moveToThread(self.uploadThread)
+        self.uploader.progress.connect(self.updateProgress)
+        self.uploader.finished.connect(self.uploadFinished)
+        self.canceled.connect(self.cancelUpload)
+        self.uploadThread.started.connect(self.uploader.run)
+
+    def start(self):
+        self.uploadThread.start()
+
+    @pyqtSlot()
+    def cancelUpload(self):
+        self.uploader.cancel = True
+        self.setLabelText("Cancelling...")
+
+    @pyqtSlot(int, int)
+    def updateProgress(self, ndone, total):
+        self.setMaximum(max(1, total))
+        self.setValue(ndone)
+
+    @pyqtSlot(object)
+    def uploadFinished(self, report):
+        self.uploadThread.quit()
+        self.uploadThread.wait()
+        self.close()
+        if self.lastSent is not None:
+            report.updateDigests(self.lastSent)
+        result = report.summary()
+        if len(report.failures()) > 0:
+            result += "\nfailures:\n" + report.failuresByError()
+        print(result)
+        if not report.success():
+            resultBox = QtWidgets.QMessageBox(self.parent())
+            resultBox.setText(result)
+            resultBox.show()
+        self.reportReady.emit(report)
+        self.deleteLater()
+
+
+def sendProjectors(qtparent, fileName, channel_names, host, port, lastSent=None):
+    """Start sending the projectors in `fileName` to the Dastard at `host`:`port`, off the GUI
+    thread, with a progress dialog. Returns the ProjectorUploadDialog; connect to its `reportReady`
+    signal to receive the ProjectorUploadReport.
+    Encoded projectors are cached on disk (see projector_cache), so re-sending a file is fast.
+    If `lastSent` is a dict mapping channel index to the payloadDigest of the projectors Dastard
+    has, channels that have not changed are skipped, and the dict is updated when done."""
+    print(f"sendProjectors: opening: {fileName}")
+    if isinstance(channel_names, channel_registry.ChannelRegistry):
+        channel_names = channel_names.names
+    try:
+        cache = projector_cache.ProjectorCache()
+    except OSError as e:
+        print(f"Not caching projectors: {e}")
+        cache = None
+    dialog = ProjectorUploadDialog(qtparent, host, port, fileName, channel_names, cache, lastSent)
+    dialog.start()
+    return dialog
+
+
+def writeBenchmarkModel(filename, nchan=4000, nbasis=6, nsamples=500):
+    "Write a _model.hdf5 file of `nchan` channels in Pope's layout, with random projectors and basis."
+    rng = np.random.default_rng(0)
+    with h5py.File(filename, "w") as h5:
+        for cnum in range(1, nchan + 1):
+            svd = h5.create_group(f"{cnum}/svdbasis")
+            svd["projectors"] = rng.standard_normal((nbasis, nsamples))
+            svd["basis"] = rng.standard_normal((nsamples, nbasis))
+
+
+def benchmark(nchan=4000):
+    """Time reading and encoding a `nchan`-channel model file, all at once (getConfigs) and
+    streamed (iterConfigs), including how soon the first config is ready to send. Then time
+    iterConfigs with a ProjectorCache: cold, warm, and after a few channels of the file change."""
+    names = [f"{p}{c}" for c in range(1, nchan + 1) for p in ("err", "chan")]
+    registry = channel_registry.ChannelRegistry(names)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, "benchmark_model.hdf5")
+        writeBenchmarkModel(filename, nchan)
+        print(f"{nchan} channels, {os.path.getsize(filename) / 1e6:.0f} MB model file")
+        t0 = time.perf_counter()
+        configs = getConfigs(filename, registry)
+        print(f"getConfigs:  {time.perf_counter() - t0:.3f} s for {len(configs)} configs")
+        t0 = time.perf_counter()
+        first = None
+        for _ in iterConfigs(filename, registry):
+            if first is None:
+                first = time.perf_counter() - t0
+        print(f"iterConfigs: {time.perf_counter() - t0:.3f} s, first config after {first * 1e3:.1f} ms")
+
+        def timeCached(label):
+            t0 = time.perf_counter()
+            n = sum(1 for _ in iterConfigs(filename, registry, cache=cache))
+            print(f"{label} {time.perf_counter() - t0:.3f} s for {n} configs")
+
+        cache = projector_cache.ProjectorCache(os.path.join(tmpdir, "cache"))
+        timeCached("cold cache: ")
+        timeCached("warm cache: ")
+        with h5py.File(filename, "r+") as h5:
+            for cnum in range(1, nchan + 1, max(1, nchan // 10)):
+                h5[f"{cnum}/svdbasis/projectors"][0, 0] += 1.0
+        timeCached("10 changed: ")
+        timeCached("warm again: ")
+
+
+if __name__ == "__main__":
+    import sys
+    if "--benchmark" in sys.argv:
+        benchmark()
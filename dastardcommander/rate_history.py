@@ -0,0 +1,271 @@
+"""
+rate_history.py
+
+A bounded-memory history of per-channel trigger counts, as reported in Dastard's TRIGGERRATE
+messages. Nothing here depends on Qt.
+
+The history is kept in tiers of decreasing time resolution. By default:
+* every message (normally 1 per second) for the last 10 minutes,
+* 10-second buckets for the last 3 hours, and
+* 1-minute buckets for the last 12 hours.
+Each tier is a fixed-size ring of rows (one row = one time bin, one column per channel), so
+memory use is set when the history is created and does not grow during a run.
+
+Usage:
+    history = RateHistory(nchan)
+    history.add(msg["CountsSeen"], msg["Duration"] / 1e9)   # for each TRIGGERRATE message
+    times, rates = history.query(start=time.time() - 3600)  # finest tier reaching back 1 hour
+    lines = history.sparklines([0, 5, 9], seconds=600)      # 60-point summary per channel
+    history.save_hdf5("rates.hdf5", channel_names)
+"""
+
+import time
+
+import h5py
+import numpy as np
+
+DEFAULT_TIERS = ((0.0, 600), (10.0, 1080), (60.0, 720))
+
+
+class RateTier:
+    """One resolution of a RateHistory: a ring of `length` time bins of width `width` seconds.
+
+    With width 0, every call to `add` is its own row; otherwise counts accumulate into the
+    current bin, which is stored once a later call falls into a new bin.
+    """
+
+    def __init__(self, width, length, nchan):
+        self.width = width
+        self.length = length
+        self.times = np.zeros(length, dtype=float)  # end time of each bin
+        self.durations = np.zeros(length, dtype=float)  # seconds of data in each bin
+        self.counts = np.zeros((length, nchan), dtype=np.uint32)
+        self.n = 0
+        self.next = 0
+        self.pending = np.zeros(nchan, dtype=np.int64)
+        self.pendingDuration = 0.0
+        self.pendingBin = None
+
+    def _append(self, t, duration, counts):
+        self.times[self.next] = t
+        self.durations[self.next] = duration
+        self.counts[self.next] = counts
+        self.next = (self.next + 1) % self.length
+        self.n = min(self.n + 1, self.length)
+
+    def add(self, t, duration, counts):
+        if self.width <= 0:
+            self._append(t, duration, counts)
+            return
+        b = int(t // self.width)
+        if self.pendingBin is not None and b != self.pendingBin:
+            self._append((self.pendingBin + 1) * self.width, self.pendingDuration, self.pending)
+            self.pending[:] = 0
+            self.pendingDuration = 0.0
+        self.pending += counts
+        self.pendingDuration += duration
+        self.pendingBin = b
+
+    def ordered(self):
+        """Return (times, durations, counts) of the stored bins, oldest first."""
+        idx = (self.next - self.n + np.arange(self.n)) % self.length
+        return self.times[idx], self.durations[idx], self.counts[idx]
+
+    @property
+    def oldest(self):
+        if self.n == 0:
+            return None
+        return self.times[(self.next - self.n) % self.length]
+
+    @property
+    def nbytes(self):
+        return self.counts.nbytes + self.times.nbytes + self.durations.nbytes
+
+
+class RateHistory:
+    """Per-channel trigger counts over time, at several resolutions (see the module docstring).
+
+    >>> h = RateHistory(nchan=2, tiers=((0, 3), (10, 4)))
+    >>> for t in range(25):
+    ...     h.add([1, t % 2], duration=1.0, t=float(t))
+    >>> times, rates = h.query()
+    >>> times.tolist(), rates[:, 0].tolist()
+    ([22.0, 23.0, 24.0], [1.0, 1.0, 1.0])
+    >>> times, rates = h.query(start=0)
+    >>> times.tolist(), rates.tolist()
+    ([10.0, 20.0], [[1.0, 0.5], [1.0, 0.5]])
+    """
+
+    def __init__(self, nchan=0, tiers=DEFAULT_TIERS):
+        self.tierSpecs = tuple(tiers)
+        self.reset(nchan)
+
+    def reset(self, nchan=None):
+        """Forget all history (and change the number of channels, if `nchan` is given)."""
+        if nchan is not None:
+            self.nchan = nchan
+        self.tiers = [RateTier(width, length, self.nchan) for width, length in self.tierSpecs]
+        self.latest = None
+
+    @property
+    def nbytes(self):
+        return sum(t.nbytes for t in self.tiers)
+
+    def add(self, counts, duration=1.0, t=None):
+        """Add one vector of per-channel trigger counts, seen in `duration` seconds ending at time `t`."""
+        counts = np.asarray(counts)
+        if len(counts) != self.nchan:
+            self.reset(len(counts))
+        if t is None:
+            t = time.time()
+        for tier in self.tiers:
+            tier.add(t, duration, counts)
+        self.latest = t
+
+    def chooseTier(self, start=None):
+        """Return the finest tier that reaches back to time `start` (or the one reaching back farthest)."""
+        if start is None:
+            return self.tiers[0]
+        best = self.tiers[0]
+        for tier in self.tiers:
+            oldest = tier.oldest
+            if oldest is None:
+                continue
+            if oldest - max(tier.width, 1.0) <= start:
+                return tier
+            if best.oldest is None or oldest < best.oldest:
+                best = tier
+        return best
+
+    def query(self, chans=None, start=None, stop=None):
+        """Return (times, rates) from the finest tier that covers `start`.
+
+        `times` are the end times of each bin (seconds since the epoch); `rates` is an array of
+        shape (len(times), nchan) in counts per second, or only the columns in `chans`, if given.
+        """
+        tier = self.chooseTier(start)
+        times, durations, counts = tier.ordered()
+        use = np.ones(len(times), dtype=bool)
+        if start is not None:
+            use &= times > start
+        if stop is not None:
+            use &= times <= stop
+        use &= durations > 0
+        if chans is not None:
+            counts = counts[:, np.asarray(chans, dtype=np.intp)]
+        rates = counts[use] / durations[use, np.newaxis]
+        return times[use], rates
+
+    def sparklines(self, chans=None, seconds=600.0, npoints=60):
+        """Return an array of shape (nchan or len(chans), npoints): mean rates over the last `seconds`.
+
+        Points with no data are NaN.
+        """
+        nout = self.nchan if chans is None else len(chans)
+        if self.latest is None:
+            return np.full((nout, npoints), np.nan)
+        start = self.latest - seconds
+        times, rates = self.query(chans, start=start)
+        bins = np.clip(((times - start) * (npoints / seconds)).astype(np.intp) - 1, 0, npoints - 1)
+        sums = np.zeros((npoints, nout))
+        np.add.at(sums, bins, rates)
+        nper = np.bincount(bins, minlength=npoints)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return (sums / nper[:, np.newaxis]).T
+
+    def save_hdf5(self, filename, channel_names=None):
+        """Write every tier of the history to an HDF5 file, one group per tier."""
+        with h5py.File(filename, "w") as h5:
+            h5.attrs["saved"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+            if channel_names is not None:
+                h5.create_dataset("channel_names", data=np.array(channel_names, dtype="S"))
+            for i, tier in enumerate(self.tiers):
+                times, durations, counts = tier.ordered()
+                g = h5.create_group(f"tier{i}")
+                g.attrs["bin_seconds"] = tier.width
+                g.create_dataset("time", data=times)
+                g.create_dataset("duration", data=durations)
+                g.create_dataset("counts", data=counts, compression="gzip", shuffle=True)
+
+
+class RateWaterfall:
+    """Recent per-channel rates as a (depth, nchan) uint8 image, one row per update.
+
+    Rates are mapped logarithmically from [vmin, vmax] counts per second onto 1-255 (0 means no
+    counts), so an 8-bit lookup table can color them. Rows form a ring buffer: the array is
+    allocated once and each update overwrites the oldest row in place. Rows are padded to a
+    multiple of 4 bytes, so the array can back a QImage directly.
+
+    >>> w = RateWaterfall(nchan=3, depth=4)
+    >>> for r in ([0, 0.1, 1e4], [1, 10, 100], [0, 0, 0]):
+    ...     w.add(r)
+    >>> w.image[:3, :3].tolist(), w.segments()
+    ([[0, 1, 255], [52, 103, 153], [0, 0, 0]], [(0, 3)])
+    >>> w.add([1, 1, 1]); w.add([2, 2, 2]); w.segments()
+    [(1, 3), (0, 1)]
+    """
+
+    def __init__(self, nchan=0, depth=7200, vmin=0.1, vmax=1e4):
+        self.depth = depth
+        self.vmin = vmin
+        self.vmax = vmax
+        self.reset(nchan)
+
+    def reset(self, nchan=None):
+        if nchan is not None:
+            self.nchan = nchan
+        self.stride = max(4, 4 * ((self.nchan + 3) // 4))
+        self.image = np.zeros((self.depth, self.stride), dtype=np.uint8)
+        self.times = np.zeros(self.depth, dtype=float)
+        self.n = 0
+        self.next = 0
+
+    def scale(self, rates):
+        """Map rates to uint8 levels: 0 for no counts, else log-scaled from vmin (1) to vmax (255)."""
+        rates = np.asarray(rates, dtype=float)
+        f = np.log(np.maximum(rates, self.vmin) / self.vmin) / np.log(self.vmax / self.vmin)
+        levels = 1 + np.round(np.clip(f, 0, 1) * 254)
+        return np.where(rates > 0, levels, 0).astype(np.uint8)
+
+    def add(self, rates, t=None):
+        rates = np.asarray(rates)
+        if len(rates) != self.nchan:
+            self.reset(len(rates))
+        self.image[self.next, :self.nchan] = self.scale(rates)
+        self.times[self.next] = time.time() if t is None else t
+        self.next = (self.next + 1) % self.depth
+        self.n = min(self.n + 1, self.depth)
+
+    def segments(self):
+        """Return [(first row, number of rows), ...] of the stored rows in time order, oldest first."""
+        if self.n < self.depth:
+            return [(0, self.n)] if self.n > 0 else []
+        return [(s, c) for s, c in ((self.next, self.depth - self.next), (0, self.next)) if c > 0]
+
+    def row_age(self, k):
+        """Return the time of the k-th most recent row (k=0 is the newest)."""
+        return self.times[(self.next - 1 - k) % self.depth]
+
+
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+
+
+def sparkline_text(values):
+    """Render a sequence of values as a string of Unicode block characters (NaN as a space).
+
+    >>> sparkline_text([0, 1, 2, 3, float("nan"), 7])
+    '▁▂▃▄ █'
+    """
+    v = np.asarray(values, dtype=float)
+    good = np.isfinite(v)
+    if not good.any():
+        return " " * len(v)
+    lo, hi = v[good].min(), v[good].max()
+    scale = (len(SPARK_CHARS) - 1) / (hi - lo) if hi > lo else 0.0
+    levels = np.round((np.where(good, v, lo) - lo) * scale).astype(int)
+    return "".join(SPARK_CHARS[k] if g else " " for k, g in zip(levels, good))
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,331 @@
+"""
+record_pipeline.py
+
+An optional multiprocess pipeline for decoding Dastard's record stream when there are too many
+channels (or too high a trigger rate) for one Python thread holding the GIL.
+
+The channels are split across a pool of worker processes. Each worker opens its own ZMQ
+subscription to the data port, subscribing only to the 2-byte channel-index prefixes of its own
+channels, so libzmq does the sharding and records for other channels never reach Python. Each
+worker decodes its records and feeds them to "consumers" (e.g., `BaselineConsumer`,
+`HistogramConsumer`) that run in the worker, where the data land. The decoded records never
+leave the worker. On request, each worker sends back only what its consumers learned since the
+last request (`delta`), and the GUI process applies that to its own copy of each consumer
+(`apply`), so polling costs little however long the pipeline runs.
+
+Nothing here depends on Qt, and nothing here blocks the caller. Usage:
+    pipeline = RecordPipeline(host, baseport, channels, consumers=[BaselineConsumer(nchan)])
+    pipeline.start()
+    ...
+    consumers = pipeline.collect()            # the updated consumers, or None until all workers reply
+    pipeline.stop()
+"""
+
+import multiprocessing
+import queue
+import struct
+
+import numpy as np
+import zmq
+
+from . import histograms
+from . import record_stream
+
+
+def pretrigger_noise(records, npresamples):
+    """Return a robust estimate of the noise (standard deviation) in each row of `records`, from
+    its first `npresamples` samples (all samples if `npresamples` is 0 or too large).
+
+    The estimate is the interquartile range divided by 1.349 (which equals the standard deviation
+    for Gaussian noise, but ignores the few samples of any pulse), or the ordinary standard
+    deviation where that is zero (a very quiet channel, where most samples are equal).
+
+    >>> x = np.array([[10, 12, 9, 11, 10, 14, 8, 10, 500], [5, 5, 5, 6, 5, 5, 5, 5, 5]])
+    >>> pretrigger_noise(x, 8).round(3).tolist()
+    [1.483, 0.331]
+    """
+    records = np.asarray(records)
+    if 0 < npresamples < records.shape[-1]:
+        records = records[..., :npresamples]
+    n = records.shape[-1]
+    lo, hi = n // 4, (3 * n) // 4
+    quartiles = np.partition(records, [lo, hi], axis=-1)
+    iqr = quartiles[..., hi].astype(float) - quartiles[..., lo]
+    return np.where(iqr > 0, iqr / 1.349, records.std(axis=-1))
+
+
+class BaselineConsumer:
+    """Estimate each channel's baseline from the median of each of its records, and its noise
+    from the pretrigger samples of each record.
+
+    The algorithm is that of configure_level_triggers.BaselineFinder: keep the medians of the
+    first `records_required` records, and report the lowest (for positive-going pulses) or
+    highest (negative-going) of them. The noise is the median over the same records of
+    `pretrigger_noise`. The medians and noise values are stored in (nchan, records_required)
+    arrays and each batch is inserted with a few vectorized operations.
+    """
+
+    def __init__(self, nchan, positive=True, records_required=40):
+        self.positive = positive
+        self.records_required = records_required
+        self.medians = np.zeros((nchan, records_required), dtype=float)
+        self.sigmas = np.zeros((nchan, records_required), dtype=float)
+        self.filled = np.zeros(nchan, dtype=np.int64)
+        self.sent = np.zeros(nchan, dtype=np.int64)  # self.filled as of the last delta()
+
+    def reset(self):
+        self.filled[:] = 0
+
+    def update(self, headers, records):
+        n = len(records)
+        if n == 0:
+            return
+        chans = np.asarray(headers["chan"], dtype=np.intp)
+        meds = np.zeros(n, dtype=float)
+        sigmas = np.zeros(n, dtype=float)
+        lengths = np.array([len(r) for r in records], dtype=np.int64)
+        npre = np.asarray(headers["npresamples"], dtype=np.int64)
+        shapes = (lengths << 32) | npre
+        for shape in np.unique(shapes):
+            idx = np.nonzero(shapes == shape)[0]
+            block = np.vstack([records[i] for i in idx])
+            meds[idx] = np.median(block, axis=1)
+            sigmas[idx] = pretrigger_noise(block, npre[idx[0]])
+
+        # Rank each record among those of its own channel in this batch, then insert it after
+        # the medians that channel already has (if there is room).
+        order = np.argsort(chans, kind="stable")
+        c = chans[order]
+        start = np.ones(n, dtype=bool)
+        start[1:] = c[1:] != c[:-1]
+        group_start = np.maximum.accumulate(np.where(start, np.arange(n), 0))
+        pos = self.filled[c] + np.arange(n) - group_start
+        ok = pos < self.records_required
+        self.medians[c[ok], pos[ok]] = meds[order][ok]
+        self.sigmas[c[ok], pos[ok]] = sigmas[order][ok]
+        self.filled += np.bincount(c[ok], minlength=len(self.filled))
+
+    def completed(self, channels):
+        """Return a boolean array: has each of `channels` seen enough records?"""
+        return self.filled[np.asarray(channels, dtype=np.intp)] >= self.records_required
+
+    def progress(self, channels):
+        """Return the number of records received so far, summed over `channels` (each capped)."""
+        return int(np.minimum(self.filled[np.asarray(channels, dtype=np.intp)], self.records_required).sum())
+
+    def baselines(self, channels):
+        """Return a dict mapping each of `channels` (that has any data) to its baseline estimate."""
+        result = {}
+        for c in channels:
+            n = self.filled[c]
+            if n == 0:
+                continue
+            m = self.medians[c, :min(n, self.records_required)]
+            result[c] = m.min() if self.positive else m.max()
+        return result
+
+    def noise(self, channels):
+        """Return a dict mapping each of `channels` (that has any data) to its noise estimate."""
+        channels = np.asarray(channels, dtype=np.intp)
+        n = np.minimum(self.filled[channels], self.records_required)
+        have = n > 0
+        channels, n = channels[have], n[have]
+        # Ignore the unfilled part of each row by making it NaN.
+        s = np.where(np.arange(self.records_required) < n[:, None], self.sigmas[channels], np.nan)
+        return dict(zip(channels.tolist(), np.nanmedian(s, axis=1).tolist()))
+
+    def delta(self):
+        """Return the state of only the channels that changed since the last call, for `apply`.
+        A channel stops changing once it has `records_required` records.
+
+        >>> worker, gui = BaselineConsumer(3, records_required=2), BaselineConsumer(3, records_required=2)
+        >>> headers = np.zeros(3, dtype=record_stream.RECORD_HEADER_DTYPE)
+        >>> headers["chan"] = [2, 2, 2]
+        >>> worker.update(headers, [np.full(4, 7.0), np.full(4, 5.0), np.full(4, 1.0)])
+        >>> d = worker.delta()
+        >>> d[0].tolist(), worker.delta()[0].tolist()
+        ([2], [])
+        >>> gui.apply(d)
+        >>> gui.progress([0, 1, 2]), float(gui.baselines([2])[2])
+        (2, 5.0)
+        """
+        changed = np.nonzero(self.filled != self.sent)[0]
+        self.sent[changed] = self.filled[changed]
+        return changed, self.medians[changed], self.sigmas[changed], self.filled[changed]
+
+    def apply(self, delta):
+        """Apply the `delta` of a consumer (in a worker) that saw a disjoint set of channels."""
+        chans, medians, sigmas, filled = delta
+        self.medians[chans] = medians
+        self.sigmas[chans] = sigmas
+        self.filled[chans] = filled
+
+
+class HistogramConsumer:
+    "Accumulate pulse-height histograms (see histograms.PulseHeightHistograms) of raw-record peaks."
+
+    def __init__(self, nbins=500, vmin=0.0, vmax=20000.0, positive=True):
+        self.positive = positive
+        self.hist = histograms.PulseHeightHistograms(0, nbins, vmin, vmax)
+
+    def reset(self):
+        self.hist.reset()
+
+    def update(self, headers, records):
+        self.hist.add_records(headers, records, self.positive)
+
+    def delta(self):
+        """Return the counts of only the channels that had any since the last call, for `apply`,
+        and start counting afresh."""
+        h = self.hist
+        self.hist = histograms.PulseHeightHistograms(0, h.nbins, h.vmin, h.vmax)
+        rows = np.nonzero(h.counts.any(axis=1) | (h.underflow > 0) | (h.overflow > 0))[0]
+        return rows, h.counts[rows], h.underflow[rows], h.overflow[rows]
+
+    def apply(self, delta):
+        """Add the `delta` of a consumer in a worker."""
+        rows, counts, underflow, overflow = delta
+        if len(rows) == 0:
+            return
+        h = self.hist
+        h._grow(rows.max() + 1)
+        h.counts[rows] += counts
+        h.underflow[rows] += underflow
+        h.overflow[rows] += overflow
+
+
+def _worker_main(host, baseport, chans, consumers, commands, results, stop):
+    """Body of one worker process: receive, decode, and consume records for `chans`.
+
+    A ("collect", seq) command is answered with (seq, process name, [c.delta() for c in
+    consumers]) on the `results` queue; the process name identifies the worker.
+    """
+    name = multiprocessing.current_process().name
+    context = zmq.Context()
+    socket = context.socket(zmq.SUB)
+    socket.setsockopt(zmq.LINGER, 0)
+    socket.connect(f"tcp://{host}:{baseport + 2}")
+    for c in chans:
+        socket.setsockopt(zmq.SUBSCRIBE, struct.pack("<H", c))
+
+    try:
+        while not stop.is_set():
+            try:
+                command = commands.get_nowait()
+                if command == "reset":
+                    for c in consumers:
+                        c.reset()
+                elif command[0] == "collect":
+                    results.put((command[1], name, [c.delta() for c in consumers]))
+            except queue.Empty:
+                pass
+
+            if socket.poll(100) == 0:
+                continue
+            batch = []
+            while len(batch) < 10000:
+                try:
+                    msg = socket.recv_multipart(zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+                if len(msg) == 2:
+                    batch.append(msg)
+            headers, records = record_stream.decode_records(batch)
+            for c in consumers:
+                c.update(headers, records)
+    finally:
+        socket.close()
+        context.term()
+
+
+class RecordPipeline:
+    """Decode the record stream in `nworkers` processes, each handling a share of `channels`."""
+
+    def __init__(self, host, baseport, channels, consumers=(), nworkers=None):
+        if nworkers is None:
+            nworkers = max(1, min(8, multiprocessing.cpu_count() - 1))
+        self.host = host
+        self.baseport = baseport
+        self.channels = np.asarray(channels, dtype=np.intp)
+        self.consumers = list(consumers)
+        self.nworkers = max(1, min(nworkers, len(self.channels)))
+        self.processes = []
+        self.commands = []
+        self.collect_requests = 0  # collect requests ever sent
+        self.collect_seq = 0  # sequence number of the pending collect request (0: none)
+        self.replied = set()  # names of the workers that replied to request collect_seq
+        # Use "spawn" so that workers never inherit the GUI's Qt or ZMQ state.
+        self.mp = multiprocessing.get_context("spawn")
+        self.results = None
+        self.stop_event = None
+
+    def start(self):
+        self.results = self.mp.Queue()
+        self.stop_event = self.mp.Event()
+        for i in range(self.nworkers):
+            chans = self.channels[i::self.nworkers].tolist()
+            commands = self.mp.Queue()
+            args = (self.host, self.baseport, chans, self.consumers, commands, self.results, self.stop_event)
+            p = self.mp.Process(target=_worker_main, args=args, name=f"record-worker-{i}", daemon=True)
+            p.start()
+            self.commands.append(commands)
+            self.processes.append(p)
+
+    def stop(self):
+        if self.stop_event is None:
+            return
+        self.stop_event.set()
+        for p in self.processes:
+            p.join(timeout=2)
+            if p.is_alive():
+                p.terminate()
+        self.processes, self.commands = [], []
+        self.stop_event = None
+        self.collect_seq = 0
+        self.replied = set()
+
+    def reset(self):
+        "Tell every worker to reset its consumers, and reset ours."
+        for q in self.commands:
+            q.put("reset")
+        for c in self.consumers:
+            c.reset()
+        # Replies to a pending request may predate the reset; ignore them.
+        self.collect_seq = 0
+        self.replied = set()
+
+    def collect(self):
+        """Ask every worker what its consumers learned, without waiting for the replies.
+
+        If no request is pending, send one. Then apply whatever replies have arrived to our own
+        `consumers`, ignoring replies to requests from before a `reset`. Once every worker has
+        replied to the pending request, return `consumers` (the list given to the constructor,
+        now covering every worker's channels); until then, return None. Call it again (e.g., on a
+        timer) to poll.
+        """
+        if self.collect_seq == 0:
+            self.collect_requests += 1
+            self.collect_seq = self.collect_requests
+            self.replied = set()
+            for q in self.commands:
+                q.put(("collect", self.collect_seq))
+        while True:
+            try:
+                seq, name, deltas = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if seq != self.collect_seq:
+                continue
+            for c, d in zip(self.consumers, deltas):
+                c.apply(d)
+            self.replied.add(name)
+        if len(self.replied) < len(self.commands):
+            return None
+        self.collect_seq = 0
+        self.replied = set()
+        return self.consumers
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,222 @@
+"""
+record_stream.py
+
+Tools for consuming the triggered-record stream that Dastard publishes on its data port
+(base port + 2) and the summary stream on base port + 3. Nothing here depends on Qt, so
+it can be used from `EasyClientDastard` or a plain script as well as from dcom.
+
+Each ZMQ message on the data port has two parts: a 36-byte header (see `RECORD_HEADER_DTYPE`)
+and the raw record samples, whose type is given by the header's `dataTypeCode`.
+"""
+
+import collections
+
+import numpy as np
+import zmq
+
+RECORD_HEADER_DTYPE = np.dtype([("chan", "<u2"), ("headerVersion", "u1"), ("dataTypeCode", "u1"),
+                                ("npresamples", "<u4"), ("nsamples", "<u4"), ("samplePeriod", "<f4"),
+                                ("voltsPerArb", "<f4"), ("unixnano", "<u8"), ("triggerFramecount", "<u8")])
+
+SUMMARY_HEADER_DTYPE = np.dtype([("chan", "<u2"), ("headerVersion", "u1"),
+                                 ("npresamples", "<u4"), ("nsamples", "<u4"), ("pretrig_mean", "<f4"),
+                                 ("peak_value", "<f4"), ("pulse_rms", "<f4"), ("pulse_average", "<f4"),
+                                 ("residualStdDev", "<f4"), ("unixnano", "<u8"), ("trig frame", "<u8")])
+
+# Record sample types, indexed by the header's dataTypeCode
+DATA_DTYPES = [np.dtype(t) for t in ("i1", "u1", "<i2", "<u2", "<i4", "<u4", "<i8", "<u8")]
+
+
+def decode_headers(headers, dtype=RECORD_HEADER_DTYPE):
+    """Decode a sequence of raw header byte strings into one structured array in a single pass."""
+    if len(headers) == 0:
+        return np.zeros(0, dtype=dtype)
+    size = dtype.itemsize
+    if any(len(h) != size for h in headers):
+        # Tolerate headers with extra trailing bytes (e.g., from a newer header version).
+        headers = [h[:size] for h in headers]
+    return np.frombuffer(b"".join(headers), dtype=dtype)
+
+
+# Number of data-port messages that decode_records skipped as undecodable in this process, by dataTypeCode
+skipped_messages = collections.Counter()
+
+
+def decode_records(messages):
+    """Decode a list of (header, data) byte-string pairs from the data port.
+
+    Returns (headers, records), where `headers` is a structured array of `RECORD_HEADER_DTYPE`
+    and `records` is a list of 1-d arrays of the appropriate sample type. Messages with an unknown
+    `dataTypeCode`, or data that is not a whole number of samples, are left out of both and
+    counted in `skipped_messages`, so one bad message cannot stop a listener.
+
+    >>> good = (np.zeros(1, dtype=RECORD_HEADER_DTYPE).tobytes(), bytes(4))
+    >>> bad = (bytes(3) + bytes([99]) + bytes(32), bytes(4))
+    >>> headers, records = decode_records([bad, good, bad])
+    Skipping undecodable record messages (first had dataTypeCode 99)
+    >>> len(headers), [r.tolist() for r in records], skipped_messages[99]
+    (1, [[0, 0, 0, 0]], 2)
+    """
+    headers = decode_headers([m[0] for m in messages])
+    records, bad = [], []
+    for i, (m, code) in enumerate(zip(messages, headers["dataTypeCode"].tolist())):
+        if code < len(DATA_DTYPES) and len(m[1]) % DATA_DTYPES[code].itemsize == 0:
+            records.append(np.frombuffer(m[1], dtype=DATA_DTYPES[code]))
+        else:
+            bad.append(i)
+    if len(bad) > 0:
+        codes = headers["dataTypeCode"][bad].tolist()
+        if len(skipped_messages) == 0:
+            print(f"Skipping undecodable record messages (first had dataTypeCode {codes[0]})")
+        skipped_messages.update(codes)
+        headers = np.delete(headers, bad)
+    return headers, records
+
+
+class RecordSubscriber:
+    """Subscribe to Dastard's record (or summary) port and receive messages in batches.
+
+    Draining the socket in batches lets consumers work on whole arrays of headers instead of
+    paying Python overhead once per record.
+    """
+
+    def __init__(self, host="localhost", baseport=5500, summaries=False, context=None):
+        if context is None:
+            context = zmq.Context.instance()
+        self.port = baseport + (3 if summaries else 2)
+        self.address = f"tcp://{host}:{self.port}"
+        self.socket = context.socket(zmq.SUB)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.connect(self.address)
+        self.socket.setsockopt_string(zmq.SUBSCRIBE, "")
+
+    def recv_batch(self, timeout_ms=100, max_messages=10000):
+        """Wait up to `timeout_ms` for data, then return all queued messages (at most `max_messages`)
+        as a list of (header, data) byte-string pairs. The list is empty if nothing arrived."""
+        batch = []
+        if self.socket.poll(timeout_ms) == 0:
+            return batch
+        while len(batch) < max_messages:
+            try:
+                msg = self.socket.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+            if len(msg) == 2:
+                batch.append((msg[0], msg[1]))
+        return batch
+
+    def close(self):
+        self.socket.close()
+
+
+class DropDetector:
+    """Track each channel's `triggerFramecount` to find dropped and out-of-order records.
+
+    All state is kept in arrays indexed by channel index, and `update` processes a whole batch
+    of headers with numpy, so the cost per record is constant no matter how long it runs.
+
+    A *gap* is a record that starts more than one record length (of the previous record) after
+    the previous record on that channel started. Gaps mean dropped data only when records are
+    contiguous, e.g., autotriggers with zero delay (noise mode). A *reversal* is a record whose
+    frame count is not later than the previous one on that channel.
+
+    Usage:
+    >>> dd = DropDetector()
+    >>> dd.update([0, 1, 0, 1], [0, 0, 100, 100], 100)
+    >>> dd.update([0, 1, 1], [300, 200, 150], 100)
+    >>> dd.gaps.tolist(), dd.frames_dropped.tolist(), dd.reversals.tolist()
+    ([1, 0], [100, 0], [0, 1])
+    >>> dd.records.tolist()
+    [3, 4]
+    """
+
+    def __init__(self, nchan=0):
+        self.reset(nchan)
+
+    def reset(self, nchan=0):
+        self.seen = np.zeros(nchan, dtype=bool)
+        self.last_frame = np.zeros(nchan, dtype=np.int64)
+        self.last_nsamples = np.zeros(nchan, dtype=np.int64)
+        self.records = np.zeros(nchan, dtype=np.int64)
+        self.gaps = np.zeros(nchan, dtype=np.int64)
+        self.frames_dropped = np.zeros(nchan, dtype=np.int64)
+        self.reversals = np.zeros(nchan, dtype=np.int64)
+
+    def _grow(self, nchan):
+        extra = nchan - len(self.seen)
+        if extra <= 0:
+            return
+        for name in ("seen", "last_frame", "last_nsamples", "records", "gaps", "frames_dropped", "reversals"):
+            a = getattr(self, name)
+            setattr(self, name, np.concatenate([a, np.zeros(extra, dtype=a.dtype)]))
+
+    def update(self, chans, framecounts, nsamples):
+        """Ingest one batch of records, given (in arrival order) their channel indices,
+        trigger frame counts, and lengths. `nsamples` may be a scalar."""
+        chans = np.asarray(chans, dtype=np.intp)
+        n = len(chans)
+        if n == 0:
+            return
+        framecounts = np.asarray(framecounts).astype(np.int64)
+        nsamples = np.broadcast_to(np.asarray(nsamples, dtype=np.int64), (n,))
+        self._grow(chans.max() + 1)
+        nchan = len(self.seen)
+
+        # Group the batch by channel, preserving arrival order within each channel.
+        order = np.argsort(chans, kind="stable")
+        c = chans[order]
+        f = framecounts[order]
+        ns = nsamples[order]
+        first = np.ones(n, dtype=bool)
+        first[1:] = c[1:] != c[:-1]
+        last = np.ones(n, dtype=bool)
+        last[:-1] = first[1:]
+
+        prev_f = np.empty(n, dtype=np.int64)
+        prev_ns = np.empty(n, dtype=np.int64)
+        prev_f[1:] = f[:-1]
+        prev_ns[1:] = ns[:-1]
+        prev_f[first] = self.last_frame[c[first]]
+        prev_ns[first] = self.last_nsamples[c[first]]
+        valid = np.ones(n, dtype=bool)
+        valid[first] = self.seen[c[first]]
+
+        delta = f - prev_f
+        reversed_ = valid & (delta <= 0)
+        gap = valid & (delta > prev_ns)
+        self.records += np.bincount(c, minlength=nchan)
+        self.reversals += np.bincount(c[reversed_], minlength=nchan)
+        self.gaps += np.bincount(c[gap], minlength=nchan)
+        dropped = (delta - prev_ns)[gap]
+        self.frames_dropped += np.bincount(c[gap], weights=dropped, minlength=nchan).astype(np.int64)
+
+        self.seen[c] = True
+        self.last_frame[c[last]] = f[last]
+        self.last_nsamples[c[last]] = ns[last]
+
+    def update_headers(self, headers):
+        """Ingest a structured array of record headers (see `decode_headers`)."""
+        self.update(headers["chan"], headers["triggerFramecount"], headers["nsamples"])
+
+    @property
+    def total_gaps(self):
+        return int(self.gaps.sum())
+
+    @property
+    def total_reversals(self):
+        return int(self.reversals.sum())
+
+    def channels_with_problems(self):
+        """Return indices of channels that have seen at least one gap or reversal."""
+        return np.nonzero((self.gaps > 0) | (self.reversals > 0))[0]
+
+    def summary(self):
+        nrec = int(self.records.sum())
+        nbad = len(self.channels_with_problems())
+        return (f"{nrec} records: {self.total_gaps} gaps ({int(self.frames_dropped.sum())} frames), "
+                f"{self.total_reversals} out of order, in {nbad} channels")
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
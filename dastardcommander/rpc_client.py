@@ -1,3 +1,4 @@
+import codecs
 import json
 import itertools
 import socket
@@ -76,3 +77,46 @@ class JSONClient:
             self._socket.close()
             if self.qtParent is not None:
                 self.qtParent.close()
+
+
+class JSONPipeline:
+    """A JSON-RPC connection that can have many requests in flight at once.
+
+    Unlike JSONClient, `send` does not wait for the reply. Dastard (Go's net/rpc/jsonrpc) handles
+    each request on a connection concurrently and may reply in any order, so `receive` returns
+    each reply's id for the caller to match with its request. Errors come back as values, not
+    message boxes, so this can be used from a worker thread. Lost connections raise OSError.
+    """
+
+    def __init__(self, addr, codec=json, timeout=7.0):
+        self._socket = socket.create_connection(addr, timeout=timeout)
+        self._id_iter = itertools.count()
+        self._codec = codec
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()  # a reply may be split mid-character
+        self._buffer = ""
+
+    def send(self, name, params):
+        """Send one request and return its id."""
+        request = dict(id=next(self._id_iter), params=[params], method=name)
+        self._socket.sendall(self._codec.dumps(request).encode())
+        return request["id"]
+
+    def receive(self):
+        """Wait for the next reply and return (id, result, error)."""
+        while True:
+            text = self._buffer.lstrip()
+            if text:
+                try:
+                    response, end = self._decoder.raw_decode(text)
+                    self._buffer = text[end:]
+                    return response.get("id"), response.get("result"), response.get("error")
+                except ValueError:
+                    pass  # an incomplete reply: read more
+            data = self._socket.recv(65536)
+            if not data:
+                raise ConnectionError("RPC server closed the connection")
+            self._buffer = text + self._utf8.decode(data)
+
+    def close(self):
+        self._socket.close()
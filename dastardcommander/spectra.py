@@ -0,0 +1,221 @@
+import numpy as np
+
+# Qt5 imports
+from PyQt5 import QtCore, QtGui, QtWidgets
+from PyQt5.QtCore import pyqtSlot
+
+from . import histograms
+from . import status_monitor
+
+
+class SpectraWindow(QtWidgets.QWidget):
+    """A window showing rough live pulse-height spectra for all channels.
+
+    Values come either from the summary stream (Dastard's peak values) or from raw records,
+    received in batches by a ZMQListener in its own QThread. Incoming batches only update the
+    histogram arrays; drawing happens on a slow timer, so the cost of display does not grow
+    with the trigger rate.
+    """
+
+    def __init__(self, dcom, parent=None):
+        QtWidgets.QWidget.__init__(self, parent)
+        self.dcom = dcom
+        self.setWindowTitle("Live spectra")
+        self.hist = histograms.PulseHeightHistograms(len(dcom.channel_names))
+        self.zmqthread = None
+        self.zmqlistener = None
+
+        self.sourceBox = QtWidgets.QComboBox()
+        self.sourceBox.addItems(["Summary peak values", "Record peaks (positive)", "Record peaks (negative)"])
+        self.channelBox = QtWidgets.QComboBox()
+        self.channelBox.addItems(dcom.channel_names)
+        self.vmaxSpin = QtWidgets.QDoubleSpinBox()
+        self.vmaxSpin.setRange(1, 1e9)
+        self.vmaxSpin.setValue(self.hist.vmax)
+        self.nbinsSpin = QtWidgets.QSpinBox()
+        self.nbinsSpin.setRange(10, 10000)
+        self.nbinsSpin.setValue(self.hist.nbins)
+        self.windowSpin = QtWidgets.QSpinBox()
+        self.windowSpin.setRange(0, 100000)
+        self.windowSpin.setSuffix(" s")
+        self.windowSpin.setSpecialValueText("forever")
+        self.startButton = QtWidgets.QPushButton("Start")
+        self.startButton.setCheckable(True)
+        self.resetButton = QtWidgets.QPushButton("Reset")
+        self.statusLabel = QtWidgets.QLabel("")
+        self.spectrumView = SpectrumView()
+        self.imageView = HistogramImageView()
+
+        controls = QtWidgets.QHBoxLayout()
+        for label, widget in (("Source", self.sourceBox), ("Channel", self.channelBox),
+                              ("Max", self.vmaxSpin), ("Bins", self.nbinsSpin), ("Integrate", self.windowSpin)):
+            controls.addWidget(QtWidgets.QLabel(label))
+            controls.addWidget(widget)
+        controls.addWidget(self.startButton)
+        controls.addWidget(self.resetButton)
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.addLayout(controls)
+        layout.addWidget(self.spectrumView, 2)
+        layout.addWidget(self.imageView, 1)
+        layout.addWidget(self.statusLabel)
+
+        self.startButton.toggled.connect(self.startStop)
+        self.resetButton.clicked.connect(self.resetHistograms)
+        self.vmaxSpin.editingFinished.connect(self.resetHistograms)
+        self.nbinsSpin.editingFinished.connect(self.resetHistograms)
+        self.windowSpin.valueChanged.connect(self.setIntegrationTime)
+        self.channelBox.currentIndexChanged.connect(self.redraw)
+        self.renderTimer = QtCore.QTimer(self)
+        self.renderTimer.timeout.connect(self.redraw)
+        self.renderTimer.start(500)
+        self.resize(800, 600)
+
+    @pyqtSlot(bool)
+    def startStop(self, start):
+        if start:
+            self.startListening()
+            self.startButton.setText("Stop")
+        else:
+            self.stopListening()
+            self.startButton.setText("Start")
+        self.sourceBox.setDisabled(start)
+
+    def startListening(self):
+        summaries = self.sourceBox.currentIndex() == 0
+        # ZMQListener subscribes to (its port argument + 1)
+        port = self.dcom.port + (2 if summaries else 1)
+        self.zmqthread = QtCore.QThread()
+        self.zmqlistener = status_monitor.ZMQListener(self.dcom.host, port)
+        self.zmqlistener.recordbatch.connect(self.batchReceived)
+        self.zmqlistener.moveToThread(self.zmqthread)
+        if summaries:
+            self.zmqthread.started.connect(self.zmqlistener.summary_batch_loop)
+        else:
+            self.zmqthread.started.connect(self.zmqlistener.record_batch_loop)
+        self.zmqthread.start()
+
+    def stopListening(self):
+        if self.zmqlistener is None:
+            return
+        self.zmqlistener.running = False
+        self.zmqthread.quit()
+        self.zmqthread.wait()
+        self.zmqlistener = None
+        self.zmqthread = None
+
+    @pyqtSlot(object, object)
+    def batchReceived(self, headers, records):
+        source = self.sourceBox.currentIndex()
+        if source == 0:
+            self.hist.add_summaries(headers)
+        else:
+            self.hist.add_records(headers, records, positive=(source == 1))
+
+    @pyqtSlot()
+    def resetHistograms(self):
+        nbins = self.nbinsSpin.value()
+        vmax = self.vmaxSpin.value()
+        if nbins != self.hist.nbins or vmax != self.hist.vmax:
+            self.hist = histograms.PulseHeightHistograms(self.hist.nchan, nbins, 0.0, vmax)
+            self.setIntegrationTime(self.windowSpin.value())
+        else:
+            self.hist.reset()
+        self.redraw()
+
+    def handleChannelNames(self):
+        """Rebuild the channel list and the histograms after a CHANNELNAMES message. Channel
+        indices may now mean other channels, so the histograms start over."""
+        current = self.channelBox.currentText()
+        self.channelBox.blockSignals(True)
+        self.channelBox.clear()
+        self.channelBox.addItems(self.dcom.channel_names)
+        self.channelBox.setCurrentIndex(max(self.channelBox.findText(current), 0))
+        self.channelBox.blockSignals(False)
+        self.hist = histograms.PulseHeightHistograms(
+            len(self.dcom.channel_names), self.hist.nbins, self.hist.vmin, self.hist.vmax
+        )
+        self.setIntegrationTime(self.windowSpin.value())
+        self.redraw()
+
+    @pyqtSlot(int)
+    def setIntegrationTime(self, seconds):
+        self.hist.integration_time = seconds if seconds > 0 else None
+
+    @pyqtSlot()
+    def redraw(self):
+        if not self.isVisible():
+            return
+        chan = max(self.channelBox.currentIndex(), 0)
+        x, y = self.hist.spectrum(chan)
+        self.spectrumView.setSpectrum(x, y)
+        self.imageView.setImage(self.hist.image())
+        ntot = int(self.hist.counts.sum())
+        nchan = int(np.count_nonzero(self.hist.counts.sum(axis=1)))
+        self.statusLabel.setText(f"{ntot} values histogrammed in {nchan} channels")
+
+    def closeEvent(self, event):
+        self.startButton.setChecked(False)
+        self.stopListening()
+        event.accept()
+
+
+class SpectrumView(QtWidgets.QWidget):
+    "Draw one channel's histogram as a filled step plot, scaled to its own maximum."
+
+    def __init__(self, parent=None):
+        QtWidgets.QWidget.__init__(self, parent)
+        self.y = np.zeros(0)
+        self.vmax = 1.0
+        self.setMinimumHeight(150)
+
+    def setSpectrum(self, x, y):
+        self.y = np.asarray(y)
+        self.vmax = x[-1] if len(x) > 0 else 1.0
+        self.update()
+
+    def paintEvent(self, event):
+        qp = QtGui.QPainter(self)
+        qp.fillRect(self.rect(), QtCore.Qt.white)
+        n = len(self.y)
+        ymax = self.y.max() if n > 0 else 0
+        if ymax <= 0:
+            qp.drawText(self.rect(), QtCore.Qt.AlignCenter, "no counts")
+            return
+        w, h = self.width(), self.height()
+        xs = np.linspace(0, w, n + 1)
+        ys = h - self.y * ((h - 15) / ymax)
+        points = [QtCore.QPointF(0, h)]
+        for i in range(n):
+            points.append(QtCore.QPointF(xs[i], ys[i]))
+            points.append(QtCore.QPointF(xs[i + 1], ys[i]))
+        points.append(QtCore.QPointF(w, h))
+        qp.setPen(QtCore.Qt.darkBlue)
+        qp.setBrush(QtGui.QColor(100, 140, 220))
+        qp.drawPolygon(QtGui.QPolygonF(points))
+        qp.setPen(QtCore.Qt.black)
+        qp.drawText(5, 12, f"max {int(ymax)} counts/bin; full scale {self.vmax:.0f}")
+
+
+class HistogramImageView(QtWidgets.QWidget):
+    "Draw all channels' histograms as one image (rows = channels), straight from a uint8 array."
+
+    def __init__(self, parent=None):
+        QtWidgets.QWidget.__init__(self, parent)
+        self.qimage = None
+        self.setMinimumHeight(80)
+
+    def setImage(self, img):
+        if img.shape[0] == 0:
+            self.qimage = None
+        else:
+            self._buffer = np.ascontiguousarray(255 - img)  # QImage does not copy; keep a reference
+            nrow, ncol = self._buffer.shape
+            self.qimage = QtGui.QImage(self._buffer.data, ncol, nrow, ncol, QtGui.QImage.Format_Grayscale8)
+        self.update()
+
+    def paintEvent(self, event):
+        qp = QtGui.QPainter(self)
+        if self.qimage is None:
+            qp.fillRect(self.rect(), QtCore.Qt.white)
+            return
+        qp.drawImage(self.rect(), self.qimage)
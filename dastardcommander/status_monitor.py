@@ -2,12 +2,15 @@ import zmq
 from PyQt5 import QtCore
 import collections
 
+from . import record_stream
+
 
 class ZMQListener(QtCore.QObject):
     """Code suggested by https://wiki.python.org/moin/PyQt/Writing%20a%20client%20for%20a%20zeromq%20service"""
 
     message = QtCore.pyqtSignal(str, str)
     pulserecord = QtCore.pyqtSignal(bytes, bytes)
+    recordbatch = QtCore.pyqtSignal(object, object)
 
     def __init__(self, host, port):
 
@@ -79,3 +82,52 @@ class ZMQListener(QtCore.QObject):
         self.socket.close()
         self.quit_once = True
         print("ZMQListener quit cleanly")
+
+    def _recv_batch(self, max_messages=10000):
+        """Receive all queued two-part messages (without blocking), up to `max_messages`."""
+        batch = []
+        while len(batch) < max_messages:
+            try:
+                msg = self.socket.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+            if len(msg) == 2:
+                batch.append(msg)
+        return batch
+
+    def record_batch_loop(self):
+        """Like data_monitor_loop, but drain all queued records at once and emit them as one
+        batch: a structured array of headers and a list of record arrays (see record_stream).
+        This costs one signal per batch instead of one per record."""
+        if self.quit_once:
+            raise ValueError("Cannot run a ZMQListener.loop more than once!")
+        self.running = True
+        while self.running:
+            if self.socket.poll(100) == 0:
+                continue
+            batch = self._recv_batch()
+            if len(batch) > 0:
+                headers, records = record_stream.decode_records(batch)
+                self.recordbatch.emit(headers, records)
+
+        self.socket.close()
+        self.quit_once = True
+        print("ZMQListener quit cleanly")
+
+    def summary_batch_loop(self):
+        """Like record_batch_loop, but for the summary port: emit each batch as a structured array
+        of summary headers (the second argument is the list of raw model-coefficient messages)."""
+        if self.quit_once:
+            raise ValueError("Cannot run a ZMQListener.loop more than once!")
+        self.running = True
+        while self.running:
+            if self.socket.poll(100) == 0:
+                continue
+            batch = self._recv_batch()
+            if len(batch) > 0:
+                headers = record_stream.decode_headers([m[0] for m in batch], record_stream.SUMMARY_HEADER_DTYPE)
+                self.recordbatch.emit(headers, [m[1] for m in batch])
+
+        self.socket.close()
+        self.quit_once = True
+        print("ZMQListener quit cleanly")
@@ -1,10 +1,16 @@
 # Qt5 imports
 import PyQt5.uic
-from PyQt5 import QtWidgets
+from PyQt5 import QtCore, QtWidgets
+from PyQt5.QtWidgets import QFileDialog
 from PyQt5.QtCore import pyqtSignal, pyqtSlot, Qt
 
 # other non qt imports
 import os
+import numpy as np
+
+from . import trigger_snapshot
+from . import trigger_states
+from .channel_registry import format_ranges, parse_ranges
 
 
 class TriggerConfig(QtWidgets.QWidget):  # noqa: PLR0904
@@ -15,6 +21,7 @@ class TriggerConfig(QtWidgets.QWidget):  # noqa: PLR0904
 
     changedTriggerStateSig = pyqtSignal()
     changedBlockList = pyqtSignal()
+    parseDelayMS = 300
 
     def __init__(self, parent, client):
         QtWidgets.QWidget.__init__(self, parent)
@@ -30,15 +37,25 @@ class TriggerConfig(QtWidgets.QWidget):  # noqa: PLR0904
             self.sendRecordLengthsToServer
         )
         self.channelChooserBox.activated.connect(self.channelChooserChanged)
-        self.channelsChosenEdit.textChanged.connect(self.channelListTextChanged)
+        # Re-parse the channel list only once typing pauses: a list can name thousands of channels.
+        self.parseTimer = QtCore.QTimer(self)
+        self.parseTimer.setSingleShot(True)
+        self.parseTimer.setInterval(self.parseDelayMS)
+        self.parseTimer.timeout.connect(self.channelListTextChanged)
+        self.channelsChosenEdit.textChanged.connect(self.parseTimer.start)
         self.auto1psModeButton.clicked.connect(self.go1psMode)
         self.noiseModeButton.clicked.connect(self.goNoiseMode)
         self.pulseModeButton.clicked.connect(self.goPulseMode)
         self.groupTriggerClearAll.clicked.connect(self.pushedClearGroupTrigger)
         self.groupTriggerAdd.clicked.connect(self.pushedAddGroupTrigger)
         self.groupTriggerRemove.clicked.connect(self.pushedRemoveGroupTrigger)
-        self.trigger_state = {}
-        self.chosenChannels = []
+        self.saveSnapshotButton.clicked.connect(self.saveSnapshot)
+        self.restoreSnapshotButton.clicked.connect(self.restoreSnapshot)
+        self.trigger_state = trigger_states.TriggerStateStore()  # as edited here
+        self.serverTriggerState = trigger_states.TriggerStateStore()  # as last reported by Dastard
+        self.groupTriggerConnections = {}  # source -> receivers, as last reported by Dastard
+        self.trigCoupling = 1  # 1 = none, 2 = FB to error, 3 = error to FB
+        self.chosenChannels = np.zeros(0, dtype=int)
         self.editWidgets = [
             self.recordLengthSpinBox,
             self.pretrigLengthSpinBox,
@@ -50,7 +67,7 @@ class TriggerConfig(QtWidgets.QWidget):  # noqa: PLR0904
         # Initialize these two to a value that definitly won't match next value
         self.lastPretrigLength = -1
         self.lastRecordLength = -1
-        # self.channel_names has been set to equal the same list belonging to the main window
+        # self.channel_names and self.channels (the ChannelRegistry) are set by the main window
 
     def _closing(self):
         """The main window calls this to block any editingFinished events from
@@ -95,11 +112,11 @@ class TriggerConfig(QtWidgets.QWidget):  # noqa: PLR0904
 
     def handleTriggerMessage(self, dicts):
         """Handle the trigger state message (in list-of-dicts form)"""
+        self.serverTriggerState.update(dicts)
         for d in dicts:
             d["EdgeMulti"] = False  # ignore all EdgeMulti settings from the server
             # so that we don't send them back... avoid EdgeMulti being stuck on
-            for channelIndex in d["ChannelIndices"]:
-                self.trigger_state[channelIndex] = d
+        self.trigger_state.update(dicts)
         self.updateTriggerGUIElements()
         self.changedTriggerStateSig.emit()
 
@@ -124,20 +141,18 @@ class TriggerConfig(QtWidgets.QWidget):  # noqa: PLR0904
                 prefix = "err"
             result = self.chanbyprefix(prefix)
         self.channelsChosenEdit.setPlainText(result)
+        self.parseTimer.stop()
+        self.parseChannelText()
         if idx != self.channelChooserBox.currentIndex():
             self.channelChooserBox.setCurrentIndex(idx)
         self.updateTriggerGUIElements()
 
     def chanbyprefix(self, prefix, include_blocked=False):
         """Return a string listing all channels for the given prefix"""
-        unblocked_chan = []
-        for p in self.channel_names:
-            if p.startswith(prefix):
-                num = p.lstrip(prefix)
-                if int(num) not in self.triggerBlocker.special:
-                    unblocked_chan.append(num)
-        cnum = ",".join(unblocked_chan)
-        return f"{prefix}:{cnum}"
+        numbers = self.channels.numbersOf(prefix)
+        if not include_blocked:
+            numbers = numbers[~np.isin(numbers, self.triggerBlocker.special)]
+        return f"{prefix}:{format_ranges(numbers)}"
 
     @pyqtSlot()
     def channelListTextChanged(self):
@@ -148,7 +163,7 @@ class TriggerConfig(QtWidgets.QWidget):  # noqa: PLR0904
     def parseChannelText(self):
         """Parse the text in the channel selector text edit box. Set the list
         self.chosenChannels accordingly."""
-        self.chosenChannels = []
+        chosen = []
         chantext = self.channelsChosenEdit.toPlainText()
         chantext = chantext.replace("\t", "\n").replace(";", "\n").replace(" ", "")
         lines = chantext.split()
@@ -159,80 +174,61 @@ class TriggerConfig(QtWidgets.QWidget):  # noqa: PLR0904
             if prefix not in self.channel_prefixes:
                 print(f"Channel prefix {prefix} not in known prefixes: {self.channel_prefixes}")
                 continue
-            for cnum in cnums.split(","):
-                # Ignore the "" that follows a trailing comma
-                if len(cnum) == 0:
-                    continue
-                name = prefix + cnum
-                try:
-                    idx = self.channel_names.index(name)
-                    self.chosenChannels.append(idx)
-                except ValueError:
-                    print(f"Channel '{name}' is not known")
+            # Numbers and ranges like "1-512" are both allowed
+            numbers, bad = parse_ranges(cnums, self.channels.maxNumber(prefix))
+            for word in bad:
+                print(f"Channel '{prefix}{word}' is not known")
+            idx = self.channels.indices(prefix, numbers)
+            unknown = numbers[idx < 0]
+            if len(unknown) > 0:
+                print(f"Channels '{prefix}:{format_ranges(unknown)}' are not known")
+            chosen.append(idx[idx >= 0])
+        self.chosenChannels = np.unique(np.concatenate(chosen)) if chosen else np.zeros(0, dtype=int)
         self.channelChooserBox.setCurrentIndex(0)
 
+    def flushChannelText(self):
+        """If the channel selector text changed within the last parseDelayMS, parse it now, so
+        self.chosenChannels matches the text before anything reads it."""
+        if self.parseTimer.isActive():
+            self.parseTimer.stop()
+            self.parseChannelText()
+
     def getstate(self, name):
         "Get the self.trigger_state value named name. If mutiple values, return None"
-        channels = self.chosenChannels
-        if len(channels) == 0:
-            return None
-        for ch in channels:
-            if ch not in self.trigger_state:
-                return None
-        x = self.trigger_state[channels[0]].get(name, None)
-        if x is None:
-            return None
-        for ch in channels[1:]:
-            y = self.trigger_state[ch].get(name, None)
-            if x != y:
-                return None
-        return x
+        self.flushChannelText()
+        return self.trigger_state.field(self.chosenChannels, name)
 
     def alltriggerstates(self):
-        """Return all unique dictionaries that are values in the self.trigger_state dict.
-        There might be 100s of entries in self.trigger_state dict but only one or a few
-        unique values in it."""
-
-        # A set() might seem natural but cannot be used to store unhashable items like dicts.
-        allstates = []
-        for ch in self.chosenChannels:
-            # This will add a trigger state to the list only if it's not already in the list.
-            if ch in self.trigger_state and self.trigger_state[ch] not in allstates:
-                allstates.append(self.trigger_state[ch])
-
-        # Now we need to split states if any of allstates refers to channels both
-        # in AND out of self.chosenChannels. Those dictionaries each become 2 dictionaries.
-        for state in allstates:
-            chans = state["ChannelIndices"]
-            keep = []
-            splitoff = []
-            for c in chans:
-                if c in self.chosenChannels:
-                    keep.append(c)
-                else:
-                    splitoff.append(c)
-            if len(splitoff) > 0:
-                state["ChannelIndices"] = keep
-                for c in keep:
-                    self.trigger_state[c] = state
-                newstate = state.copy()
-                newstate["ChannelIndices"] = splitoff
-                for c in splitoff:
-                    self.trigger_state[c] = newstate
-        return allstates
+        """Return one state dict for each distinct trigger state among self.chosenChannels.
+
+        Each dict's "ChannelIndices" lists only the chosen channels in that state. There might be
+        1000s of chosen channels but only one or a few distinct states among them."""
+        self.flushChannelText()
+        return self.trigger_state.groups(self.chosenChannels)
 
     def configureDastardTriggers(self, singlestate=None):
+        self.flushChannelText()
         if singlestate is not None:
             self.client.call("SourceControl.ConfigureTriggers", singlestate)
             return
-        for state in self.alltriggerstates():
-            self.client.call("SourceControl.ConfigureTriggers", state)
+        self.sendTriggerStates(self.trigger_state, self.chosenChannels)
+
+    def sendTriggerStates(self, desired, channels=None):
+        """Send the fewest ConfigureTriggers requests that give `channels` (default: all) the states
+        they have in `desired` (a TriggerStateStore). Channels whose last known server state
+        already matches are skipped. Return the number of requests sent."""
+        requests = trigger_states.diff_requests(self.serverTriggerState, desired, channels)
+        for request in requests:
+            reply = self.client.call("SourceControl.ConfigureTriggers", request)
+            # Until the server's next TRIGGER message says otherwise, assume the request took effect.
+            if reply is not None and reply[1] is None:
+                self.serverTriggerState.update([request])
+        return len(requests)
 
     def setstates(self, newstate):
         """Set multiple self.trigger_state values from `newstate`, a dict of state key->value pairs."""
-        for state in self.alltriggerstates():
-            for name, val in newstate.items():
-                state[name] = val
+        self.flushChannelText()
+        self.trigger_state.update_fields(self.chosenChannels, newstate)
 
     def updateTriggerGUIElements(self):
         """Given the self.chosenChannels, update the various trigger status GUI elements."""
@@ -353,24 +349,36 @@ class TriggerConfig(QtWidgets.QWidget):  # noqa: PLR0904
         elif ndisabled == 1:
             msg = f"One channel is disabled: {self.triggerBlocker.special[0]}"
         else:
-            msg = "{} channels are disabled: {}".format(
-                ndisabled, ",".join(map(str, self.triggerBlocker.special))
-            )
+            msg = f"{ndisabled} channels are disabled: {format_ranges(self.triggerBlocker.special)}"
         self.disabledTextEdit.setPlainText(msg)
         self.channelChooserChanged()  # update that text box
 
     @pyqtSlot(int)
     def blockTriggering(self, channelIndex):
         """Block all triggering from channel with index `channelIndex`."""
-        self.trigger_state[channelIndex]["ChannelIndices"].remove(channelIndex)
-        notrig_state = self.trigger_state[channelIndex].copy()
-        self.trigger_state[channelIndex] = notrig_state
-        notrig_state["ChannelIndices"] = [channelIndex]
-        notrig_state["AutoTrigger"] = False
-        notrig_state["EdgeTrigger"] = False
-        notrig_state["LevelTrigger"] = False
-        notrig_state["EMTState"] = {"EdgeMulti": False, "EdgeMultiNoise": False}
-        self.configureDastardTriggers(notrig_state)
+        notrig = {
+            "AutoTrigger": False,
+            "EdgeTrigger": False,
+            "LevelTrigger": False,
+            "EMTState": {"EdgeMulti": False, "EdgeMultiNoise": False},
+        }
+        if channelIndex in self.trigger_state:
+            self.trigger_state.update_fields([channelIndex], notrig)
+        else:
+            self.trigger_state.assign([channelIndex], notrig)
+        self.sendTriggerStates(self.trigger_state, [channelIndex])
+
+    def blockChannels(self, channelIndices):
+        """Block all triggering from the channels with indices `channelIndices`. They all get one
+        trigger-off state (other trigger fields are not kept), so this needs at most one request."""
+        notrig = {
+            "AutoTrigger": False,
+            "EdgeTrigger": False,
+            "LevelTrigger": False,
+            "EMTState": {"EdgeMulti": False, "EdgeMultiNoise": False},
+        }
+        self.trigger_state.assign(channelIndices, notrig)
+        self.sendTriggerStates(self.trigger_state, channelIndices)
 
     def handleGroupTriggerMessage(self, msg):
         """Handle the group trigger state message"""
@@ -379,6 +387,9 @@ class TriggerConfig(QtWidgets.QWidget):  # noqa: PLR0904
         # purpose to doing so at this time.
         allsrc, allrx = set(), set()
         conn = msg["Connections"]
+        if conn is None:
+            conn = {}
+        self.groupTriggerConnections = {int(src): sorted(rx) for src, rx in conn.items()}
         for src, rx in conn.items():
             allsrc.add(src)
             allrx.update(rx)
@@ -402,6 +413,66 @@ class TriggerConfig(QtWidgets.QWidget):  # noqa: PLR0904
             text = f"Active group trigger {name}: {cnum_text}"
             gui_label.setText(text)
 
+    @pyqtSlot()
+    def saveSnapshot(self):
+        """Save the server's trigger state for all channels, and the trigger couplings, to a file."""
+        startdir = os.path.expanduser("~/.dastard")
+        filename, _ = QFileDialog.getSaveFileName(
+            self, "Save trigger snapshot", startdir, "Trigger snapshots (*.json)")
+        if not filename:
+            return
+        snap = trigger_snapshot.TriggerSnapshot.capture(
+            self.serverTriggerState, self.channel_names, self.groupTriggerConnections, self.trigCoupling)
+        snap.save(filename)
+        print(f"Saved trigger snapshot of {len(snap.states)} distinct states to {filename}")
+
+    @pyqtSlot()
+    def restoreSnapshot(self):
+        startdir = os.path.expanduser("~/.dastard")
+        filename, _ = QFileDialog.getOpenFileName(
+            self, "Restore trigger snapshot", startdir, "Trigger snapshots (*.json);;All Files (*)")
+        if not filename:
+            return
+        try:
+            snap = trigger_snapshot.TriggerSnapshot.load(filename)
+        except (OSError, ValueError, KeyError) as e:
+            QtWidgets.QMessageBox.warning(self, "Trigger snapshot", f"Could not read {filename}:\n{e}")
+            return
+        self.applySnapshot(snap)
+
+    def applySnapshot(self, snap):
+        """Send the trigger states and couplings of a TriggerSnapshot, with as few requests as possible.
+
+        Returns the number of requests sent."""
+        desired, missing = snap.desired(self.channels)
+        if len(missing) > 0:
+            print(f"Trigger snapshot has {len(missing)} channels not now known, such as {missing[0]}")
+        connections, dropped = snap.desiredGroupTriggers(self.channels)
+        if dropped > 0:
+            print(f"Trigger snapshot has {dropped} group trigger couplings to channels not now known; dropping them")
+        nrequests = self.sendTriggerStates(desired)
+        self.trigger_state.update(desired.groups(desired.known()))
+
+        if connections != self.groupTriggerConnections or snap.trigCoupling != self.trigCoupling:
+            dummy = True
+            self.client.call("SourceControl.StopTriggerCoupling", dummy)
+            nrequests += 1
+            if len(connections) > 0:
+                self.client.call("SourceControl.AddGroupTriggerCoupling", {"Connections": connections})
+                nrequests += 1
+            if snap.trigCoupling == 2:
+                self.client.call("SourceControl.CoupleFBToErr", True)
+                nrequests += 1
+            elif snap.trigCoupling == 3:
+                self.client.call("SourceControl.CoupleErrToFB", True)
+                nrequests += 1
+            # Until Dastard reports the new couplings, assume they took effect.
+            self.groupTriggerConnections = connections
+            self.trigCoupling = snap.trigCoupling
+        self.updateTriggerGUIElements()
+        print(f"Restored trigger snapshot from {snap.saved} with {nrequests} requests")
+        return nrequests
+
     @pyqtSlot()
     def checkedCoupleFBErr(self):
         on = self.coupleFBToErrCheckBox.isChecked()
@@ -424,6 +495,7 @@ class TriggerConfig(QtWidgets.QWidget):  # noqa: PLR0904
             errfb = True
         elif msg != 1:
             print(f"message: TRIGCOUPLING {msg}, but expect 1, 2 or 3")
+        self.trigCoupling = msg
         self.coupleFBToErrCheckBox.setChecked(fberr)
         self.coupleErrToFBCheckBox.setChecked(errfb)
 
@@ -489,7 +561,7 @@ class TriggerConfig(QtWidgets.QWidget):  # noqa: PLR0904
             # TODO: convert samples to ms
         try:
             edgeraw = int(float(edgeraw) / edgescale + 0.5)
-            newstate["EdgeLeveL"] = edgeraw
+            newstate["EdgeLevel"] = edgeraw
         except ValueError:
             pass
         self.setstates(newstate)
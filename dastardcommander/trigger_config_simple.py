@@ -1,12 +1,13 @@
 # Qt5 imports
 import PyQt5.uic
 from PyQt5 import QtWidgets
-from PyQt5.QtCore import QSettings
+from PyQt5.QtCore import QSettings, pyqtSlot
 
 # other non qt imports
 import os
 from enum import Enum
 import time
+import numpy as np
 from . import projectors
 
 """keep track of the state of sync between the GUI and dastard"""
@@ -214,33 +215,32 @@ class TriggerConfigSimple(QtWidgets.QWidget):
         If any channel numbers are blocked, but don't exist, we assume the channel numbering
         has changed. Therefore, delete the blocked list.
         """
-        signal_indices = self.dcom.channelIndicesSignalOnly()
+        channels = self.dcom.channels
+        signal_indices = channels.signalIndices
         if not exclude_blocked:
-            return signal_indices
-        sigset = set(signal_indices)
-        blocked_numbers = self.triggerBlocker.special
+            return signal_indices.tolist()
+        blocked_indices = channels.indices(channels.signalPrefix, self.triggerBlocker.special)
 
         # Check for blocked channels that are no longer valid channel numbers. If any are found,
         # reset the blocked index list. Fixes #159.
-        for n in blocked_numbers:
-            if n not in self.channel_indices:
-                print("**** WARNING:")
-                print(f"\tChannel {n} is in the list to be blocked but is not a valid channel number.")
-                print("\tThis is probably because the list of blocked channels is out of date.")
-                print("\tResetting the disabled-channel list.")
-                self.triggerBlocker.clear()
-                return signal_indices
-
-        blocked_indices = [self.channel_indices[n] for n in blocked_numbers]
-        enabled_indices = list(sigset - set(blocked_indices))
-        if len(enabled_indices) < len(sigset):
-            print(f"{len(enabled_indices)}/{len(sigset)} channels enabled and "
-                  f"{len(sigset) - len(enabled_indices)} disabled: {blocked_indices}")
+        if (blocked_indices < 0).any():
+            n = self.triggerBlocker.special[int(np.argmax(blocked_indices < 0))]
+            print("**** WARNING:")
+            print(f"\tChannel {n} is in the list to be blocked but is not a valid channel number.")
+            print("\tThis is probably because the list of blocked channels is out of date.")
+            print("\tResetting the disabled-channel list.")
+            self.triggerBlocker.clear()
+            return signal_indices.tolist()
+
+        enabled_indices = signal_indices[~np.isin(signal_indices, blocked_indices)]
+        nsig, nenabled = len(signal_indices), len(enabled_indices)
+        if nenabled < nsig:
+            print(f"{nenabled}/{nsig} channels enabled and "
+                  f"{nsig - nenabled} disabled: {blocked_indices.tolist()}")
         else:
-            print(f"All {len(enabled_indices)} channels are enabled.")
-            print("The disabled list is: ", blocked_indices)
-        enabled_indices.sort()
-        return enabled_indices
+            print(f"All {nenabled} channels are enabled.")
+            print("The disabled list is: ", blocked_indices.tolist())
+        return np.sort(enabled_indices).tolist()
 
     def handleTriggerMessage(self, d):
         """If DASTARD indicates the trigger state has changed, change the UI to say so."""
@@ -267,12 +267,18 @@ class TriggerConfigSimple(QtWidgets.QWidget):
             self.lineEdit_projectors.setText(fileName)
 
     def handleSendProjectors(self):
+        """Start sending the projectors file; returns the ProjectorUploadDialog running the upload."""
         fileName = self.lineEdit_projectors.text()
-        success = projectors.sendProjectors(
-            self, fileName, self.dcom.channel_names, self.client
+        dialog = projectors.sendProjectors(
+            self, fileName, self.dcom.channels, self.dcom.host, self.dcom.port, self.dcom.projectorDigests
         )
+        dialog.reportReady.connect(self.projectorsSent)
+        return dialog
+
+    @pyqtSlot(object)
+    def projectorsSent(self, report):
+        success = report.success()
         print(f"sendprojectors success success = {success}")
         if success:
-            self.settings.setValue("projectors_file", self.lineEdit_projectors.text())
+            self.settings.setValue("projectors_file", report.fileName)
             self.setProjectorSync(True)
-        return success
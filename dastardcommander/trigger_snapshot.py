@@ -0,0 +1,144 @@
+"""
+trigger_snapshot.py
+
+Save and restore a whole trigger configuration: every channel's trigger state plus the trigger
+couplings (group triggers and FB/error coupling). Nothing here depends on Qt.
+
+A snapshot file is JSON. Each distinct trigger state is written once, in a table, and each
+channel refers to its state by position in that table, so a 4000-channel configuration with
+a few distinct states takes a few kilobytes:
+
+    {"version": 1,
+     "saved": "2024-05-01T10:00:00",
+     "channelNames": ["err1", "chan1", ...],
+     "states": [{...fields...}, ...],
+     "stateOfChannel": [0, 1, 0, 1, ...],         (-1 for channels with no known state)
+     "groupTriggers": [[source, [receivers...]], ...],
+     "trigCoupling": 1}                            (as in the TRIGCOUPLING message)
+
+Group trigger sources and receivers are channel indices at the time of saving. Channels (both
+their states and their couplings) are matched by name when restoring, so a snapshot still
+applies if the channel order changes between Dastard runs.
+
+Usage:
+    snap = TriggerSnapshot.capture(server_store, channel_names, connections, coupling)
+    snap.save("pulses.json")
+    snap = TriggerSnapshot.load("pulses.json")
+    desired, missing = snap.desired(registry)
+    connections, dropped = snap.desiredGroupTriggers(registry)
+"""
+
+import json
+import time
+
+import numpy as np
+
+from . import trigger_states
+
+SNAPSHOT_VERSION = 1
+
+
+class TriggerSnapshot:
+    """One saved trigger configuration (see the module docstring).
+
+    >>> store = trigger_states.TriggerStateStore()
+    >>> store.update([{"ChannelIndices": [1, 3], "EdgeTrigger": True, "EdgeLevel": 100}])
+    >>> snap = TriggerSnapshot.capture(store, ["err1", "chan1", "err2", "chan2"], {3: [1]}, 1)
+    >>> snap.stateOfChannel, snap.groupTriggers
+    ([-1, 0, -1, 0], {3: [1]})
+    >>> from .channel_registry import ChannelRegistry
+    >>> desired, missing = snap.desired(ChannelRegistry(["chan2", "chan1", "chan3"]))
+    >>> desired.known().tolist(), desired[0]["EdgeLevel"], missing
+    ([0, 1], 100, [])
+    >>> snap.desiredGroupTriggers(ChannelRegistry(["chan2", "chan1", "chan3"]))
+    ({0: [1]}, 0)
+    >>> snap.desiredGroupTriggers(ChannelRegistry(["chan2", "chan3"]))
+    ({}, 1)
+    """
+
+    def __init__(self, channelNames, states, stateOfChannel, groupTriggers=None, trigCoupling=1):
+        self.channelNames = list(channelNames)
+        self.states = list(states)
+        self.stateOfChannel = list(stateOfChannel)
+        self.groupTriggers = {} if groupTriggers is None else dict(groupTriggers)
+        self.trigCoupling = trigCoupling
+        self.saved = time.strftime("%Y-%m-%dT%H:%M:%S")
+
+    @classmethod
+    def capture(cls, store, channelNames, groupTriggers=None, trigCoupling=1):
+        """Capture the states in TriggerStateStore `store` for channels `channelNames`, plus couplings."""
+        sids = store._lookup(np.arange(len(channelNames)))
+        used = np.unique(sids[sids >= 0])
+        position = {sid: i for i, sid in enumerate(used.tolist())}
+        states = [store.states[sid] for sid in used.tolist()]
+        stateOfChannel = [position.get(sid, -1) for sid in sids.tolist()]
+        connections = {int(src): sorted(int(r) for r in rx) for src, rx in (groupTriggers or {}).items()}
+        return cls(channelNames, states, stateOfChannel, connections, trigCoupling)
+
+    def save(self, filename):
+        obj = {
+            "version": SNAPSHOT_VERSION,
+            "saved": self.saved,
+            "channelNames": self.channelNames,
+            "states": self.states,
+            "stateOfChannel": self.stateOfChannel,
+            "groupTriggers": [[src, rx] for src, rx in sorted(self.groupTriggers.items())],
+            "trigCoupling": self.trigCoupling,
+        }
+        with open(filename, "w", encoding="ascii") as fp:
+            json.dump(obj, fp)
+            fp.write("\n")  # ensure \n at EOF
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, "r", encoding="ascii") as fp:
+            obj = json.load(fp)
+        version = obj.get("version")
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f"{filename} is trigger snapshot version {version}, expected {SNAPSHOT_VERSION}")
+        groupTriggers = {int(src): rx for src, rx in obj.get("groupTriggers", [])}
+        snap = cls(obj["channelNames"], obj["states"], obj["stateOfChannel"], groupTriggers,
+                   obj.get("trigCoupling", 1))
+        snap.saved = obj.get("saved", "")
+        return snap
+
+    def desired(self, registry):
+        """Return (store, missing): the snapshot's states as a TriggerStateStore indexed by the
+        channel indices in ChannelRegistry `registry`, and the names of saved channels it lacks."""
+        store = trigger_states.TriggerStateStore()
+        indices = np.array([registry.index.get(name, -1) for name in self.channelNames], dtype=np.int64)
+        stateOfChannel = np.asarray(self.stateOfChannel, dtype=np.int64)
+        lost = (indices < 0) & (stateOfChannel >= 0)
+        missing = [self.channelNames[i] for i in np.nonzero(lost)[0]]
+        for i, fields in enumerate(self.states):
+            use = (stateOfChannel == i) & (indices >= 0)
+            store.assign(indices[use], fields)
+        return store, missing
+
+    def desiredGroupTriggers(self, registry):
+        """Return (connections, dropped): the snapshot's group trigger couplings with sources and
+        receivers remapped to the channel indices in ChannelRegistry `registry`, and how many
+        saved couplings were dropped because their source or receiver is not in `registry`."""
+        def newIndex(i):
+            if 0 <= i < len(self.channelNames):
+                return registry.index.get(self.channelNames[i], -1)
+            return -1
+
+        connections = {}
+        dropped = 0
+        for src, rx in self.groupTriggers.items():
+            newSrc = newIndex(src)
+            newRx = [newIndex(r) for r in rx]
+            if newSrc < 0:
+                dropped += len(rx)
+                continue
+            kept = sorted(r for r in newRx if r >= 0)
+            dropped += len(newRx) - len(kept)
+            if len(kept) > 0:
+                connections[newSrc] = kept
+        return connections, dropped
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
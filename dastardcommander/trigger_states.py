@@ -0,0 +1,338 @@
+"""
+trigger_states.py
+
+An indexed store of per-channel trigger states, as reported in Dastard's TRIGGER messages and
+edited in the Triggering tab. Nothing here depends on Qt.
+
+A trigger state is a dict of ConfigureTriggers fields (AutoTrigger, EdgeLevel, ...) without
+its "ChannelIndices". Even on arrays of thousands of channels there are usually only a few
+distinct states, so each distinct state is stored once, under an integer id found from a
+hashable canonical form of its fields. Each channel's state id is kept in one numpy array, and
+each state id keeps the set of channels that use it. Finding the states used by a selection of
+channels, or whether a field is common to all of them, costs one `np.unique` over the selection
+instead of comparing dicts channel by channel.
+
+Usage:
+    store = TriggerStateStore()
+    store.update(msg)                                # a TRIGGER message (list of dicts)
+    store.field(chosen, "EdgeTrigger")               # common value or None
+    store.update_fields(chosen, {"EdgeLevel": 100})
+    for state in store.groups(chosen):               # one ConfigureTriggers request per state
+        client.call("SourceControl.ConfigureTriggers", state)
+
+To send only what the server lacks, keep a second store of the server's state (from its TRIGGER
+messages) and send the requests from `diff_requests(server, desired, chosen)`.
+
+A ConfigureTriggers request replaces the whole trigger state of its channels: any field it
+omits is set to zero (False, 0, ...). So states are compared in `normalized` form, with zero
+fields dropped, and each request carries a complete state. Channels that need the same new
+state share one request. Run this module with --benchmark to compare the RPCs needed with
+and without diffing on a large array.
+"""
+
+import json
+import time
+
+import numpy as np
+
+
+def canonical(value):
+    """Return a hashable form of a (possibly nested) trigger state value.
+
+    >>> canonical({"b": [1, 2], "a": {"y": 1, "x": 0}})
+    (('a', (('x', 0), ('y', 1))), ('b', (1, 2)))
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((k, canonical(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(canonical(v) for v in value)
+    return value
+
+
+def normalized(fields):
+    """Return `fields` without "ChannelIndices" or zero values (which Dastard assumes when omitted).
+
+    >>> normalized({"ChannelIndices": [3], "EdgeTrigger": False, "EdgeLevel": 10, "EMTState": {"EdgeMulti": False}})
+    {'EdgeLevel': 10}
+    """
+    result = {}
+    for k, v in fields.items():
+        if k == "ChannelIndices":
+            continue
+        value = normalized(v) if isinstance(v, dict) else v
+        if value:
+            result[k] = value
+    return result
+
+
+class TriggerStateStore:
+    """Per-channel trigger states, each distinct state stored once (see the module docstring).
+
+    >>> s = TriggerStateStore()
+    >>> s.update([{"ChannelIndices": [0, 1, 2, 3], "EdgeTrigger": True, "EdgeLevel": 100}])
+    >>> s.nstates, s.field([1, 2], "EdgeLevel")
+    (1, 100)
+    >>> s.update_fields([2, 3], {"EdgeLevel": 50})
+    >>> s.nstates, s.field([1, 2], "EdgeLevel"), s.field([1, 2], "EdgeTrigger")
+    (2, None, True)
+    >>> [g["ChannelIndices"] for g in s.groups([1, 2, 3])]
+    [[1], [2, 3]]
+    >>> s[3]["ChannelIndices"], s[3]["EdgeLevel"]
+    ([2, 3], 50)
+    >>> s.update_fields([0, 1], {"EdgeLevel": 50})
+    >>> s.nstates, s.groups([0])[0]["ChannelIndices"]
+    (1, [0])
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.states = {}  # state id -> dict of fields (no "ChannelIndices")
+        self.members = {}  # state id -> set of channel indices
+        self.ids = {}  # canonical(fields) -> state id
+        self.nextID = 0
+        self.chanState = np.zeros(0, dtype=np.int64)  # channel index -> state id, or -1
+
+    @property
+    def nstates(self):
+        return len(self.states)
+
+    def _intern(self, fields):
+        """Return the id of the state with these fields, adding it if it is new."""
+        fields = {k: v for k, v in fields.items() if k != "ChannelIndices"}
+        key = canonical(fields)
+        sid = self.ids.get(key)
+        if sid is None:
+            sid = self.nextID
+            self.nextID += 1
+            self.ids[key] = sid
+            self.states[sid] = fields
+            self.members[sid] = set()
+        return sid
+
+    def _grow(self, n):
+        if n > len(self.chanState):
+            old = self.chanState
+            self.chanState = np.full(max(n, 2 * len(old)), -1, dtype=np.int64)
+            self.chanState[:len(old)] = old
+
+    def _lookup(self, channels):
+        """Return the state id of each of `channels` (-1 for channels with no known state)."""
+        channels = np.asarray(channels, dtype=np.int64)
+        sids = np.full(len(channels), -1, dtype=np.int64)
+        ok = (channels >= 0) & (channels < len(self.chanState))
+        sids[ok] = self.chanState[channels[ok]]
+        return sids
+
+    def assign(self, channels, fields):
+        """Set the state of every channel in `channels` to `fields`."""
+        channels = np.unique(np.asarray(channels, dtype=np.int64))
+        if len(channels) == 0:
+            return
+        sid = self._intern(fields)
+        self._grow(channels[-1] + 1)
+        old = self.chanState[channels]
+        self.chanState[channels] = sid
+        chanlist = channels.tolist()
+        for oldsid in np.unique(old).tolist():
+            if oldsid < 0 or oldsid == sid:
+                continue
+            m = self.members[oldsid]
+            m.difference_update(c for c, o in zip(chanlist, old.tolist()) if o == oldsid)
+            if len(m) == 0:
+                self._forget(oldsid)
+        self.members[sid].update(chanlist)
+
+    def _forget(self, sid):
+        del self.ids[canonical(self.states[sid])]
+        del self.states[sid]
+        del self.members[sid]
+
+    def update(self, dicts):
+        """Store the states in a TRIGGER message: a list of dicts, each with its "ChannelIndices"."""
+        for d in dicts:
+            self.assign(d["ChannelIndices"], d)
+
+    def known(self):
+        """Return a sorted array of all channels with a known state."""
+        return np.nonzero(self.chanState >= 0)[0]
+
+    def __contains__(self, channel):
+        return self._lookup([channel])[0] >= 0
+
+    def __getitem__(self, channel):
+        """Return a copy of the state of `channel`, with "ChannelIndices" listing all channels sharing it."""
+        sid = int(self._lookup([channel])[0])
+        if sid < 0:
+            raise KeyError(channel)
+        d = dict(self.states[sid])
+        d["ChannelIndices"] = sorted(self.members[sid])
+        return d
+
+    def field(self, channels, name):
+        """Return the value of field `name` if it is the same for all `channels`, else None.
+
+        None is also returned if `channels` is empty or any of them has no known state.
+        """
+        sids = np.unique(self._lookup(channels))
+        if len(sids) == 0 or sids[0] < 0:
+            return None
+        sids = sids.tolist()
+        x = self.states[sids[0]].get(name, None)
+        if x is None:
+            return None
+        for sid in sids[1:]:
+            if self.states[sid].get(name, None) != x:
+                return None
+        return x
+
+    def groups(self, channels):
+        """Return one state dict per distinct state among `channels` (those with any known state).
+
+        Each dict's "ChannelIndices" lists only the members of `channels` that have that state,
+        so it is a complete ConfigureTriggers request for exactly those channels.
+        """
+        channels = np.unique(np.asarray(channels, dtype=np.int64))
+        sids = self._lookup(channels)
+        order = np.argsort(sids, kind="stable")
+        sids, channels = sids[order], channels[order]
+        bounds = np.nonzero(np.diff(sids))[0] + 1
+        result = []
+        for s, chans in zip(np.split(sids, bounds), np.split(channels, bounds)):
+            if len(s) == 0 or s[0] < 0:
+                continue
+            d = dict(self.states[int(s[0])])
+            d["ChannelIndices"] = chans.tolist()
+            result.append(d)
+        return result
+
+    def update_fields(self, channels, newfields):
+        """Change the fields in `newfields` for all `channels` with a known state, keeping their other fields."""
+        for g in self.groups(channels):
+            chans = g.pop("ChannelIndices")
+            g.update(newfields)
+            self.assign(chans, g)
+
+
+def diff_requests(current, desired, channels=None):
+    """Return the fewest ConfigureTriggers requests that take `channels` from state `current` to `desired`.
+
+    `current` and `desired` are TriggerStateStores; `channels` defaults to every channel with a
+    desired state. Channels whose desired state already matches (in normalized form) are
+    skipped, those with no known current state are always included, and channels needing the
+    same state are merged into one request.
+
+    >>> server, desired = TriggerStateStore(), TriggerStateStore()
+    >>> server.update([{"ChannelIndices": list(range(6)), "EdgeTrigger": True, "EdgeLevel": 100}])
+    >>> desired.update([{"ChannelIndices": list(range(8)), "EdgeTrigger": True, "EdgeLevel": 100}])
+    >>> desired.update_fields([1, 2, 3], {"EdgeLevel": 50})
+    >>> desired.update_fields([0], {"AutoTrigger": False})
+    >>> [(r["ChannelIndices"], r["EdgeLevel"]) for r in diff_requests(server, desired)]
+    [([6, 7], 100), ([1, 2, 3], 50)]
+    """
+    if channels is None:
+        channels = desired.known()
+    channels = np.unique(np.asarray(channels, dtype=np.int64))
+    dsid = desired._lookup(channels)
+    keep = dsid >= 0
+    channels, dsid = channels[keep], dsid[keep]
+    if len(channels) == 0:
+        return []
+    ssid = current._lookup(channels)
+
+    # Number the distinct normalized states, then compare channel by channel as integers.
+    keys = {}
+
+    def keynumbers(store, sids):
+        unique, inverse = np.unique(sids, return_inverse=True)
+        numbers = []
+        for sid in unique.tolist():
+            if sid < 0:
+                numbers.append(-1)
+            else:
+                numbers.append(keys.setdefault(canonical(normalized(store.states[sid])), len(keys)))
+        return np.array(numbers, dtype=np.int64)[inverse.ravel()]
+
+    dkey = keynumbers(desired, dsid)
+    skey = keynumbers(current, ssid)
+    changed = dkey != skey
+    requests = []
+    for k in np.unique(dkey[changed]).tolist():
+        use = changed & (dkey == k)
+        request = dict(desired.states[int(dsid[np.argmax(use)])])
+        request["ChannelIndices"] = channels[use].tolist()
+        requests.append(request)
+    return requests
+
+
+def benchmark(nchan=8192, latency=1e-3):
+    """Compare ConfigureTriggers RPCs with and without diffing, for common operations on a TDM
+    array of `nchan` channels (half signal, half error). Wall time assumes `latency` seconds per RPC.
+
+    An operation is a series of edits, each sent as soon as it is made (as the Triggering tab's
+    mode buttons do). Without diffing, each edit sends every distinct state among the chosen
+    channels; with it, only `diff_requests` against the server's state, updated after each send.
+    """
+    signal = np.arange(1, nchan, 2)
+    allchan = np.arange(nchan)
+    edge = {"EdgeTrigger": True, "EdgeRising": True, "EdgeLevel": 100, "AutoTrigger": False,
+            "AutoDelay": 0, "LevelTrigger": False, "LevelLevel": 0, "EdgeMulti": False}
+
+    def uniform():
+        store = TriggerStateStore()
+        store.assign(signal, edge)
+        store.assign(np.arange(0, nchan, 2), {})
+        return store
+
+    def perchannel_levels():
+        store = uniform()
+        for i, c in enumerate(signal.tolist()):
+            store.assign([c], dict(edge, LevelTrigger=True, LevelLevel=1000 + i))
+        return store
+
+    pulse_mode = ({"AutoTrigger": False}, {"EdgeTrigger": True}, {"LevelTrigger": False})
+    cases = (
+        ("Edge level, all signal channels", uniform, signal, ({"EdgeLevel": 50},)),
+        ("Re-apply unchanged edge level", uniform, signal, ({"EdgeLevel": 100},)),
+        ("Block 1 channel", uniform, [5], ({"EdgeTrigger": False},)),
+        ("Pulse mode, all channels", uniform, allchan, pulse_mode),
+        ("Auto on, per-channel levels", perchannel_levels, signal, ({"AutoTrigger": True},)),
+        ("Pulse mode, per-channel levels", perchannel_levels, signal, pulse_mode),
+    )
+    print(f"{nchan} channels, {latency * 1e3:.1f} ms per RPC")
+    print(f"{'operation':32s} {'RPCs':>6s} {'diffed':>7s} {'kbytes':>8s} {'diffed':>7s} {'wall s':>7s} {'diffed':>7s}")
+    for name, initial, chosen, edits in cases:
+        server = initial()
+        desired = copy_store(server)
+        nrpc, nbytes, elapsed = [0, 0], [0.0, 0.0], 0.0
+        for fields in edits:
+            desired.update_fields(chosen, fields)
+            allstates = desired.groups(chosen)
+            t0 = time.perf_counter()
+            requests = diff_requests(server, desired, chosen)
+            server.update(requests)
+            elapsed += time.perf_counter() - t0
+            for i, reqs in enumerate((allstates, requests)):
+                nrpc[i] += len(reqs)
+                nbytes[i] += sum(len(json.dumps(r)) for r in reqs) / 1e3
+        wall = (nrpc[0] * latency, elapsed + nrpc[1] * latency)
+        print(f"{name:32s} {nrpc[0]:6d} {nrpc[1]:7d} {nbytes[0]:8.1f} {nbytes[1]:7.1f} "
+              f"{wall[0]:7.3f} {wall[1]:7.3f}")
+
+
+def copy_store(store):
+    "Return an independent copy of a TriggerStateStore."
+    result = TriggerStateStore()
+    for sid, chans in store.members.items():
+        result.assign(sorted(chans), store.states[sid])
+    return result
+
+
+if __name__ == "__main__":
+    import sys
+    if "--benchmark" in sys.argv:
+        benchmark()
+    else:
+        import doctest
+        doctest.testmod()
@@ -250,8 +250,11 @@ class Workflow(QtWidgets.QWidget):
             em.showMessage(f"{self.projectorsFilename} does not exist")
             return
         self.dc.triggerTabSimple.lineEdit_projectors.setText(self.projectorsFilename)
-        success = self.dc.triggerTabSimple.handleSendProjectors()
-        if success:
+        dialog = self.dc.triggerTabSimple.handleSendProjectors()
+        dialog.reportReady.connect(self.projectorsSent)
+
+    def projectorsSent(self, report):
+        if report.success():
             self.label_loadedProjectors.setText("projectors loaded? yes")
             self.projectorsLoadedSig.emit(True)
 